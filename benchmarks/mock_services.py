@@ -0,0 +1,99 @@
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from providers import FakeProvider
+
+# Local stand-ins for the remote services used by the benchmarks:
+# a provider whose outputs live on a local HTTP server, and that server.
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def payload_bytes(name, size):
+    """Deterministic pseudo-random image payload of size bytes for an output name"""
+    seed = int.from_bytes(hashlib.sha256(name.encode('utf-8')).digest()[:8], "big")
+    body = random.Random(seed).randbytes(max(0, size - len(PNG_SIGNATURE)))
+    return PNG_SIGNATURE + body
+
+
+class _PayloadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled sessions reuse connections
+
+    def do_GET(self):
+        server = self.server
+        if not self.path.startswith("/images/"):
+            self.send_error(404)
+            return
+        if server.delay:
+            time.sleep(server.delay)
+        body = payload_bytes(self.path, server.payload_size)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.requests += 1
+            server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class PayloadServer(ThreadingHTTPServer):
+    """
+    HTTP server standing in for the provider's CDN.
+    GET /images/<name> returns payload_size bytes that depend only on the name,
+    after waiting delay seconds. Counts requests and body bytes sent.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, payload_size=256 * 1024, delay=0.0, host="127.0.0.1", port=0):
+        super().__init__((host, port), _PayloadHandler)
+        self.payload_size = payload_size
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes_sent = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def start(self):
+        """Serve from a background thread and return self"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class BenchmarkProvider(FakeProvider):
+    """
+    FakeProvider whose outputs are served by a PayloadServer.
+    :param base_url: PayloadServer.base_url
+    :param distribution: "uniform" (latency +/- jitter) or "lognormal" (median latency, shape sigma)
+    :param sigma: Shape of the lognormal distribution; larger means a longer tail
+    """
+
+    def __init__(self, base_url, distribution="uniform", sigma=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+        self.distribution = distribution
+        self.sigma = sigma
+
+    def _duration(self):
+        if self.distribution == "lognormal":
+            return self.random.lognormvariate(math.log(max(self.latency, 1e-6)), self.sigma)
+        return super()._duration()
+
+    def _output_url(self, key):
+        return f"{self.base_url}/images/{hashlib.sha256(key).hexdigest()[:32]}.png"
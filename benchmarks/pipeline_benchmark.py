@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# End-to-end benchmark of the generate -> download -> save -> log path.
+#
+# Every generator runs through jobs.run_job against BenchmarkProvider (an
+# in-process fake provider) whose outputs are fetched from a local
+# PayloadServer, so results are reproducible and need no network access or
+# API keys. Each (generator, concurrency) scenario runs in a fresh process
+# inside a temporary working directory, which keeps peak RSS and the caches
+# of one scenario from leaking into the next.
+#
+#   python benchmarks/pipeline_benchmark.py --concurrency 1 4 16 --requests 64
+#   python benchmarks/pipeline_benchmark.py --generators flux logo --distribution lognormal --payload-kb 2048
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_services import PayloadServer  # noqa: E402
+
+GENERATORS = ["flux", "photomaker", "face-to-many", "sticker", "logo"]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unavailable"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, max(0, int(round(q / 100 * (len(samples) - 1)))))]
+
+
+def _job_params(generator, i, input_image, input_folder):
+    """Parameters of the i-th benchmark job; seeds differ so no request is a cache hit"""
+    if generator == "flux":
+        return {"prompt": f"benchmark image {i}", "seed": i}
+    if generator == "photomaker":
+        return {"folder": input_folder, "seed": i}
+    if generator == "face-to-many":
+        return {"image": input_image, "seed": i}
+    if generator == "sticker":
+        return {"image": input_image, "prompt": f"benchmark sticker {i}"}
+    return {"prompt": f"benchmark logo {i}", "seed": i, "num_variations": 2}
+
+
+def run_scenario(config):
+    """Run one generator at one concurrency level and return its measurements (runs in a child process)"""
+    os.chdir(config["workdir"])
+    os.environ.update({
+        "IMAGEGEN_PROVIDER": "fake",
+        "IMAGEGEN_UPLOADS": "fake",
+        "IMAGEGEN_METRICS_FILE": os.path.join(config["workdir"], "metrics.prom"),
+    })
+    if not config["cache"]:
+        os.environ["IMAGEGEN_NO_CACHE"] = "1"
+
+    import metrics
+    from jobs import run_job
+    from concurrency import run_bounded
+    from providers import register_provider, _fake_png
+    from mock_services import BenchmarkProvider
+
+    register_provider("fake", BenchmarkProvider(
+        config["base_url"],
+        distribution=config["distribution"],
+        sigma=config["sigma"],
+        latency=config["latency"],
+        jitter=config["jitter"],
+        failure_rate=config["failure_rate"],
+        queue_time=config["queue_time"],
+        seed=0,
+    ))
+
+    input_folder = os.path.join(config["workdir"], "inputs")
+    os.makedirs(input_folder, exist_ok=True)
+    input_image = os.path.join(input_folder, "face.png")
+    with open(input_image, "wb") as f:
+        f.write(_fake_png(b"benchmark input", size=config["input_size"]))
+
+    generator = config["generator"]
+    latencies = []
+    errors = []
+
+    def timed_job(i):
+        start = time.perf_counter()
+        run_job(generator, _job_params(generator, i, input_image, input_folder))
+        return time.perf_counter() - start
+
+    output = sys.stdout if config["verbose"] else open(os.devnull, "w")
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        for _, elapsed, error in run_bounded(timed_job, range(config["requests"]), config["concurrency"]):
+            if error is None:
+                latencies.append(elapsed)
+            else:
+                errors.append(str(error))
+    wall = time.perf_counter() - started
+
+    return {
+        "generator": generator,
+        "concurrency": config["concurrency"],
+        "requests": config["requests"],
+        "succeeded": len(latencies),
+        "failed": len(errors),
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "download_p50": metrics.percentile("download", 50),
+        "peak_rss_mb": peak_rss_mb(),
+        "bytes_downloaded": metrics.counter_total("imagegen_download_bytes_total"),
+        "bytes_uploaded": metrics.counter_total("imagegen_upload_bytes_total"),
+        "first_error": errors[0] if errors else None,
+    }
+
+
+def _ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_table(results):
+    header = f"{'generator':<13}{'conc':>5}{'ok':>6}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}" \
+             f"{'dl p50':>8}{'RSS MB':>8}{'down MB':>9}{'up MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.0f}"
+        print(f"{r['generator']:<13}{r['concurrency']:>5}{r['succeeded']:>6}{r['throughput']:>9.2f}"
+              f"{_ms(r['p50']):>9}{_ms(r['p99']):>9}{_ms(r['download_p50']):>8}{rss:>8}"
+              f"{r['wire_bytes_down'] / 1e6:>9.2f}{r['bytes_uploaded'] / 1e6:>7.2f}")
+        if r["first_error"]:
+            print(f"  first error: {r['first_error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against local mock services.")
+    parser.add_argument("--generators", nargs="+", choices=GENERATORS, default=GENERATORS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Jobs per scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean (uniform) or median (lognormal) inference seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Uniform latency spread in seconds")
+    parser.add_argument("--distribution", choices=["uniform", "lognormal"], default="uniform")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Lognormal shape; larger means a longer tail")
+    parser.add_argument("--queue-time", type=float, default=0.0, help="Seconds each job reports as queued")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--payload-kb", type=int, default=256, help="Size of each output image")
+    parser.add_argument("--server-delay", type=float, default=0.0, help="Seconds before the file server answers")
+    parser.add_argument("--input-size", type=int, default=512, help="Side in pixels of the input face image")
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache enabled")
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Show the generators' own output")
+    args = parser.parse_args(argv)
+
+    server = PayloadServer(payload_size=args.payload_kb * 1024, delay=args.server_delay).start()
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for generator in args.generators:
+            for concurrency in args.concurrency:
+                server.reset_counters()
+                with tempfile.TemporaryDirectory(prefix="imagegen-bench-") as workdir:
+                    config = dict(vars(args), generator=generator, concurrency=concurrency,
+                                  workdir=workdir, base_url=server.base_url)
+                    # Not a multiprocessing.Pool: its workers are daemonic and can't start process pools of their own
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                        result = executor.submit(run_scenario, config).result()
+                result["wire_bytes_down"] = server.bytes_sent
+                result["wire_requests"] = server.requests
+                results.append(result)
+                print(f"{generator} x{concurrency}: {result['throughput']:.2f} req/s", file=sys.stderr)
+    finally:
+        server.shutdown()
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# Startup budget check for the CLI and the generator modules.
+#
+# Imports each module in a fresh interpreter with `-X importtime` and fails when
+#   - a provider SDK or other heavy dependency is imported at module level, or
+#   - the module's cumulative import time is over the budget.
+# It also times `imagegen.py --help` against a bare interpreter start.
+# Exits with status 1 on any regression, so it can run in CI or a pre-commit hook:
+#
+#   python benchmarks/startup_check.py --budget-ms 100
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "imagegen", "jobs", "sweep", "job_queue",
+    "flux_image_generator", "photo_maker", "face-to-many", "image_to_sticker", "logo_generator",
+]
+
+# Only loaded once a generation, upload or service actually needs them
+LAZY_MODULES = [
+    "requests", "urllib3", "dotenv", "fal_client", "replicate", "httpx",
+    "PIL", "numpy", "starlette", "uvicorn", "yaml", "multiprocessing",
+]
+
+
+def import_profile(module):
+    """Import module in a fresh interpreter; return ({imported module: cumulative us}, target cumulative us)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"__import__({module!r})"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imported[name.strip()] = int(cumulative)
+    return imported, imported.get(module, 0)
+
+
+def best_wall_time(command, runs):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=REPO_ROOT, capture_output=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that imports stay lazy and startup stays within budget.")
+    parser.add_argument("--budget-ms", type=float, default=100.0, help="Max cumulative import time per module")
+    parser.add_argument("--help-budget-ms", type=float, default=100.0,
+                        help="Max time of 'imagegen.py --help' beyond a bare interpreter start")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per wall-clock measurement (best is kept)")
+    args = parser.parse_args(argv)
+
+    problems = []
+    print(f"{'module':<22}{'import ms':>10}  eager heavy imports")
+    for module in MODULES:
+        try:
+            imported, total = import_profile(module)
+        except RuntimeError as e:
+            problems.append(str(e))
+            continue
+        eager = [name for name in LAZY_MODULES if name in imported]
+        print(f"{module:<22}{total / 1000:>10.1f}  {', '.join(eager) or '-'}")
+        if eager:
+            problems.append(f"{module} imports {', '.join(eager)} at import time")
+        if total / 1000 > args.budget_ms:
+            problems.append(f"{module} takes {total / 1000:.1f} ms to import (budget {args.budget_ms:.0f} ms)")
+
+    baseline = best_wall_time([sys.executable, "-c", "pass"], args.runs)
+    help_time = best_wall_time([sys.executable, "imagegen.py", "--help"], args.runs)
+    overhead_ms = (help_time - baseline) * 1000
+    print(f"\nimagegen.py --help: {help_time * 1000:.0f} ms ({overhead_ms:.0f} ms over a bare interpreter)")
+    if overhead_ms > args.help_budget_ms:
+        problems.append(f"imagegen.py --help takes {overhead_ms:.0f} ms over startup (budget {args.help_budget_ms:.0f} ms)")
+
+    if problems:
+        print("\nStartup budget exceeded:")
+        for problem in problems:
+            print(f"  - {problem}")
+        return 1
+    print("\nStartup budget OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import contextvars
+
+# Bounded fan-out helper shared by batch mode and multi-sample requests, and the
+# process pool factory for CPU-bound work handed off by saves (thumbnails,
+# storage re-encoding).
+
+
+def run_bounded(fn, items, max_workers=4):
+    """
+    Call fn(item) for every item with at most max_workers calls in flight.
+    Items are consumed lazily, so very large inputs are never loaded whole.
+    Yields (item, result, error) tuples as calls finish, in completion order;
+    a failing call yields its exception instead of stopping the others.
+    Each call runs in a copy of the caller's context (e.g. progress listeners).
+    """
+    # Imported here: concurrent.futures pulls in logging, which slows down startup
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        pending = {}
+
+        def submit_next():
+            for item in items:
+                context = contextvars.copy_context()
+                pending[executor.submit(context.run, fn, item)] = item
+                return True
+            return False
+
+        for _ in range(max(1, max_workers)):
+            if not submit_next():
+                break
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
+                submit_next()
+
+
+def background_pool(workers):
+    """
+    Start a spawn process pool that is shut down (after finishing its queued work)
+    when the process exits, including processes started by multiprocessing.
+    """
+    import atexit
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing.util import Finalize
+
+    # spawn: work is handed off from download threads, and forking a threaded process can deadlock
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    atexit.register(executor.shutdown, wait=True)
+    # Processes started by multiprocessing (queue workers, the benchmark) skip atexit and
+    # would wait forever on the pool's workers when they exit. The high priority runs
+    # this before multiprocessing closes the pool's queues.
+    Finalize(None, executor.shutdown, kwargs={"wait": True}, exitpriority=100)
+    return executor
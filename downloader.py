@@ -0,0 +1,182 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+import metrics
+from storage_format import apply_storage_format
+
+# Shared image downloader used by every save_image function.
+# One pooled Session keeps TLS connections to the provider CDNs alive
+# between images, and responses are streamed to disk instead of buffered.
+# Files are named after what the server actually sent (magic bytes first,
+# then Content-Type), not after what the caller expected.
+
+DEFAULT_TIMEOUT = (10, 120)  # (connect, read) seconds
+CHUNK_SIZE = 256 * 1024
+POOL_SIZE = 16
+HASH_NAME_LENGTH = 32  # hex characters of the SHA-256 used in output file names
+SNIFF_BYTES = 64  # enough for an ISO BMFF ftyp box and its compatible brands
+
+CONTENT_TYPES = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/avif": ".avif",
+    "image/heic": ".heic",
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide pooled requests Session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # requests is imported on first download so commands that never download start faster
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def detect_extension(head, content_type=None, default=None):
+    """
+    File extension for an image from its first bytes, falling back to its
+    Content-Type header and then to default.
+    """
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return ".gif"
+    if head[4:8] == b"ftyp":
+        brand = head[8:12]
+        if brand in (b"mif1", b"msf1"):
+            # Generic HEIF brand, used by AVIF files too: the compatible brands tell them apart
+            box_end = min(int.from_bytes(head[:4], "big"), len(head))
+            compatible = {head[i:i + 4] for i in range(16, box_end - 3, 4)}
+            brand = b"avif" if compatible & {b"avif", b"avis"} else b"heic"
+        if brand in (b"avif", b"avis"):
+            return ".avif"
+        if brand in (b"heic", b"heix"):
+            return ".heic"
+    if content_type:
+        extension = CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+        if extension:
+            return extension
+    return default
+
+
+def _write_chunks(chunks, folder):
+    """Write chunks to a temporary file in folder while hashing them; also returns the first bytes"""
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".download_", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    write_seconds = 0.0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                if chunk:
+                    start = time.perf_counter()
+                    f.write(chunk)
+                    write_seconds += time.perf_counter() - start
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if len(head) < SNIFF_BYTES:
+                        head += chunk[:SNIFF_BYTES - len(head)]
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    metrics.observe("disk_write", write_seconds)
+    metrics.increment("imagegen_download_bytes_total", size)
+    return tmp_path, digest.hexdigest(), size, head
+
+
+def _stream_to_temp(url, folder, timeout, chunk_size):
+    """
+    Stream url into a temporary file in folder while hashing it.
+    file:// URLs (used by the fake provider) are copied from disk.
+    Returns (tmp_path, sha256 hex digest, size, detected extension or None),
+    or None if the download failed.
+    """
+    url = str(url)
+    with metrics.span("download"):
+        return _fetch_to_temp(url, folder, timeout, chunk_size)
+
+
+def _fetch_to_temp(url, folder, timeout, chunk_size):
+    if url.startswith("file://"):
+        source = url[len("file://"):]
+        if not os.path.exists(source):
+            return None
+        with open(source, 'rb') as f:
+            tmp_path, digest, size, head = _write_chunks(iter(lambda: f.read(chunk_size), b""), folder)
+        return tmp_path, digest, size, detect_extension(head)
+
+    with get_session().get(url, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            return None
+        tmp_path, digest, size, head = _write_chunks(response.iter_content(chunk_size=chunk_size), folder)
+        return tmp_path, digest, size, detect_extension(head, response.headers.get("Content-Type"))
+
+
+def download_content_addressed(url, folder, extension, timeout=DEFAULT_TIMEOUT, chunk_size=CHUNK_SIZE):
+    """
+    Stream url into folder under a name derived from the SHA-256 of its content.
+    Identical content always maps to the same file, so concurrent saves never
+    overwrite each other and re-downloads are deduplicated.
+    :param extension: Used when the format can't be detected from the content or Content-Type
+    The file is then re-encoded if a storage format is configured (see storage_format.py).
+    Returns (filepath, sha256 hex digest, size), or None if the download failed.
+    """
+    url = str(url)
+    if url.startswith("file://"):
+        source = url[len("file://"):]
+        if os.path.isfile(source) and os.path.isdir(folder) and os.path.samefile(os.path.dirname(source), folder):
+            # Already saved here (a cache hit served from disk): nothing to copy
+            digest = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b""):
+                    digest.update(chunk)
+            return os.path.join(folder, os.path.basename(source)), digest.hexdigest(), os.path.getsize(source)
+
+    streamed = _stream_to_temp(url, folder, timeout, chunk_size)
+    if streamed is None:
+        return None
+    tmp_path, digest, size, detected = streamed
+    filepath = os.path.join(folder, f"{digest[:HASH_NAME_LENGTH]}{detected or extension}")
+    if os.path.exists(filepath):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, filepath)
+
+    return apply_storage_format(filepath), digest, size
+
+
+def save_all(urls, save_fn, max_workers=4):
+    """
+    Call save_fn(url) for every url in parallel and return the results in input order.
+    Used to download all the outputs of a multi-image result at once.
+    """
+    urls = list(urls)
+    if len(urls) <= 1:
+        return [save_fn(url) for url in urls]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        return list(executor.map(save_fn, urls))
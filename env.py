@@ -0,0 +1,20 @@
+import threading
+
+# Loads the .env file the first time provider credentials are needed instead of
+# at import time, so commands that never call a provider (--help, listings,
+# dry runs, the fake provider) don't pay for importing python-dotenv.
+
+_loaded = False
+_lock = threading.Lock()
+
+
+def load_env():
+    """Load variables from the .env file into os.environ once; variables already set win"""
+    global _loaded
+    if _loaded:
+        return
+    with _lock:
+        if not _loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _loaded = True
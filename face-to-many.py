@@ -1,21 +1,35 @@
-import replicate
 import os
-from dotenv import load_dotenv
 from datetime import datetime
-import requests
-import json
-from glob import glob
-import base64
+from env import load_env
+from downloader import download_content_addressed
+from output_index import new_request_id, record_output
+from thumbnails import schedule_thumbnails
+from log_store import append_log
+from result_cache import cached_run
+from predictions import run_prediction
+from uploads import image_reference
+from preprocess import prepare_input_image
 
-# Load environment variables from .env file
-load_dotenv()
+STYLES = [
+    "3D",
+    "Pixels",  # Changed from "Pixel"
+    "Clay",
+    "Video game",  # Changed from "Digital Art"
+    "Emoji",  # Changed from "Neon"
+    "Toy",    # Changed from "Anime"
+]
 
 def get_images_from_folder(folder_path):
     """Get list of images from the specified folder"""
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.webp']
-    images = []
-    for ext in image_extensions:
-        images.extend(glob(os.path.join(folder_path, ext)))
+    image_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+    if not os.path.isdir(folder_path):
+        return []
+    # One directory listing instead of a glob per extension
+    with os.scandir(folder_path) as entries:
+        images = [
+            entry.path for entry in entries
+            if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith(image_extensions)
+        ]
     return sorted(images)
 
 def select_image(images):
@@ -48,16 +62,20 @@ def generate_transformed_face(
     prompt_strength=4.5,
     denoising_strength=0.65,
     instant_id_strength=1.0,
-    control_depth_strength=0.8
+    control_depth_strength=0.8,
+    use_cache=True,
+    preprocess=True
 ):
     """
     Generate transformed face using Replicate API
     """
+    model = "fofr/face-to-many:a07f252abbbd832009640b27f063ea52d87d7a23a185ca165bec23b5adc8deaf"
     try:
-        # Read and encode the image
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
-            image_uri = f"data:image/jpeg;base64,{image_data}"
+        # Downscale to the model's working resolution, then upload once
+        # (or encode inline if uploading isn't possible)
+        if preprocess:
+            image_path = prepare_input_image(image_path, model)
+        image_uri = image_reference(image_path)
         
         # Build input parameters
         input_params = {
@@ -79,10 +97,7 @@ def generate_transformed_face(
         if negative_prompt:
             input_params["negative_prompt"] = negative_prompt
         
-        output = replicate.run(
-            "fofr/face-to-many:a07f252abbbd832009640b27f063ea52d87d7a23a185ca165bec23b5adc8deaf",
-            input=input_params
-        )
+        output = cached_run(model, input_params, lambda: run_prediction(model, input_params), use_cache)
         
         # Handle the output properly
         if isinstance(output, list):
@@ -98,17 +113,14 @@ def generate_transformed_face(
         print(f"Error generating transformed image: {e}")
         return None
 
-def save_image(url, folder, prefix="transformed"):
-    """Save an image from URL to the specified folder"""
+def save_image(url, folder, prefix="transformed", request_id=None):
+    """Save an image from URL to the specified folder, named after its content hash"""
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{prefix}_{timestamp}.png"
-            filepath = os.path.join(folder, filename)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
+        saved = download_content_addressed(url, folder, ".png")
+        if saved is not None:
+            filepath, digest, _ = saved
+            record_output(request_id, digest, filepath, url, prefix)
+            schedule_thumbnails(filepath)
             print(f"Image saved: {filepath}")
             return filepath
         else:
@@ -118,54 +130,17 @@ def save_image(url, folder, prefix="transformed"):
         print(f"Error saving image: {e}")
         return None
 
-def save_request_log(log_data, logs_folder="logs", log_file_name="face_transformation_log.json"):
-    """Save the request log to a single JSON file in the logs folder"""
-    os.makedirs(logs_folder, exist_ok=True)
-    log_file_path = os.path.join(logs_folder, log_file_name)
-
-    if isinstance(log_data.get('timestamp'), datetime):
-        log_data['timestamp'] = log_data['timestamp'].isoformat()
-    
-    def sanitize_for_json(obj):
-        if isinstance(obj, (datetime, bytes)):
-            return str(obj)
-        elif isinstance(obj, dict):
-            return {k: sanitize_for_json(v) for k, v in obj.items()}
-        elif isinstance(obj, (list, tuple)):
-            return [sanitize_for_json(item) for item in obj]
-        elif hasattr(obj, 'url'):  # Handle FileOutput objects
-            return obj.url
-        else:
-            return str(obj) if hasattr(obj, '__dict__') else obj
-
-    log_data = sanitize_for_json(log_data)
-
+def save_request_log(log_data, logs_folder="logs", log_file_name="face_transformation_log.jsonl"):
+    """Append the request log to a JSONL file in the logs folder"""
     try:
-        if os.path.exists(log_file_path):
-            with open(log_file_path, 'r') as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
-        
-        existing_data.append(log_data)
-        
-        with open(log_file_path, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        
+        log_file_path = append_log(log_data, log_file_name, logs_folder)
         print(f"Request log saved to {log_file_path}")
     except Exception as e:
         print(f"Error saving log: {e}")
 
 def get_style_choice():
     """Present a menu for transformation style selection"""
-    style_options = {
-        1: "3D",
-        2: "Pixels",  # Changed from "Pixel"
-        3: "Clay",
-        4: "Video game",  # Changed from "Digital Art"
-        5: "Emoji",  # Changed from "Neon"
-        6: "Toy",    # Changed from "Anime"
-    }
+    style_options = dict(enumerate(STYLES, 1))
     
     while True:
         print("\nChoose a transformation style:")
@@ -183,6 +158,9 @@ def get_style_choice():
             print("Invalid input. Please enter a number.")
 
 if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_env()
+
     # Check for API key
     replicate_api_key = os.getenv("REPLICATE_API_TOKEN")
     if not replicate_api_key:
@@ -262,13 +240,15 @@ if __name__ == "__main__":
 
     if output_url:
         # Save generated image
-        saved_path = save_image(output_url, output_folder)
+        request_id = new_request_id()
+        saved_path = save_image(output_url, output_folder, request_id=request_id)
         
         if saved_path:
             print(f"\nTransformed image saved successfully to: {saved_path}")
             
             # Prepare and save log data
             log_data = {
+                "request_id": request_id,
                 "timestamp": datetime.now(),
                 "input_image": selected_image,
                 "style": style,
@@ -1,25 +1,38 @@
-import fal_client
 import os
-from dotenv import load_dotenv
 from datetime import datetime
-import requests
+from env import load_env
+from downloader import download_content_addressed, save_all
+from output_index import new_request_id, record_output
+from thumbnails import schedule_thumbnails
 import json
-
-# Load environment variables from .env file
-load_dotenv()
-
-def generate_image(prompt, image_size="landscape_4_3", num_images=1, seed=None):
+from log_store import append_log
+from result_cache import cached_run
+from predictions import run_prediction
+import sys
+import argparse
+from concurrency import run_bounded
+
+IMAGE_SIZES = [
+    "square_hd",
+    "square",
+    "portrait_4_3",
+    "portrait_16_9",
+    "landscape_4_3",
+    "landscape_16_9"
+]
+
+def generate_image(prompt, image_size="landscape_4_3", num_images=1, seed=None, use_cache=True):
     """
     Generate images using fal.ai API
     :param prompt: The text prompt for image generation
     :param image_size: options: square_hd, square, portrait_4_3, portrait_16_9, landscape_4_3, landscape_16_9
     :param num_images: Number of images to generate
     :param seed: Random number. With the same seed and the same prompt the image is always the same
+    :param use_cache: Reuse a cached result for seeded requests instead of calling the API again
     """
     def on_queue_update(update):
-        if isinstance(update, fal_client.InProgress):
-            for log in update.logs:
-                print(log["message"])
+        for message in update["logs"]:
+            print(message)
 
     arguments = {
         "prompt": prompt,
@@ -30,64 +43,82 @@ def generate_image(prompt, image_size="landscape_4_3", num_images=1, seed=None):
         "seed": seed
     }
 
-    result = fal_client.subscribe(
-        "fal-ai/flux-pro/v1.1",
-        arguments=arguments,
-        with_logs=True,
-        on_queue_update=on_queue_update,
-    )
+    model = "fal-ai/flux-pro/v1.1"
+    result = cached_run(model, arguments, lambda: run_prediction(
+        model,
+        arguments,
+        on_update=on_queue_update,
+    ), use_cache)
     
     return result
 
-def save_image(url, folder):
-    """Save an image from URL to the specified folder"""
-    response = requests.get(url)
-    if response.status_code == 200:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"generated_image_{timestamp}.jpg"
-        filepath = os.path.join(folder, filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+def load_batch_jobs(job_file):
+    """
+    Read batch jobs from a file with one JSON object per line.
+    Each job needs a prompt and may set image_size, num_images and seed.
+    Blank lines and lines starting with '#' are ignored.
+    """
+    with open(job_file, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: invalid JSON ({e})")
+                continue
+            if not isinstance(job, dict) or not job.get("prompt"):
+                print(f"Skipping line {line_number}: job has no prompt")
+                continue
+            yield job
+
+def generate_batch(jobs, max_workers=4):
+    """
+    Run generation jobs keeping at most max_workers fal requests in flight.
+    Jobs are read lazily, so very large prompt files are never loaded whole.
+    Yields (job, result, error) tuples as each job finishes, in completion order.
+    """
+    def run(job):
+        return generate_image(
+            job["prompt"],
+            job.get("image_size", "landscape_4_3"),
+            job.get("num_images", 1),
+            job.get("seed"),
+        )
+
+    return run_bounded(run, jobs, max_workers)
+
+def save_image(url, folder, request_id=None):
+    """Save an image from URL to the specified folder, named after its content hash"""
+    saved = download_content_addressed(url, folder, ".jpg")
+    if saved is not None:
+        filepath, digest, _ = saved
+        record_output(request_id, digest, filepath, url, "generated_image")
+        schedule_thumbnails(filepath)
         print(f"Image saved: {filepath}")
         return filepath
     else:
         print(f"Failed to download image from {url}")
         return None
 
-def save_request_log(log_data, log_file="request_log.json", logs_folder="logs"):
+def save_images(result, folder, request_id=None):
+    """Download every image of a fal result in parallel and return the saved paths"""
+    urls = [image['url'] for image in result['images']]
+    saved = save_all(urls, lambda url: save_image(url, folder, request_id))
+    return [path for path in saved if path]
+
+def save_request_log(log_data, log_file="request_log.jsonl", logs_folder="logs"):
     """
-    Save the request log to a JSON file.
-    If the file exists, it appends the new data to the existing log.
+    Append the request log to a JSONL file.
+    Existing request_log.json history is migrated on first use.
     """
-    # Create logs folder if it doesn't exist
-    os.makedirs(logs_folder, exist_ok=True)
-
-    log_file_path = os.path.join(logs_folder, log_file)
-
-    if os.path.exists(log_file_path):
-        with open(log_file_path, 'r') as f:
-            existing_data = json.load(f)
-    else:
-        existing_data = []
-    
-    existing_data.append(log_data)
-    
-    with open(log_file_path, 'w') as f:
-        json.dump(existing_data, f, indent=2)
-    
+    log_file_path = append_log(log_data, log_file, logs_folder)
     print(f"Request log saved to {log_file_path}")
 
 def get_image_size_choice():
     """Present a menu for image size selection and return the chosen size"""
-    size_options = [
-        "square_hd",
-        "square",
-        "portrait_4_3",
-        "portrait_16_9",
-        "landscape_4_3",
-        "landscape_16_9"
-    ]
+    size_options = IMAGE_SIZES
     
     while True:
         print("\nChoose an image size:")
@@ -103,7 +134,43 @@ def get_image_size_choice():
         except ValueError:
             print("Invalid input. Please enter a number.")
 
+def run_batch(job_file, image_folder, max_workers=4):
+    """Generate every job in job_file concurrently, saving and logging each one as it finishes"""
+    completed = 0
+    failed = 0
+    for job, result, error in generate_batch(load_batch_jobs(job_file), max_workers):
+        if error is not None:
+            failed += 1
+            print(f"Job failed ({job['prompt'][:60]}): {error}")
+            continue
+
+        request_id = new_request_id()
+        saved_images = save_images(result, image_folder, request_id)
+
+        completed += 1
+        log_data = {
+            "request_id": request_id,
+            "timestamp": datetime.now().isoformat(),
+            "prompt": job["prompt"],
+            "image_size": job.get("image_size", "landscape_4_3"),
+            "num_images": job.get("num_images", 1),
+            "seed": job.get("seed"),
+            "output_images": saved_images,
+            "api_response": result
+        }
+        save_request_log(log_data)
+
+    print(f"\nBatch finished: {completed} jobs completed, {failed} failed.")
+
 if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_env()
+
+    parser = argparse.ArgumentParser(description="Generate images with fal.ai FLUX")
+    parser.add_argument("--batch", metavar="FILE", help="JSONL file with one job per line (prompt, image_size, num_images, seed)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of jobs kept in flight in batch mode (default 4)")
+    args = parser.parse_args()
+
     # Check for API key
     fal_key = os.getenv("FAL_KEY")
     if not fal_key:
@@ -114,6 +181,10 @@ if __name__ == "__main__":
     image_folder = "all_output/generated_images"
     os.makedirs(image_folder, exist_ok=True)
 
+    if args.batch:
+        run_batch(args.batch, image_folder, max(1, args.concurrency))
+        sys.exit(0)
+
     # Get generation parameters
     prompt = input("Insert Prompt: ")
     image_size = get_image_size_choice()
@@ -124,16 +195,14 @@ if __name__ == "__main__":
     print(result)
 
     # Save generated images
-    saved_images = []
-    for image in result['images']:
-        saved_path = save_image(image['url'], image_folder)
-        if saved_path:
-            saved_images.append(saved_path)
+    request_id = new_request_id()
+    saved_images = save_images(result, image_folder, request_id)
 
     print(f"\nSaved {len(saved_images)} images in the '{image_folder}' folder.")
 
     # Prepare and save log data
     log_data = {
+        "request_id": request_id,
         "timestamp": datetime.now().isoformat(),
         "prompt": prompt,
         "image_size": image_size,
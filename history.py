@@ -0,0 +1,345 @@
+import os
+import json
+import sqlite3
+import hashlib
+from log_store import log_path, migrate_legacy_log, rotated_files
+
+# Queryable index over the generation history of every generator.
+#
+# The JSONL request logs stay the source of truth; this SQLite database is a
+# normalized, indexed copy (model, prompt, params, seed, inputs, outputs,
+# timings) that can be deleted and rebuilt at any time. Ingestion is
+# incremental: the byte offset reached in every log file (rotated ones
+# included, tracked by inode) is remembered, so each run only reads the lines
+# appended since the previous one. Legacy JSON array logs are migrated to
+# JSONL first.
+#
+# Prompt substring search uses an FTS5 trigram index when SQLite supports it
+# (3.34+), and falls back to a LIKE scan otherwise.
+
+HISTORY_PATH = os.path.join(".cache", "history.sqlite")
+LOGS_FOLDER = "logs"
+OUTPUT_INDEX_LOG = "output_index.jsonl"
+READ_CHUNK = 8 * 1024 * 1024  # log bytes indexed per transaction
+
+# Request log name -> (generator, model)
+LOGS = {
+    "request_log.jsonl": ("flux", "fal-ai/flux-pro/v1.1"),
+    "photomaker_log.jsonl": ("photomaker", "tencentarc/photomaker"),
+    "face_transformation_log.jsonl": ("face-to-many", "fofr/face-to-many"),
+    "sticker_generation_log.jsonl": ("sticker", "fofr/face-to-sticker"),
+    "logo_generation_log.jsonl": ("logo", "mejiabrayan/logoai"),
+}
+
+# Record fields stored in their own columns (or as inputs/outputs) rather than in params
+_NORMALIZED_FIELDS = {
+    "request_id", "timestamp", "prompt", "base_prompt", "style_prompt", "negative_prompt",
+    "style", "style_name", "style_suffix", "seed", "input_image", "input_images", "input_folder",
+    "output_image", "output_images", "output_url", "output_urls", "generation_urls", "sticker_url",
+    "api_response", "duration_seconds",
+}
+
+
+def connect(path=HISTORY_PATH):
+    """Open the history database, creating its tables on first use"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-65536")  # 64 MB keeps the unique indexes in memory while ingesting
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY,
+            request_id TEXT NOT NULL UNIQUE,
+            timestamp TEXT,
+            generator TEXT NOT NULL,
+            model TEXT NOT NULL,
+            prompt TEXT,
+            negative_prompt TEXT,
+            style TEXT,
+            seed INTEGER,
+            params TEXT,
+            inputs TEXT,
+            timings TEXT,
+            duration REAL
+        );
+        CREATE INDEX IF NOT EXISTS requests_seed ON requests (seed);
+        CREATE INDEX IF NOT EXISTS requests_model ON requests (model);
+        CREATE INDEX IF NOT EXISTS requests_generator ON requests (generator);
+        CREATE INDEX IF NOT EXISTS requests_timestamp ON requests (timestamp);
+
+        CREATE TABLE IF NOT EXISTS outputs (
+            request_id TEXT NOT NULL,
+            path TEXT NOT NULL,
+            name TEXT,
+            url TEXT,
+            sha256 TEXT,
+            UNIQUE (request_id, path)
+        );
+        CREATE INDEX IF NOT EXISTS outputs_name ON outputs (name);
+        CREATE INDEX IF NOT EXISTS outputs_sha256 ON outputs (sha256);
+
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            log_name TEXT NOT NULL,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            PRIMARY KEY (log_name, inode)
+        );
+    """)
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS requests_fts "
+            "USING fts5(prompt, content='requests', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        pass  # no FTS5 trigram tokenizer; prompt search falls back to LIKE
+    return conn
+
+
+def _has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'requests_fts'").fetchone() is not None
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize(generator, model, record):
+    """Map one log record of any generator onto the common history schema"""
+    api_response = record.get("api_response") if isinstance(record.get("api_response"), dict) else {}
+    seed = record.get("seed")
+    if seed is None:
+        seed = api_response.get("seed")  # fal reports the seed it picked
+
+    prompt = record.get("prompt") or record.get("base_prompt") or record.get("style_prompt")
+    style = record.get("style_name") or record.get("style") or record.get("style_suffix") or None
+    inputs = _as_list(record.get("input_images") or record.get("input_image") or record.get("input_folder"))
+
+    paths = [path for path in _as_list(record.get("output_images") or record.get("output_image")) if path]
+    urls = _as_list(
+        record.get("output_urls") or record.get("generation_urls")
+        or record.get("output_url") or record.get("sticker_url")
+        or [image.get("url") for image in api_response.get("images", []) if isinstance(image, dict)]
+    )
+    if paths:
+        outputs = [(path, urls[i] if len(urls) == len(paths) else None) for i, path in enumerate(paths)]
+    else:
+        outputs = [(None, url) for url in urls]
+
+    timings = dict(api_response.get("timings") or {})
+    if record.get("duration_seconds") is not None:
+        timings["total"] = record["duration_seconds"]
+
+    return {
+        "request_id": record.get("request_id"),
+        "timestamp": str(record.get("timestamp") or "").replace(" ", "T") or None,
+        "generator": generator,
+        "model": model,
+        "prompt": prompt,
+        "negative_prompt": record.get("negative_prompt"),
+        "style": str(style) if style is not None else None,
+        "seed": _as_int(seed),
+        "params": {k: v for k, v in record.items() if k not in _NORMALIZED_FIELDS},
+        "inputs": [str(path) for path in inputs],
+        "outputs": outputs,
+        "timings": timings,
+        "duration": timings.get("total"),
+    }
+
+
+def _insert_request(conn, entry, fts=False):
+    cursor = conn.execute(
+        "INSERT OR IGNORE INTO requests (request_id, timestamp, generator, model, prompt, negative_prompt, "
+        "style, seed, params, inputs, timings, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (entry["request_id"], entry["timestamp"], entry["generator"], entry["model"], entry["prompt"],
+         entry["negative_prompt"], entry["style"], entry["seed"], json.dumps(entry["params"], default=str),
+         json.dumps(entry["inputs"]), json.dumps(entry["timings"], default=str), entry["duration"])
+    )
+    if cursor.rowcount and entry["prompt"] and fts:
+        conn.execute("INSERT INTO requests_fts (rowid, prompt) VALUES (?, ?)", (cursor.lastrowid, entry["prompt"]))
+    for path, url in entry["outputs"]:
+        path = path or url
+        conn.execute(
+            "INSERT OR IGNORE INTO outputs (request_id, path, name, url) VALUES (?, ?, ?, ?)",
+            (entry["request_id"], path, os.path.basename(str(path)), url)
+        )
+
+
+def _insert_output_index(conn, entry):
+    if not entry.get("request_id") or not entry.get("path"):
+        return
+    conn.execute(
+        "INSERT INTO outputs (request_id, path, name, url, sha256) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (request_id, path) DO UPDATE SET sha256 = excluded.sha256, url = coalesce(outputs.url, excluded.url)",
+        (entry["request_id"], entry["path"], os.path.basename(entry["path"]), entry.get("url"), entry.get("sha256"))
+    )
+
+
+def _log_files(log_name, logs_folder):
+    """The rotated files of a log, oldest first, then the active file"""
+    path = log_path(log_name, logs_folder)
+    return [file_path for _, file_path in reversed(rotated_files(path))] + [path]
+
+
+def _ingest_file(conn, log_name, file_path, handle_line):
+    """
+    Feed the lines appended to file_path since the last run to handle_line; returns the number read.
+    Commits after every READ_CHUNK bytes, so memory stays bounded and an interrupted
+    ingest continues from the last committed chunk.
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return 0
+    row = conn.execute(
+        "SELECT offset FROM ingest_state WHERE log_name = ? AND inode = ?", (log_name, stat.st_ino)
+    ).fetchone()
+    offset = row[0] if row else 0
+    if offset > stat.st_size:
+        offset = 0  # inode reused by a different file
+    if offset == stat.st_size:
+        return 0
+
+    count = 0
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        pending = b""
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            data = pending + chunk
+            end = data.rfind(b"\n") + 1  # a partially written last line waits for the next chunk or run
+            pending = data[end:]
+            with conn:
+                for line in data[:end].splitlines():
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    handle_line(record, line)
+                    count += 1
+                offset += end
+                conn.execute(
+                    "INSERT OR REPLACE INTO ingest_state (log_name, inode, offset) VALUES (?, ?, ?)",
+                    (log_name, stat.st_ino, offset)
+                )
+    return count
+
+
+def ingest(conn=None, logs_folder=LOGS_FOLDER):
+    """Index every log line written since the last ingest; returns the number of new lines"""
+    own_connection = conn is None
+    conn = conn or connect()
+    total = 0
+    fts = _has_fts(conn)
+    try:
+        for log_name, (generator, model) in LOGS.items():
+            migrate_legacy_log(log_path(log_name, logs_folder))
+
+            def handle_request(record, line, generator=generator, model=model, log_name=log_name):
+                entry = normalize(generator, model, record)
+                if not entry["request_id"]:
+                    # Records written before request ids existed get a stable id from their content
+                    entry["request_id"] = f"{log_name}:{hashlib.sha1(line).hexdigest()}"
+                _insert_request(conn, entry, fts)
+
+            for file_path in _log_files(log_name, logs_folder):
+                total += _ingest_file(conn, log_name, file_path, handle_request)
+
+        for file_path in _log_files(OUTPUT_INDEX_LOG, logs_folder):
+            total += _ingest_file(conn, OUTPUT_INDEX_LOG, file_path,
+                                  lambda record, line: _insert_output_index(conn, record))
+    finally:
+        if own_connection:
+            conn.close()
+    return total
+
+
+def _models_with_prefix(conn, prefix):
+    """Distinct indexed models starting with prefix, found by skipping through the model index"""
+    models = []
+    row = conn.execute("SELECT min(model) FROM requests WHERE model >= ?", (prefix,)).fetchone()
+    while row and row[0] is not None and row[0].startswith(prefix):
+        models.append(row[0])
+        row = conn.execute("SELECT min(model) FROM requests WHERE model > ?", (row[0],)).fetchone()
+    return models
+
+
+def query(conn, prompt=None, seed=None, model=None, generator=None, output=None, since=None, limit=50):
+    """
+    Return matching history entries, most recently logged first, each with its outputs.
+    :param prompt: Case-insensitive substring of the prompt
+    :param model: Model id or prefix (e.g. 'fofr/')
+    :param output: Output file path, file name, or SHA-256 prefix
+    :param since: Only entries at or after this ISO date/time
+    """
+    source, order = "requests r", "r.id"
+    clauses, args = [], []
+    if prompt:
+        if _has_fts(conn) and len(prompt) >= 3:
+            # Driving the query from the trigram index streams matches in rowid order,
+            # so LIMIT stops early however many rows match
+            source, order = "requests_fts f JOIN requests r ON r.id = f.rowid", "f.rowid"
+            clauses.append("requests_fts MATCH ?")
+            args.append('"' + prompt.replace('"', '""') + '"')
+        else:
+            clauses.append("r.prompt LIKE ? ESCAPE '\\'")
+            args.append("%" + prompt.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    if seed is not None:
+        clauses.append("r.seed = ?")
+        args.append(int(seed))
+    if model:
+        models = _models_with_prefix(conn, model)
+        if not models:
+            return []
+        clauses.append(f"r.model IN ({', '.join('?' * len(models))})")
+        args += models
+    if generator:
+        clauses.append("r.generator = ?")
+        args.append(generator)
+    if since:
+        clauses.append("r.timestamp >= ?")
+        args.append(since.replace(" ", "T"))
+    if output:
+        name = os.path.basename(output)
+        clauses.append(
+            "r.request_id IN (SELECT request_id FROM outputs WHERE name = ? OR (sha256 >= ? AND sha256 < ?))"
+        )
+        args += [name, name.lower(), name.lower() + "g"]
+
+    sql = ("SELECT r.request_id, r.timestamp, r.generator, r.model, r.prompt, r.negative_prompt, r.style, r.seed, "
+           f"r.params, r.inputs, r.timings FROM {source}")
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    # Logs are appended in time order, so the rowid order is the log order and needs no sort
+    sql += f" ORDER BY {order} DESC LIMIT ?"
+    args.append(limit)
+
+    results = []
+    for row in conn.execute(sql, args).fetchall():
+        entry = dict(zip(
+            ("request_id", "timestamp", "generator", "model", "prompt", "negative_prompt", "style", "seed",
+             "params", "inputs", "timings"), row
+        ))
+        for key in ("params", "inputs", "timings"):
+            entry[key] = json.loads(entry[key]) if entry[key] else None
+        entry["outputs"] = [
+            {"path": path, "url": url, "sha256": sha256}
+            for path, url, sha256 in conn.execute(
+                "SELECT path, url, sha256 FROM outputs WHERE request_id = ?", (entry["request_id"],)
+            )
+        ]
+        results.append(entry)
+    return results
@@ -0,0 +1,174 @@
+import os
+import base64
+import hashlib
+import mimetypes
+import tempfile
+import threading
+from collections import OrderedDict
+from metrics import span
+
+# Memoized base64 data URI encoder for input images.
+# The same reference photos in images_to_upload/ are sent with hundreds of
+# generations, so encodings are kept in a size-bounded LRU keyed on the
+# file's path, mtime and size. Editing or replacing a file invalidates it.
+# Encodings are also written to .cache/data_uris/ under the SHA-256 of the
+# file's content, so later runs and other worker processes reuse them.
+
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+DISK_CACHE_FOLDER = os.path.join(".cache", "data_uris")
+MAX_DISK_BYTES = 1024 * 1024 * 1024
+EVICT_EVERY = 50  # disk writes between two eviction passes
+MAX_DIGESTS = 4096  # file versions whose SHA-256 is remembered
+
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_digests = OrderedDict()
+_disk_writes = 0
+
+# Magic byte signatures of the formats the providers accept
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def detect_mime_type(header, path=None):
+    """
+    Return the image MIME type from the first bytes of a file.
+    Falls back to the file extension, then to image/jpeg.
+    """
+    for signature, mime_type in _SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header[4:8] == b"ftyp" and header[8:12] in (b"avif", b"avis"):
+        return "image/avif"
+    if path:
+        guessed, _ = mimetypes.guess_type(path)
+        if guessed and guessed.startswith("image/"):
+            return guessed
+    return "image/jpeg"
+
+
+def _file_key(image_path):
+    stat = os.stat(image_path)
+    return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+
+def file_digest(image_path):
+    """Return the SHA-256 hex digest of a file, memoized per file version"""
+    key = _file_key(image_path)
+    with _cache_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+    sha = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _cache_lock:
+        _digests[key] = digest
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+    return digest
+
+
+def _disk_path(digest, cache_folder):
+    return os.path.join(cache_folder, digest[:2], f"{digest}.uri")
+
+
+def _read_disk(digest, cache_folder):
+    path = _disk_path(digest, cache_folder)
+    try:
+        with open(path, "r") as f:
+            data_uri = f.read()
+        os.utime(path)  # recently used, for eviction
+        return data_uri
+    except OSError:
+        return None
+
+
+def _write_disk(digest, data_uri, cache_folder):
+    global _disk_writes
+    path = _disk_path(digest, cache_folder)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(data_uri)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache the encoding of an input image: {e}")
+        return
+    with _cache_lock:
+        _disk_writes += 1
+        due = _disk_writes % EVICT_EVERY == 1
+    if due:
+        evict_disk(cache_folder)
+
+
+def evict_disk(cache_folder=DISK_CACHE_FOLDER, max_bytes=MAX_DISK_BYTES):
+    """Remove least recently used encodings until the disk cache fits max_bytes"""
+    entries = []
+    total_bytes = 0
+    for root, _, files in os.walk(cache_folder):
+        for name in files:
+            if not name.endswith(".uri"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        removed += 1
+        total_bytes -= size
+    return removed
+
+
+def encode_image_to_data_uri(image_path, cache_folder=DISK_CACHE_FOLDER):
+    """Return the image as a base64 data URI with its real MIME type, memoized per file version"""
+    global _cache_bytes
+    key = _file_key(image_path)
+    with _cache_lock:
+        data_uri = _cache.get(key)
+        if data_uri is not None:
+            _cache.move_to_end(key)
+            return data_uri
+
+    digest = file_digest(image_path)
+    data_uri = _read_disk(digest, cache_folder)
+    if data_uri is None:
+        with span("encode"):
+            with open(image_path, "rb") as f:
+                raw = f.read()
+            mime_type = detect_mime_type(raw[:16], image_path)
+            data_uri = f"data:{mime_type};base64,{base64.b64encode(raw).decode('ascii')}"
+        _write_disk(digest, data_uri, cache_folder)
+
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = data_uri
+            _cache_bytes += len(data_uri)
+            # Drop least recently used encodings (but always keep the newest one)
+            while _cache_bytes > MAX_CACHE_BYTES and len(_cache) > 1:
+                _, evicted = _cache.popitem(last=False)
+                _cache_bytes -= len(evicted)
+    return data_uri
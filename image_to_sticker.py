@@ -1,25 +1,28 @@
-import replicate
 import os
-from dotenv import load_dotenv
 from datetime import datetime
-import requests
-import json
-from glob import glob
-import base64
+from env import load_env
+from downloader import download_content_addressed
+from output_index import new_request_id, record_output
+from thumbnails import schedule_thumbnails
+from log_store import append_log
+from predictions import run_prediction
+from uploads import image_reference
+from preprocess import prepare_input_image
 
 # FAILS TO GENERATE, same problem in the replicate webapp
 
-# Load environment variables from .env file
-load_dotenv()
-
 def get_images_from_folder(folder_path):
     """Get list of images from the specified folder"""
-    # Supported image formats
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.webp']
-    images = []
-    for ext in image_extensions:
-        images.extend(glob(os.path.join(folder_path, ext)))
-    return sorted(images)  # Sort for consistent ordering
+    image_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+    if not os.path.isdir(folder_path):
+        return []
+    # One directory listing instead of a glob per extension
+    with os.scandir(folder_path) as entries:
+        images = [
+            entry.path for entry in entries
+            if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith(image_extensions)
+        ]
+    return sorted(images)
 
 def select_image(images):
     """Present a menu for image selection"""
@@ -40,19 +43,21 @@ def select_image(images):
         except ValueError:
             print("Invalid input. Please enter a number.")
 
-def generate_sticker(image_path, prompt, prompt_strength=4.5, instant_id_strength=0.7):
+def generate_sticker(image_path, prompt, prompt_strength=4.5, instant_id_strength=0.7, preprocess=True):
     """
     Generate sticker using Replicate API
     :param image_path: Path to the input image
     :param prompt: The text prompt for sticker style
     :param prompt_strength: Strength of the prompt (default: 4.5)
     :param instant_id_strength: Strength of identity preservation (default: 0.7)
+    :param preprocess: Downscale the input to the model's working resolution before upload
     """
+    model = "fofr/face-to-sticker:764d4827ea159608a07cdde8ddf1c6000019627515eb02b6b449695fd547e5ef"
     try:
-        # Read and encode the image
-        with open(image_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
-            image_uri = f"data:image/jpeg;base64,{image_data}"
+        # Downscale, then upload the image once (or encode it inline if uploading isn't possible)
+        if preprocess:
+            image_path = prepare_input_image(image_path, model)
+        image_uri = image_reference(image_path)
         
         input_params = {
             "image": image_uri,
@@ -61,68 +66,33 @@ def generate_sticker(image_path, prompt, prompt_strength=4.5, instant_id_strengt
             "instant_id_strength": float(instant_id_strength)
         }
         
-        output = replicate.run(
-            "fofr/face-to-sticker:764d4827ea159608a07cdde8ddf1c6000019627515eb02b6b449695fd547e5ef",
-            input=input_params
-        )
+        output = run_prediction(model, input_params)
+        # The model returns a list of images; the first one is the sticker
+        if isinstance(output, (list, tuple)):
+            output = output[0] if output else None
         
         return str(output) if output else None
     except Exception as e:
         print(f"Error generating sticker: {e}")
         return None
 
-def save_image(url, folder, prefix="sticker"):
-    """Save an image from URL to the specified folder"""
-    response = requests.get(url)
-    if response.status_code == 200:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{prefix}_{timestamp}.png"
-        filepath = os.path.join(folder, filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+def save_image(url, folder, prefix="sticker", request_id=None):
+    """Save an image from URL to the specified folder, named after its content hash"""
+    saved = download_content_addressed(url, folder, ".png")
+    if saved is not None:
+        filepath, digest, _ = saved
+        record_output(request_id, digest, filepath, url, prefix)
+        schedule_thumbnails(filepath)
         print(f"Sticker saved: {filepath}")
         return filepath
     else:
         print(f"Failed to download sticker from {url}")
         return None
 
-def save_request_log(log_data, logs_folder="logs", log_file_name="sticker_generation_log.json"):
-    """Save the request log to a single JSON file in the logs folder"""
-    os.makedirs(logs_folder, exist_ok=True)
-    log_file_path = os.path.join(logs_folder, log_file_name)
-
-    if isinstance(log_data.get('timestamp'), datetime):
-        log_data['timestamp'] = log_data['timestamp'].isoformat()
-    
-    def sanitize_for_json(obj):
-        if isinstance(obj, (datetime, bytes)):
-            return str(obj)
-        elif isinstance(obj, dict):
-            return {k: sanitize_for_json(v) for k, v in obj.items()}
-        elif isinstance(obj, (list, tuple)):
-            return [sanitize_for_json(item) for item in obj]
-        else:
-            return str(obj) if hasattr(obj, '__dict__') else obj
-
-    log_data = sanitize_for_json(log_data)
-
+def save_request_log(log_data, logs_folder="logs", log_file_name="sticker_generation_log.jsonl"):
+    """Append the request log to a JSONL file in the logs folder"""
     try:
-        if os.path.exists(log_file_path):
-            try:
-                with open(log_file_path, 'r') as f:
-                    existing_data = json.load(f)
-            except json.JSONDecodeError:
-                print("Warning: Existing log file was corrupted. Creating new log.")
-                existing_data = []
-        else:
-            existing_data = []
-        
-        existing_data.append(log_data)
-        
-        with open(log_file_path, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        
+        log_file_path = append_log(log_data, log_file_name, logs_folder)
         print(f"Request log saved to {log_file_path}")
     except Exception as e:
         print(f"Error saving log: {e}")
@@ -156,6 +126,9 @@ def get_style_prompt():
             print("Invalid input. Please enter a number.")
 
 if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_env()
+
     # Check for API key
     replicate_api_key = os.getenv("REPLICATE_API_TOKEN")
     if not replicate_api_key:
@@ -208,13 +181,15 @@ if __name__ == "__main__":
 
     if sticker_url:
         # Save generated sticker
-        saved_path = save_image(sticker_url, sticker_folder)
+        request_id = new_request_id()
+        saved_path = save_image(sticker_url, sticker_folder, request_id=request_id)
         
         if saved_path:
             print(f"\nSticker saved successfully to: {saved_path}")
             
             # Prepare and save log data
             log_data = {
+                "request_id": request_id,
                 "timestamp": datetime.now(),
                 "input_image": selected_image,
                 "style_prompt": style_prompt,
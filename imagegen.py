@@ -0,0 +1,369 @@
+import os
+import sys
+import json
+import argparse
+from env import load_env
+from storage_format import check_storage_format
+from jobs import GENERATORS, UPLOAD_FOLDER, load_generator, load_job_file, resolve_params, run_job
+from flux_image_generator import IMAGE_SIZES
+
+# Single command line entry point for all generators.
+#
+#   python imagegen.py flux --prompt "a red fox" --image-size square_hd --seed 42
+#   python imagegen.py photomaker --folder alice --style-name Cinematic
+#   python imagegen.py run jobs.yaml
+#
+# When a required option is missing and the command runs in a terminal, the
+# interactive menus from the original scripts are used as a fallback.
+
+API_KEYS = {
+    "flux": "FAL_KEY",
+    "photomaker": "REPLICATE_API_TOKEN",
+    "face-to-many": "REPLICATE_API_TOKEN",
+    "sticker": "REPLICATE_API_TOKEN",
+    "logo": "REPLICATE_API_TOKEN",
+}
+
+
+def check_settings():
+    """Exit when an output setting such as IMAGEGEN_STORAGE_FORMAT is invalid, before any work is done"""
+    try:
+        check_storage_format()
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+
+def check_api_key(generator):
+    """Exit with a helpful message when the provider key for generator is not set"""
+    load_env()
+    check_settings()  # again, now that the .env file is loaded
+    key = API_KEYS[generator]
+    if not os.getenv(key):
+        print(f"{key} not found in environment variables. Please check your .env file.")
+        sys.exit(1)
+
+
+def interactive_fallback(generator, params):
+    """Fill in missing required parameters with the scripts' interactive menus"""
+    if not sys.stdin.isatty():
+        return params
+    module = load_generator(generator)
+
+    if generator in ("flux", "logo") and not params.get("prompt"):
+        params["prompt"] = input("Insert Prompt: ")
+    elif generator == "photomaker" and not params.get("folder"):
+        params["folder"] = module.select_folder(module.get_subfolders(UPLOAD_FOLDER))
+    elif generator in ("face-to-many", "sticker") and not params.get("image"):
+        params["image"] = module.select_image(module.get_images_from_folder(UPLOAD_FOLDER))
+    return params
+
+
+def build_parser():
+    """Build the argparse parser with one subcommand per generator"""
+    parser = argparse.ArgumentParser(prog="imagegen", description="Generate images with fal.ai and Replicate models")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the provider, ignoring cached results")
+    parser.add_argument("--output-folder", help="Override the generator's output folder")
+    parser.add_argument("--resumable", action="store_true",
+                        help="Submit and poll predictions, persisting their ids so a restarted run resumes them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    flux = subparsers.add_parser("flux", help="Text to image with FLUX 1.1 pro (fal.ai)")
+    flux.add_argument("--prompt")
+    flux.add_argument("--image-size", choices=IMAGE_SIZES)
+    flux.add_argument("--num-images", type=int)
+    flux.add_argument("--seed", type=int)
+    flux.add_argument("--batch", metavar="FILE", help="JSONL prompt file, run concurrently")
+    flux.add_argument("--concurrency", type=int, default=4, help="Jobs in flight in batch mode (default 4)")
+
+    photomaker = subparsers.add_parser("photomaker", help="Subject-driven photos with PhotoMaker (Replicate)")
+    photomaker.add_argument("--folder", help="Folder of reference images (path or name inside images_to_upload)")
+    photomaker.add_argument("--prompt")
+    photomaker.add_argument("--style-name")
+    photomaker.add_argument("--num-steps", type=int)
+    photomaker.add_argument("--num-outputs", type=int)
+    photomaker.add_argument("--guidance-scale", type=float)
+    photomaker.add_argument("--style-strength-ratio", type=float)
+    photomaker.add_argument("--seed", type=int)
+    photomaker.add_argument("--negative-prompt")
+    photomaker.add_argument("--disable-safety-checker", action="store_true", default=None)
+
+    face = subparsers.add_parser("face-to-many", help="Turn a face into 3D, pixel art, clay... (Replicate)")
+    face.add_argument("--image", help="Input image (path or name inside images_to_upload)")
+    face.add_argument("--style")
+    face.add_argument("--prompt")
+    face.add_argument("--seed", type=int)
+    face.add_argument("--lora-scale", type=float)
+    face.add_argument("--custom-lora-url")
+    face.add_argument("--negative-prompt")
+    face.add_argument("--prompt-strength", type=float)
+    face.add_argument("--denoising-strength", type=float)
+    face.add_argument("--instant-id-strength", type=float)
+    face.add_argument("--control-depth-strength", type=float)
+
+    sticker = subparsers.add_parser("sticker", help="Turn a face into a sticker (Replicate)")
+    sticker.add_argument("--image", help="Input image (path or name inside images_to_upload)")
+    sticker.add_argument("--prompt", help="Sticker style prompt")
+    sticker.add_argument("--prompt-strength", type=float)
+    sticker.add_argument("--instant-id-strength", type=float)
+
+    logo = subparsers.add_parser("logo", help="Logo generation (Replicate)")
+    logo.add_argument("--prompt")
+    logo.add_argument("--style-suffix")
+    logo.add_argument("--num-variations", type=int)
+    logo.add_argument("--seed", type=int)
+    logo.add_argument("--max-concurrency", type=int, help="Variations generated at the same time (default 5)")
+
+    run = subparsers.add_parser("run", help="Run every job in a YAML, JSON or JSONL job file")
+    run.add_argument("job_file")
+    run.add_argument("--keep-going", action="store_true", help="Continue with the next job when one fails")
+
+    sweep = subparsers.add_parser("sweep", help="Run a parameter sweep and write a contact sheet")
+    sweep.add_argument("spec", help="YAML or JSON sweep spec")
+    sweep.add_argument("--concurrency", type=int, help="Jobs run at the same time (default: spec or 4)")
+    sweep.add_argument("--columns", type=int, help="Contact sheet columns (default: size of the last matrix axis)")
+    sweep.add_argument("--dry-run", action="store_true", help="Only print the expanded grid")
+
+    history = subparsers.add_parser("history", help="Search the generation history of every generator")
+    history.add_argument("--prompt", help="Prompt contains this text (case-insensitive)")
+    history.add_argument("--seed", type=int)
+    history.add_argument("--model", help="Model id or prefix, e.g. fofr/face-to-many")
+    history.add_argument("--generator", choices=list(GENERATORS))
+    history.add_argument("--output", help="Output image path, file name or SHA-256 prefix")
+    history.add_argument("--since", help="Only entries at or after this date (YYYY-MM-DD[THH:MM])")
+    history.add_argument("--limit", type=int, default=20)
+    history.add_argument("--json", action="store_true", help="Print the entries as JSON lines")
+
+    thumbs = subparsers.add_parser("thumbnails", help="Create WebP thumbnails for existing outputs")
+    thumbs.add_argument("folders", nargs="*", help="Folders to scan (default: all_output)")
+    thumbs.add_argument("--sizes", type=int, nargs="+", help="Longest side of each thumbnail size (default 128 512)")
+    thumbs.add_argument("--workers", type=int, help="Worker processes (default: one per CPU)")
+    thumbs.add_argument("--force", action="store_true", help="Re-create thumbnails that are up to date")
+
+    dedupe = subparsers.add_parser("dedupe", help="Find near-duplicate outputs by perceptual hash")
+    dedupe.add_argument("folders", nargs="*", help="Folders to scan (default: all_output)")
+    dedupe.add_argument("--radius", type=int, default=8, help="Max differing hash bits (of 64) for a match")
+    dedupe.add_argument("--hash", choices=["ahash", "dhash", "phash"], default="phash")
+    dedupe.add_argument("--prune", action="store_true",
+                        help="Move all but the oldest image of each cluster to all_output/.duplicates")
+    dedupe.add_argument("--json", action="store_true", help="Print the clusters as JSON lines")
+
+    watch = subparsers.add_parser("watch", help="Queue a preset of jobs for every new upload in images_to_upload")
+    watch.add_argument("preset", help="YAML or JSON preset listing the jobs to run per image or subfolder")
+    watch.add_argument("--folder", default=UPLOAD_FOLDER, help="Folder to watch (default images_to_upload)")
+    watch.add_argument("--settle", type=float, help="Seconds an input must stay unchanged before it is queued")
+    watch.add_argument("--poll", action="store_true", help="Poll instead of using inotify (e.g. on network drives)")
+    watch.add_argument("--workers", type=int, default=0, help="Also run this many queue workers")
+    watch.add_argument("--queue", default=None, help="Queue database (default .cache/queue.sqlite)")
+
+    subparsers.add_parser("predictions", help="List submitted predictions that were not collected yet")
+
+    enqueue = subparsers.add_parser("enqueue", help="Add the jobs of a job file to the persistent queue")
+    enqueue.add_argument("job_file")
+    enqueue.add_argument("--queue", default=None, help="Queue database (default .cache/queue.sqlite)")
+
+    worker = subparsers.add_parser("worker", help="Run worker processes that consume the persistent queue")
+    worker.add_argument("-n", "--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    worker.add_argument("--queue", default=None, help="Queue database (default .cache/queue.sqlite)")
+    worker.add_argument("--exit-when-empty", action="store_true", help="Stop once no runnable jobs are left")
+
+    queue = subparsers.add_parser("queue", help="Show how many queued jobs are in each state")
+    queue.add_argument("--queue", default=None, help="Queue database (default .cache/queue.sqlite)")
+
+    serve = subparsers.add_parser("serve", help="Run the HTTP job API (needs starlette and uvicorn)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+
+    return parser
+
+
+# argparse destinations that are CLI options rather than job parameters
+_CLI_ONLY = {"command", "no_cache", "output_folder", "resumable", "batch", "concurrency"}
+
+
+def run_jobs_file(job_file, use_cache=True, output_folder=None, keep_going=False):
+    """Run the jobs in job_file one after another, returning the number that failed"""
+    jobs = load_job_file(job_file)
+    failed = 0
+    for i, (generator, params) in enumerate(jobs, 1):
+        print(f"\n[{i}/{len(jobs)}] {generator}")
+        try:
+            params = dict(params)
+            params.setdefault("use_cache", use_cache)
+            run_job(generator, params, output_folder)
+        except Exception as e:
+            failed += 1
+            print(f"Job {i} ({generator}) failed: {e}")
+            if not keep_going:
+                break
+    return failed
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    use_cache = not args.no_cache
+    if args.resumable:
+        os.environ["IMAGEGEN_RESUMABLE"] = "1"
+    check_settings()
+
+    if args.command == "predictions":
+        from predictions import list_open_predictions
+        open_predictions = list_open_predictions()
+        for model, provider, job_id, status, age in open_predictions:
+            print(f"{provider:10} {job_id:40} {status:10} {age / 60:7.1f} min  {model.split(':')[0]}")
+        print(f"{len(open_predictions)} predictions not collected yet. Re-run their jobs with --resumable to pick them up.")
+        return 0
+
+    if args.command == "history":
+        import history
+        conn = history.connect()
+        try:
+            new_lines = history.ingest(conn)
+            entries = history.query(conn, args.prompt, args.seed, args.model, args.generator, args.output,
+                                    args.since, args.limit)
+        finally:
+            conn.close()
+        for entry in entries:
+            if args.json:
+                print(json.dumps(entry, default=str))
+                continue
+            seed = "-" if entry["seed"] is None else entry["seed"]
+            print(f"{(entry['timestamp'] or '')[:19]:19}  {entry['generator']:12} seed {seed!s:<11} {entry['prompt'] or ''}")
+            for output in entry["outputs"]:
+                print(f"    {output['path']}")
+        if not args.json:
+            print(f"{len(entries)} entries ({new_lines} new log lines indexed)")
+        return 0
+
+    if args.command == "thumbnails":
+        import thumbnails
+        if not thumbnails.thumbnails_enabled():
+            print("Thumbnails need Pillow (pip install Pillow) and IMAGEGEN_THUMBNAILS not set to 0.")
+            return 1
+        rendered, skipped, failed = thumbnails.backfill(
+            args.folders, tuple(args.sizes or thumbnails.SIZES), args.workers, args.force
+        )
+        print(f"Thumbnails: {rendered} created, {skipped} up to date, {failed} failed")
+        return 1 if failed else 0
+
+    if args.command == "dedupe":
+        import thumbnails
+        import perceptual_hash
+        if not thumbnails.thumbnails_enabled() or not perceptual_hash.numpy_available():
+            print("Perceptual hashes need Pillow and NumPy (pip install Pillow numpy) and IMAGEGEN_THUMBNAILS not set to 0.")
+            return 1
+        # Hashes are computed by the thumbnail workers; this only decodes outputs without one
+        thumbnails.backfill(args.folders)
+        entries = perceptual_hash.load_hash_index(args.folders)
+        clusters = perceptual_hash.find_clusters(entries, args.radius, args.hash)
+        for cluster in clusters:
+            keeper = perceptual_hash.choose_keeper(cluster)
+            others = [entry for entry in cluster if entry is not keeper]
+            if args.json:
+                print(json.dumps({"keep": keeper["source"], "duplicates": [entry["source"] for entry in others]}))
+                continue
+            print(f"\n{len(cluster)} images:\n  keep  {keeper['source']}")
+            for entry in others:
+                distance = perceptual_hash.hamming(keeper["hashes"][args.hash], entry["hashes"][args.hash])
+                print(f"  dup   {entry['source']}  ({distance} bits)")
+        duplicates = sum(len(cluster) - 1 for cluster in clusters)
+        if not args.json:
+            print(f"\n{len(clusters)} clusters, {duplicates} near-duplicates among {len(entries)} images")
+        if args.prune and clusters:
+            moved = perceptual_hash.prune_duplicates(clusters)
+            print(f"Moved {len(moved)} near-duplicates to {perceptual_hash.DUPLICATES_FOLDER}")
+        return 0
+
+    if args.command == "watch":
+        import job_queue
+        import watch_folder
+        queue_path = args.queue or job_queue.QUEUE_PATH
+        watcher = watch_folder.FolderWatcher(args.folder, watch_folder.load_preset(args.preset), queue_path,
+                                             settle_seconds=args.settle)
+        import multiprocessing
+        # Worker processes are started here rather than through run_workers, so stopping kills them all
+        workers = [
+            multiprocessing.Process(target=job_queue.worker_loop, kwargs={"path": queue_path})
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            enqueued = watcher.run(use_inotify=not args.poll)
+        finally:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        print(f"Stopped watching; {enqueued} jobs queued")
+        return 0
+
+    if args.command == "serve":
+        import service
+        service.serve(args.host, args.port)
+        return 0
+
+    if args.command in ("enqueue", "worker", "queue"):
+        import job_queue
+        queue_path = args.queue or job_queue.QUEUE_PATH
+        if args.command == "enqueue":
+            jobs = [(generator, params, params.pop("idempotency_key", None))
+                    for generator, params in load_job_file(args.job_file)]
+            try:
+                # Check every job first, so a bad one doesn't leave the file half enqueued
+                for generator, params, _ in jobs:
+                    resolve_params(generator, params)
+            except ValueError as e:
+                print(e)
+                return 1
+            for generator, params, key in jobs:
+                job_queue.enqueue(generator, params, key, path=queue_path)
+            print(f"Enqueued {len(jobs)} jobs in {queue_path}")
+        elif args.command == "worker":
+            job_queue.run_workers(max(1, args.workers), queue_path, exit_when_empty=args.exit_when_empty)
+        else:
+            for status, count in sorted(job_queue.queue_counts(queue_path).items()):
+                print(f"{status:10} {count}")
+        return 0
+
+    if args.command == "sweep":
+        import sweep
+        spec = sweep.load_spec(args.spec)
+        if args.dry_run:
+            for cell in sweep.expand(spec):
+                print(json.dumps(cell["axes"], default=str))
+            return 0
+        check_api_key(spec["generator"])
+        manifest = sweep.run_sweep(spec, args.concurrency, args.output_folder, use_cache, args.columns)
+        return 1 if any(cell["status"] == "failed" for cell in manifest["cells"]) else 0
+
+    if args.command == "run":
+        failed = run_jobs_file(args.job_file, use_cache, args.output_folder, args.keep_going)
+        return 1 if failed else 0
+
+    generator = args.command
+    check_api_key(generator)
+
+    if generator == "flux" and args.batch:
+        module = load_generator("flux")
+        output_folder = args.output_folder or GENERATORS["flux"][1]
+        os.makedirs(output_folder, exist_ok=True)
+        module.run_batch(args.batch, output_folder, max(1, args.concurrency))
+        return 0
+
+    params = {k: v for k, v in vars(args).items() if k not in _CLI_ONLY and v is not None}
+    params = interactive_fallback(generator, params)
+    params["use_cache"] = use_cache
+    try:
+        record = run_job(generator, params, args.output_folder)
+    except Exception as e:
+        print(f"Error: {e}")
+        return 1
+
+    outputs = record.get("output_images") or [record.get("output_image")]
+    print(f"\nSaved {len([o for o in outputs if o])} images. Request id: {record['request_id']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+
+# Durable local job queue (SQLite in WAL mode) for all five generators.
+#
+# Jobs are claimed with a lease: a worker that dies mid-job stops renewing its
+# lease and the job becomes claimable again, so every job runs at least once.
+# Each job carries an idempotency key, and enqueuing a key that already exists
+# is a no-op. Workers run in resumable prediction mode and key each job's
+# predictions by its queue id, so a job picked up again after a crash resumes
+# its provider predictions instead of paying twice. Failures that would only
+# repeat (bad parameters, missing inputs, permanent provider errors) fail the
+# job right away instead of using up its attempts.
+#
+# Several worker processes on one host can consume the same queue. Not across
+# machines: SQLite's WAL mode needs shared memory, so the queue file must not
+# be shared over a network filesystem.
+
+QUEUE_PATH = os.path.join(".cache", "queue.sqlite")
+LEASE_SECONDS = 120
+MAX_ATTEMPTS = 3
+IDLE_SLEEP = 1.0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def connect(path=QUEUE_PATH):
+    """Open the queue database, creating it on first use"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            generator TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            lease_owner TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, lease_expires, id)")
+    return conn
+
+
+def default_idempotency_key(generator, params):
+    """Hash of the generator and its canonical parameters"""
+    canonical = json.dumps({"generator": generator, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def enqueue(generator, params, idempotency_key=None, max_attempts=MAX_ATTEMPTS, path=QUEUE_PATH):
+    """
+    Add a job to the queue and return its id.
+    Returns the existing job's id when the idempotency key was already enqueued.
+    """
+    return try_enqueue(generator, params, idempotency_key, max_attempts, path)[0]
+
+
+def try_enqueue(generator, params, idempotency_key=None, max_attempts=MAX_ATTEMPTS, path=QUEUE_PATH):
+    """
+    Like enqueue, but returns (job id, created) where created is False for an already enqueued key.
+    Raises ValueError for unknown generators or parameters, before anything is queued.
+    """
+    from jobs import resolve_params
+    resolve_params(generator, params)
+    key = idempotency_key or default_idempotency_key(generator, params)
+    now = time.time()
+    conn = connect(path)
+    try:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO jobs (idempotency_key, generator, params, status, max_attempts, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, generator, json.dumps(params, default=str), QUEUED, max_attempts, now, now)
+        )
+        job_id = conn.execute("SELECT id FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()[0]
+        return job_id, cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+def claim(conn, worker_id, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically lease the oldest runnable job to worker_id.
+    Runnable means queued, or running with an expired lease (its worker died)
+    and attempts left. Expired jobs without attempts left are marked failed.
+    Returns (id, generator, params, attempts) or None when the queue is empty.
+    """
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # A job that keeps killing its worker must not be retried forever
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = COALESCE(error, 'lease expired'), lease_owner = NULL, "
+            "lease_expires = NULL, updated = ? WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts",
+            (FAILED, now, RUNNING, now)
+        )
+        row = conn.execute(
+            "SELECT id, generator, params, attempts FROM jobs "
+            "WHERE status = ? OR (status = ? AND lease_expires < ? AND attempts < max_attempts) ORDER BY id LIMIT 1",
+            (QUEUED, RUNNING, now)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        job_id, generator, params, attempts = row
+        conn.execute(
+            "UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? "
+            "WHERE id = ?",
+            (RUNNING, worker_id, now + lease_seconds, now, job_id)
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return job_id, generator, json.loads(params), attempts + 1
+
+
+def renew_lease(conn, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+    """Extend a running job's lease; returns False if the worker no longer owns it"""
+    cursor = conn.execute(
+        "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+        (time.time() + lease_seconds, time.time(), job_id, worker_id, RUNNING)
+    )
+    return cursor.rowcount == 1
+
+
+def complete(conn, job_id, worker_id, result):
+    """Mark a job done and store its result"""
+    conn.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, lease_expires = NULL, updated = ? "
+        "WHERE id = ? AND lease_owner = ?",
+        (DONE, json.dumps(result, default=str), time.time(), job_id, worker_id)
+    )
+
+
+def is_permanent(error):
+    """True for failures a retry would only repeat: bad parameters, missing inputs, permanent provider errors"""
+    if isinstance(error, (ValueError, KeyError, FileNotFoundError)):
+        return True
+    from providers import ProviderError
+    from scheduler import RETRYABLE_STATUSES
+    status = getattr(error, "status", None)
+    return isinstance(error, ProviderError) and status is not None and status not in RETRYABLE_STATUSES
+
+
+def fail(conn, job_id, worker_id, error):
+    """Record a failed attempt; the job is queued again until it runs out of attempts, unless the error is permanent"""
+    conn.execute(
+        "UPDATE jobs SET status = CASE WHEN ? OR attempts >= max_attempts THEN ? ELSE ? END, "
+        "error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? WHERE id = ? AND lease_owner = ?",
+        (is_permanent(error), FAILED, QUEUED, str(error), time.time(), job_id, worker_id)
+    )
+
+
+def queue_counts(path=QUEUE_PATH):
+    """Return {status: number of jobs}"""
+    if not os.path.exists(path):
+        return {}
+    conn = connect(path)
+    try:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    finally:
+        conn.close()
+
+
+def _keep_lease(path, job_id, worker_id, stop, lease_seconds, lost):
+    """Renew a job's lease every third of the lease time until stop is set; sets lost if it was taken away"""
+    conn = connect(path)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not renew_lease(conn, job_id, worker_id, lease_seconds):
+                lost.set()
+                return
+    finally:
+        conn.close()
+
+
+def worker_loop(path=QUEUE_PATH, worker_id=None, lease_seconds=LEASE_SECONDS, exit_when_empty=False):
+    """
+    Claim and run jobs until stopped (or until the queue is empty with exit_when_empty).
+    Returns the number of jobs this worker processed.
+    """
+    from jobs import run_job
+
+    # Lease-expired jobs may run twice; resumable mode (with the job's queue id as
+    # request id, below) makes the repeat pick up the already submitted predictions.
+    os.environ.setdefault("IMAGEGEN_RESUMABLE", "1")
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    # One metrics file per worker process so they don't overwrite each other
+    import metrics
+    metrics.set_export_path(os.path.join("logs", "metrics", f"worker_{socket.gethostname()}_{os.getpid()}.prom"))
+    conn = connect(path)
+    processed = 0
+    try:
+        while True:
+            job = claim(conn, worker_id, lease_seconds)
+            if job is None:
+                if exit_when_empty:
+                    return processed
+                time.sleep(IDLE_SLEEP)
+                continue
+
+            job_id, generator, params, attempt = job
+            print(f"[{worker_id}] job {job_id} ({generator}), attempt {attempt}")
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(
+                target=_keep_lease, args=(path, job_id, worker_id, stop, lease_seconds, lost), daemon=True
+            )
+            heartbeat.start()
+            try:
+                # The same id on every attempt, so a re-run resumes the job's predictions
+                record = run_job(generator, params, request_id=f"queue:{os.path.abspath(path)}:{job_id}")
+                if lost.is_set():
+                    print(f"[{worker_id}] job {job_id} finished after losing its lease; leaving it to its new owner")
+                else:
+                    complete(conn, job_id, worker_id, record)
+            except Exception as e:
+                print(f"[{worker_id}] job {job_id} failed: {e}")
+                if not lost.is_set():
+                    fail(conn, job_id, worker_id, e)
+            finally:
+                stop.set()
+                heartbeat.join()
+            processed += 1
+            metrics.write_metrics()
+    finally:
+        conn.close()
+
+
+def run_workers(num_workers, path=QUEUE_PATH, lease_seconds=LEASE_SECONDS, exit_when_empty=False):
+    """Run num_workers worker processes against the queue and wait for them"""
+    import multiprocessing
+
+    if num_workers <= 1:
+        worker_loop(path, lease_seconds=lease_seconds, exit_when_empty=exit_when_empty)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_loop,
+            kwargs={"path": path, "lease_seconds": lease_seconds, "exit_when_empty": exit_when_empty}
+        )
+        for _ in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
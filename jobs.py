@@ -0,0 +1,380 @@
+import os
+import time
+import importlib
+from datetime import datetime
+
+# Non-interactive job runners for every generator.
+# A job is a generator name plus a dict of parameters; run_job performs the
+# same generate -> save -> log steps as the interactive scripts, so it can be
+# driven from the command line, job files or background workers.
+
+UPLOAD_FOLDER = "images_to_upload"
+
+# generator name -> (module file, output folder)
+GENERATORS = {
+    "flux": ("flux_image_generator", "all_output/generated_images"),
+    "photomaker": ("photo_maker", "all_output/photo_maker"),
+    "face-to-many": ("face-to-many", "all_output/face_to_many_img"),
+    "sticker": ("image_to_sticker", "all_output/generated_stickers"),
+    "logo": ("logo_generator", "all_output/generated_logos"),
+}
+
+# Parameters each generator's job accepts, with their defaults
+JOB_DEFAULTS = {
+    "flux": {
+        "prompt": None,
+        "image_size": "landscape_4_3",
+        "num_images": 1,
+        "seed": None,
+    },
+    "photomaker": {
+        "folder": None,
+        "prompt": "A photo of a person img",
+        "style_name": "Photographic (Default)",
+        "num_steps": 20,
+        "num_outputs": 1,
+        "guidance_scale": 5,
+        "style_strength_ratio": 20,
+        "seed": None,
+        "negative_prompt": None,  # None means the script's default negative prompt
+        "disable_safety_checker": False,
+    },
+    "face-to-many": {
+        "image": None,
+        "style": "3D",
+        "prompt": "a person",
+        "seed": None,
+        "lora_scale": 1.0,
+        "custom_lora_url": None,
+        "negative_prompt": None,
+        "prompt_strength": 4.5,
+        "denoising_strength": 0.65,
+        "instant_id_strength": 1.0,
+        "control_depth_strength": 0.8,
+    },
+    "sticker": {
+        "image": None,
+        "prompt": "cartoon",
+        "prompt_strength": 4.5,
+        "instant_id_strength": 0.7,
+    },
+    "logo": {
+        "prompt": None,
+        "style_suffix": "",
+        "num_variations": 1,
+        "seed": None,
+        "max_concurrency": 5,
+    },
+}
+
+# Job parameter each generator takes its uploaded input from
+INPUT_PARAMS = {"face-to-many": "image", "sticker": "image", "photomaker": "folder"}
+
+# Parameters a job must set because they have no sensible default
+REQUIRED_PARAMS = {
+    "flux": ["prompt"],
+    "photomaker": ["folder"],
+    "face-to-many": ["image"],
+    "sticker": ["image"],
+    "logo": ["prompt"],
+}
+
+
+def load_generator(generator):
+    """Import and return the script module implementing a generator"""
+    if generator not in GENERATORS:
+        raise ValueError(f"Unknown generator '{generator}'. Choose from: {', '.join(GENERATORS)}")
+    # import_module also handles the hyphenated face-to-many.py file name
+    return importlib.import_module(GENERATORS[generator][0])
+
+
+def resolve_params(generator, params):
+    """Merge params over the generator defaults and check required values are set"""
+    if generator not in JOB_DEFAULTS:
+        raise ValueError(f"Unknown generator '{generator}'. Choose from: {', '.join(GENERATORS)}")
+    unknown = set(params) - set(JOB_DEFAULTS[generator]) - {"use_cache"}
+    if unknown:
+        raise ValueError(f"Unknown parameters for {generator}: {', '.join(sorted(unknown))}")
+
+    resolved = dict(JOB_DEFAULTS[generator])
+    resolved.update({k: v for k, v in params.items() if v is not None})
+    missing = [name for name in REQUIRED_PARAMS[generator] if resolved.get(name) in (None, "")]
+    if missing:
+        raise ValueError(f"Missing required parameters for {generator}: {', '.join(missing)}")
+    return resolved
+
+
+def upload_path(name):
+    """
+    Path of a name inside the upload folder, for inputs from untrusted callers
+    such as the HTTP service. Absolute paths, '..' and symlinks leading out of
+    the upload folder are rejected with ValueError.
+    """
+    if not isinstance(name, str) or not name or os.path.isabs(name) or ".." in name.replace("\\", "/").split("/"):
+        raise ValueError(f"Inputs must be names inside {UPLOAD_FOLDER}: {name!r}")
+    root = os.path.realpath(UPLOAD_FOLDER)
+    path = os.path.join(UPLOAD_FOLDER, name)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise ValueError(f"Inputs must be names inside {UPLOAD_FOLDER}: {name!r}")
+    return path
+
+
+def restrict_inputs(generator, params):
+    """Return params with the generator's input resolved by upload_path"""
+    param = INPUT_PARAMS.get(generator)
+    if param is None or params.get(param) is None:
+        return params
+    return dict(params, **{param: upload_path(params[param])})
+
+
+def _resolve_input(path, kind):
+    """Accept absolute/relative paths or names inside the upload folder"""
+    if os.path.exists(path):
+        return path
+    candidate = os.path.join(UPLOAD_FOLDER, path)
+    if os.path.exists(candidate):
+        return candidate
+    raise FileNotFoundError(f"Input {kind} not found: {path}")
+
+
+def _run_flux(module, params, output_folder, use_cache):
+    started = time.time()
+    result = module.generate_image(
+        params["prompt"], params["image_size"], params["num_images"], params["seed"], use_cache=use_cache
+    )
+    request_id = module.new_request_id()
+    saved_images = module.save_images(result, output_folder, request_id)
+    log_data = {
+        "request_id": request_id,
+        "timestamp": datetime.now().isoformat(),
+        "prompt": params["prompt"],
+        "image_size": params["image_size"],
+        "num_images": params["num_images"],
+        "seed": params["seed"],
+        "output_images": saved_images,
+        "api_response": result
+    }
+    log_data["duration_seconds"] = round(time.time() - started, 3)
+    module.save_request_log(log_data)
+    return log_data
+
+
+def _run_photomaker(module, params, output_folder, use_cache):
+    started = time.time()
+    folder_path = _resolve_input(params["folder"], "folder")
+    folder_name = os.path.basename(os.path.normpath(folder_path))
+    images = module.get_images_from_folder(folder_path)
+    if not images:
+        raise FileNotFoundError(f"No images found in {folder_path}")
+
+    prompt = params["prompt"]
+    if "img" not in prompt:
+        prompt += " img"
+    negative_prompt = params["negative_prompt"] or module.DEFAULT_NEGATIVE_PROMPT
+
+    output_urls = module.generate_photo(
+        images,
+        prompt=prompt,
+        num_steps=params["num_steps"],
+        style_name=params["style_name"],
+        num_outputs=params["num_outputs"],
+        guidance_scale=params["guidance_scale"],
+        negative_prompt=negative_prompt,
+        style_strength_ratio=params["style_strength_ratio"],
+        seed=params["seed"],
+        disable_safety_checker=params["disable_safety_checker"],
+        use_cache=use_cache
+    )
+    if not output_urls:
+        raise RuntimeError("Failed to generate photos")
+
+    request_id = module.new_request_id()
+    numbered_urls = list(enumerate(output_urls, 1))
+    saved_paths = module.save_all(
+        numbered_urls,
+        lambda item: module.save_image(item[1], output_folder, f"photomaker_{folder_name}_{item[0]}", request_id)
+    )
+    log_data = {
+        "request_id": request_id,
+        "timestamp": datetime.now(),
+        "input_folder": folder_name,
+        "input_images": images[:4],
+        "prompt": prompt,
+        "style_name": params["style_name"],
+        "num_steps": params["num_steps"],
+        "num_outputs": params["num_outputs"],
+        "guidance_scale": params["guidance_scale"],
+        "style_strength_ratio": params["style_strength_ratio"],
+        "seed": params["seed"],
+        "negative_prompt": negative_prompt,
+        "disable_safety_checker": params["disable_safety_checker"],
+        "output_images": [path for path in saved_paths if path],
+        "output_urls": output_urls
+    }
+    log_data["duration_seconds"] = round(time.time() - started, 3)
+    module.save_request_log(log_data)
+    return log_data
+
+
+def _run_face_to_many(module, params, output_folder, use_cache):
+    started = time.time()
+    image_path = _resolve_input(params["image"], "image")
+    output_url = module.generate_transformed_face(
+        image_path,
+        style=params["style"],
+        prompt=params["prompt"],
+        seed=params["seed"],
+        lora_scale=params["lora_scale"],
+        custom_lora_url=params["custom_lora_url"],
+        negative_prompt=params["negative_prompt"],
+        prompt_strength=params["prompt_strength"],
+        denoising_strength=params["denoising_strength"],
+        instant_id_strength=params["instant_id_strength"],
+        control_depth_strength=params["control_depth_strength"],
+        use_cache=use_cache
+    )
+    if not output_url:
+        raise RuntimeError("Failed to generate transformed image")
+
+    request_id = module.new_request_id()
+    saved_path = module.save_image(output_url, output_folder, request_id=request_id)
+    log_data = {
+        "request_id": request_id,
+        "timestamp": datetime.now(),
+        "input_image": image_path,
+        "style": params["style"],
+        "prompt": params["prompt"],
+        "seed": params["seed"],
+        "lora_scale": params["lora_scale"],
+        "custom_lora_url": params["custom_lora_url"],
+        "negative_prompt": params["negative_prompt"],
+        "prompt_strength": params["prompt_strength"],
+        "denoising_strength": params["denoising_strength"],
+        "instant_id_strength": params["instant_id_strength"],
+        "control_depth_strength": params["control_depth_strength"],
+        "output_image": saved_path,
+        "output_url": output_url
+    }
+    log_data["duration_seconds"] = round(time.time() - started, 3)
+    module.save_request_log(log_data)
+    return log_data
+
+
+def _run_sticker(module, params, output_folder, use_cache):
+    started = time.time()
+    image_path = _resolve_input(params["image"], "image")
+    sticker_url = module.generate_sticker(
+        image_path,
+        params["prompt"],
+        params["prompt_strength"],
+        params["instant_id_strength"]
+    )
+    if not sticker_url:
+        raise RuntimeError("Failed to generate sticker")
+
+    request_id = module.new_request_id()
+    saved_path = module.save_image(sticker_url, output_folder, request_id=request_id)
+    log_data = {
+        "request_id": request_id,
+        "timestamp": datetime.now(),
+        "input_image": image_path,
+        "style_prompt": params["prompt"],
+        "prompt_strength": params["prompt_strength"],
+        "instant_id_strength": params["instant_id_strength"],
+        "output_image": saved_path,
+        "sticker_url": sticker_url
+    }
+    log_data["duration_seconds"] = round(time.time() - started, 3)
+    module.save_request_log(log_data)
+    return log_data
+
+
+def _run_logo(module, params, output_folder, use_cache):
+    started = time.time()
+    num_variations = max(1, min(5, int(params["num_variations"])))
+    logo_urls = module.generate_logo(
+        params["prompt"], num_variations, params["style_suffix"], seed=params["seed"], use_cache=use_cache,
+        max_concurrency=params["max_concurrency"]
+    )
+    if not logo_urls:
+        raise RuntimeError("Failed to generate logos")
+
+    request_id = module.new_request_id()
+    saved_logos = module.save_all(logo_urls, lambda url: module.save_image(url, output_folder, request_id=request_id))
+    log_data = {
+        "request_id": request_id,
+        "timestamp": datetime.now(),
+        "base_prompt": params["prompt"],
+        "style_suffix": params["style_suffix"],
+        "num_variations": num_variations,
+        "seed": params["seed"],
+        "output_images": [path for path in saved_logos if path],
+        "generation_urls": logo_urls
+    }
+    log_data["duration_seconds"] = round(time.time() - started, 3)
+    module.save_request_log(log_data)
+    return log_data
+
+
+_RUNNERS = {
+    "flux": _run_flux,
+    "photomaker": _run_photomaker,
+    "face-to-many": _run_face_to_many,
+    "sticker": _run_sticker,
+    "logo": _run_logo,
+}
+
+
+def run_job(generator, params, output_folder=None, request_id=None):
+    """
+    Run one generation job end to end and return its log record.
+    :param generator: One of GENERATORS (flux, photomaker, face-to-many, sticker, logo)
+    :param params: Job parameters; missing ones take the JOB_DEFAULTS values
+    :param output_folder: Override the generator's default output folder
+    :param request_id: Stable id of the job (e.g. its queue id), so a re-run resumes its
+        unseeded predictions in resumable mode instead of submitting them again
+    """
+    params = resolve_params(generator, params)
+    use_cache = params.pop("use_cache", True)
+    module = load_generator(generator)
+    output_folder = output_folder or GENERATORS[generator][1]
+    os.makedirs(output_folder, exist_ok=True)
+    if request_id is None:
+        return _RUNNERS[generator](module, params, output_folder, use_cache)
+    from predictions import stable_request
+    with stable_request(request_id):
+        return _RUNNERS[generator](module, params, output_folder, use_cache)
+
+
+def load_job_file(path):
+    """
+    Read jobs from a YAML, JSON or JSONL file.
+    Each job is a mapping with a 'generator' key and that generator's parameters,
+    either at the top level or under 'params'. YAML and JSON files may hold a
+    single job, a list of jobs, or a mapping with a 'jobs' list.
+    """
+    import json
+
+    with open(path, 'r') as f:
+        text = f.read()
+
+    if path.endswith(".jsonl"):
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    elif path.endswith((".yaml", ".yml")):
+        import yaml  # PyYAML is only needed for YAML job files
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+
+    if isinstance(data, dict):
+        data = data.get("jobs", [data])
+
+    jobs = []
+    for job in data or []:
+        job = dict(job)
+        generator = job.pop("generator", None)
+        if generator is None:
+            raise ValueError(f"Job without a 'generator' in {path}: {job}")
+        params = job.pop("params", job)
+        jobs.append((generator, params))
+    return jobs
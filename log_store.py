@@ -0,0 +1,213 @@
+import os
+import json
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from metrics import span
+
+# Shared append-only request log used by all the generator scripts.
+# Every record is one JSON line, so writing a log entry costs the same
+# no matter how much history is already on disk.
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024  # rotate once the active file reaches 50 MB
+DEFAULT_BACKUP_COUNT = 20
+
+_migration_checked = set()  # JSONL paths whose legacy log this process already looked for
+_migration_lock = threading.Lock()
+_rotation_lock = threading.Lock()
+
+
+def sanitize_for_json(obj):
+    """Convert datetimes, bytes and SDK objects into JSON serializable values"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, bytes):
+        return str(obj)
+    elif isinstance(obj, dict):
+        return {k: sanitize_for_json(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [sanitize_for_json(item) for item in obj]
+    elif hasattr(obj, 'url'):  # Handle replicate FileOutput objects
+        return str(obj.url)
+    else:
+        return str(obj) if hasattr(obj, '__dict__') else obj
+
+
+def log_path(log_file_name, logs_folder="logs"):
+    """Return the path of the JSONL log for a log name (legacy '.json' names are mapped to '.jsonl')"""
+    base, ext = os.path.splitext(log_file_name)
+    if ext == ".json":
+        log_file_name = base + ".jsonl"
+    return os.path.join(logs_folder, log_file_name)
+
+
+def rotated_files(path):
+    """Existing rotated files of a log as [(index, path)], newest (.1) first; gaps are skipped"""
+    folder, name = os.path.split(path)
+    prefix = name + "."
+    try:
+        names = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return []
+    indices = sorted(int(n[len(prefix):]) for n in names if n.startswith(prefix) and n[len(prefix):].isdigit())
+    return [(i, f"{path}.{i}") for i in indices]
+
+
+def _rotated_count(path):
+    """Highest rotated index in use"""
+    rotated = rotated_files(path)
+    return rotated[-1][0] if rotated else 0
+
+
+@contextlib.contextmanager
+def _locked_rotation(path):
+    """
+    Serialize rotation of a log across threads and, with fcntl, across processes
+    (service threads, download threads and queue workers all append to the same logs).
+    """
+    with _rotation_lock:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def migrate_legacy_log(jsonl_path):
+    """
+    Convert an old pretty-printed JSON array log next to jsonl_path into JSONL.
+    The records are written as the oldest rotated file, so the active log
+    (which other processes may be appending to) is never rewritten.
+    Runs once: the legacy file is renamed to '<name>.json.migrated' afterwards.
+    """
+    legacy_path = os.path.splitext(jsonl_path)[0] + ".json"
+    if not os.path.exists(legacy_path):
+        return 0
+
+    # Renaming is atomic, so only one process gets to migrate the file
+    claimed_path = f"{legacy_path}.{os.getpid()}.migrating"
+    try:
+        os.replace(legacy_path, claimed_path)
+    except FileNotFoundError:
+        return 0
+
+    try:
+        with open(claimed_path, 'r') as f:
+            records = json.load(f)
+    except json.JSONDecodeError:
+        os.replace(claimed_path, legacy_path)
+        print(f"Warning: legacy log {legacy_path} is corrupted, leaving it untouched.")
+        return 0
+    if not isinstance(records, list):
+        records = [records]
+
+    folder = os.path.dirname(jsonl_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".migrating_", suffix=".tmp")
+    with os.fdopen(fd, 'w') as out:
+        for record in records:
+            out.write(json.dumps(sanitize_for_json(record)) + "\n")
+        out.flush()
+        os.fsync(out.fileno())
+    # read_log reads rotated files oldest first, so legacy history stays in front
+    with _locked_rotation(jsonl_path):
+        os.replace(tmp_path, f"{jsonl_path}.{_rotated_count(jsonl_path) + 1}")
+    os.replace(claimed_path, legacy_path + ".migrated")
+
+    print(f"Migrated {len(records)} records from {legacy_path} to {jsonl_path}")
+    return len(records)
+
+
+def _migrate_once(jsonl_path):
+    """migrate_legacy_log, but only the first time this process appends to a log"""
+    if jsonl_path in _migration_checked:
+        return
+    with _migration_lock:
+        if jsonl_path not in _migration_checked:
+            migrate_legacy_log(jsonl_path)
+            _migration_checked.add(jsonl_path)
+
+
+def rotate_log(path, backup_count=DEFAULT_BACKUP_COUNT):
+    """
+    Shift path -> path.1 -> path.2 ... dropping the files past backup_count.
+    Callers hold _locked_rotation; a missing active file means it was just rotated.
+    """
+    if not os.path.exists(path):
+        return
+    for i, rotated in reversed(rotated_files(path)):
+        if i >= backup_count:
+            os.remove(rotated)
+        else:
+            os.replace(rotated, f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def append_log(
+    log_data,
+    log_file_name,
+    logs_folder="logs",
+    fsync=True,
+    max_bytes=DEFAULT_MAX_BYTES,
+    backup_count=DEFAULT_BACKUP_COUNT
+):
+    """
+    Append one record to a JSONL log and return the log file path.
+    :param log_data: Dict to log; datetimes and SDK objects are sanitized first
+    :param log_file_name: Name of the log file inside logs_folder
+    :param fsync: Flush the record to disk before returning
+    :param max_bytes: Rotate the active file once it grows past this size (0 disables rotation)
+    :param backup_count: Number of rotated files to keep
+    """
+    os.makedirs(logs_folder, exist_ok=True)
+    path = log_path(log_file_name, logs_folder)
+    _migrate_once(path)
+
+    if max_bytes and _size(path) >= max_bytes:
+        with _locked_rotation(path):
+            if _size(path) >= max_bytes:  # another writer may have rotated it meanwhile
+                rotate_log(path, backup_count)
+
+    line = json.dumps(sanitize_for_json(log_data)) + "\n"
+    with span("log_write"):
+        # A single O_APPEND write keeps concurrent writers from interleaving records
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+    return path
+
+
+def read_log(log_file_name, logs_folder="logs"):
+    """Yield records from a JSONL log, oldest rotated file first, skipping truncated lines"""
+    path = log_path(log_file_name, logs_folder)
+    rotated = [file_path for _, file_path in rotated_files(path)]
+    for file_path in list(reversed(rotated)) + [path]:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can only damage the last line of a file
+                    continue
@@ -1,124 +1,94 @@
-import replicate
 import os
-from dotenv import load_dotenv
 from datetime import datetime
-import requests
-import json
+from env import load_env
+from downloader import download_content_addressed, save_all
+from output_index import new_request_id, record_output
+from thumbnails import schedule_thumbnails
+from log_store import append_log
+from result_cache import cached_run
+from predictions import run_prediction
+from concurrency import run_bounded
 
-# Load environment variables from .env file
-load_dotenv()
+STYLE_SUFFIXES = [
+    "",  # Default, no style suffix
+    "minimalistic, clean, modern",
+    "luxurious, elegant, high-end",
+    "playful, creative, bold",
+    "tech, futuristic, innovative",
+    "professional, corporate, trustworthy"
+]
 
-def generate_logo(prompt, num_variations=1, style_suffix=""):
+MODEL = "mejiabrayan/logoai:67ed00e8999fecd32035074fa0f2e9a31ee03b57a8415e6a5e2f93a242ddd8d2"
+
+def generate_variation(full_prompt, seed=None, use_cache=True):
+    """Generate a single logo variation and return its output URLs"""
+    input_params = {
+        "prompt": full_prompt,
+    }
+    if seed is not None:
+        input_params["seed"] = seed
+
+    output = cached_run(MODEL, input_params, lambda: run_prediction(MODEL, input_params), use_cache)
+    # Convert the output to a list of strings if it isn't already
+    if isinstance(output, (list, tuple)):
+        return [str(url) for url in output]
+    return [str(output)]
+
+def generate_logo(prompt, num_variations=1, style_suffix="", seed=None, use_cache=True, max_concurrency=5):
     """
     Generate logo using Replicate API
     :param prompt: The text prompt for logo generation
     :param num_variations: Number of variations to generate
     :param style_suffix: Optional style modifier to append to the prompt
+    :param seed: Optional base seed; variation i uses seed + i so results are reproducible
+    :param use_cache: Reuse cached results for seeded requests instead of calling the API again
+    :param max_concurrency: Maximum number of variations generated at the same time
     """
     # Enhance prompt with style suffix if provided
     full_prompt = f"{prompt} {style_suffix}".strip()
     
-    # List to store all generated URLs
+    # List to store all generated URLs, in completion order
     all_outputs = []
     
-    # Generate specified number of variations
-    for _ in range(num_variations):
-        input_params = {
-            "prompt": full_prompt,
-        }
-        
-        try:
-            output = replicate.run(
-                "mejiabrayan/logoai:67ed00e8999fecd32035074fa0f2e9a31ee03b57a8415e6a5e2f93a242ddd8d2",
-                input=input_params
-            )
-            # Convert the output to a list of strings if it isn't already
-            if isinstance(output, (list, tuple)):
-                all_outputs.extend([str(url) for url in output])
-            else:
-                all_outputs.append(str(output))
-        except Exception as e:
-            print(f"Error generating logo: {e}")
+    # The model returns one logo per call, so variations are requested concurrently.
+    # A failed variation is reported but doesn't discard the others.
+    seeds = [seed + i if seed is not None else None for i in range(num_variations)]
+    for _, urls, error in run_bounded(
+        lambda variation_seed: generate_variation(full_prompt, variation_seed, use_cache),
+        seeds,
+        max_concurrency
+    ):
+        if error is not None:
+            print(f"Error generating logo: {error}")
+        else:
+            all_outputs.extend(urls)
     
     return all_outputs
 
-def save_image(url, folder, prefix="logo"):
-    """Save an image from URL to the specified folder"""
-    response = requests.get(url)
-    if response.status_code == 200:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{prefix}_{timestamp}.png"
-        filepath = os.path.join(folder, filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+def save_image(url, folder, prefix="logo", request_id=None):
+    """Save an image from URL to the specified folder, named after its content hash"""
+    saved = download_content_addressed(url, folder, ".png")
+    if saved is not None:
+        filepath, digest, _ = saved
+        record_output(request_id, digest, filepath, url, prefix)
+        schedule_thumbnails(filepath)
         print(f"Logo saved: {filepath}")
         return filepath
     else:
         print(f"Failed to download logo from {url}")
         return None
 
-def save_request_log(log_data, logs_folder="logs", log_file_name="logo_generation_log.json"):
-    """
-    Save the request log to a single JSON file in the logs folder.
-    Appends new data to existing log file.
-    """
-    # Create logs folder if it doesn't exist
-    os.makedirs(logs_folder, exist_ok=True)
-    
-    log_file_path = os.path.join(logs_folder, log_file_name)
-
-    # Convert datetime to string if it exists in log_data
-    if isinstance(log_data.get('timestamp'), datetime):
-        log_data['timestamp'] = log_data['timestamp'].isoformat()
-    
-    # Ensure all data is JSON serializable
-    def sanitize_for_json(obj):
-        if isinstance(obj, (datetime, bytes)):
-            return str(obj)
-        elif isinstance(obj, dict):
-            return {k: sanitize_for_json(v) for k, v in obj.items()}
-        elif isinstance(obj, (list, tuple)):
-            return [sanitize_for_json(item) for item in obj]
-        else:
-            return str(obj) if hasattr(obj, '__dict__') else obj
-
-    # Sanitize the log data
-    log_data = sanitize_for_json(log_data)
-
+def save_request_log(log_data, logs_folder="logs", log_file_name="logo_generation_log.jsonl"):
+    """Append the request log to a JSONL file in the logs folder"""
     try:
-        # Load existing data or create empty list
-        if os.path.exists(log_file_path):
-            try:
-                with open(log_file_path, 'r') as f:
-                    existing_data = json.load(f)
-            except json.JSONDecodeError:
-                print("Warning: Existing log file was corrupted. Creating new log.")
-                existing_data = []
-        else:
-            existing_data = []
-        
-        # Append new data
-        existing_data.append(log_data)
-        
-        # Write updated data back to file
-        with open(log_file_path, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        
+        log_file_path = append_log(log_data, log_file_name, logs_folder)
         print(f"Request log saved to {log_file_path}")
     except Exception as e:
         print(f"Error saving log: {e}")
 
 def get_style_choice():
     """Present a menu for logo style selection"""
-    style_options = {
-        1: "",  # Default, no style suffix
-        2: "minimalistic, clean, modern",
-        3: "luxurious, elegant, high-end",
-        4: "playful, creative, bold",
-        5: "tech, futuristic, innovative",
-        6: "professional, corporate, trustworthy"
-    }
+    style_options = dict(enumerate(STYLE_SUFFIXES, 1))
     
     while True:
         print("\nChoose a logo style:")
@@ -136,6 +106,9 @@ def get_style_choice():
             print("Invalid input. Please enter a number.")
 
 if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_env()
+
     # Check for API key
     replicate_api_key = os.getenv("REPLICATE_API_TOKEN")
     if not replicate_api_key:
@@ -160,16 +133,15 @@ if __name__ == "__main__":
     logo_urls = generate_logo(base_prompt, num_variations, style_suffix)
 
     # Save generated logos
-    saved_logos = []
-    for url in logo_urls:
-        saved_path = save_image(url, logo_folder)
-        if saved_path:
-            saved_logos.append(saved_path)
+    request_id = new_request_id()
+    saved_logos = save_all(logo_urls, lambda url: save_image(url, logo_folder, request_id=request_id))
+    saved_logos = [path for path in saved_logos if path]
 
     print(f"\nSaved {len(saved_logos)} logos in the '{logo_folder}' folder.")
 
     # Prepare and save log data
     log_data = {
+        "request_id": request_id,
         "timestamp": datetime.now(),
         "base_prompt": base_prompt,
         "style_suffix": style_suffix,
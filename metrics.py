@@ -0,0 +1,170 @@
+import os
+import time
+import atexit
+import bisect
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Per-stage latency and cost instrumentation.
+#
+# Pipeline stages (preprocess, encode, upload, queue_wait, inference, download,
+# disk_write, log_write) are timed with span() and kept as Prometheus-style
+# histograms, next to request counters and estimated per-model cost counters.
+# Everything is written in Prometheus text format to IMAGEGEN_METRICS_FILE
+# (default logs/metrics.prom) when the process exits, and served on /metrics
+# by the HTTP service.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RECENT_SAMPLES = 1000  # samples kept per series for percentile summaries
+
+# Estimated USD prices; adjust to your plan.
+# per_image: charged per output image; per_second: charged per second of prediction time.
+MODEL_COSTS = {
+    "fal-ai/flux-pro/v1.1": {"per_image": 0.04},
+    "tencentarc/photomaker": {"per_second": 0.000725},
+    "fofr/face-to-many": {"per_second": 0.000725},
+    "fofr/face-to-sticker": {"per_second": 0.000725},
+    "mejiabrayan/logoai": {"per_second": 0.000725},
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (stage, model) -> {"buckets": [...], "sum": float, "count": int, "recent": deque}
+_counters = {}    # (name, labels tuple) -> float
+_gauges = {}      # (name, labels tuple) -> float
+_export_path = os.getenv("IMAGEGEN_METRICS_FILE", os.path.join("logs", "metrics.prom"))
+
+
+def observe(stage, seconds, model=""):
+    """Record the duration of one pipeline stage"""
+    model = str(model).split(":")[0]
+    with _lock:
+        series = _histograms.get((stage, model))
+        if series is None:
+            series = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0, "recent": deque(maxlen=RECENT_SAMPLES)}
+            _histograms[(stage, model)] = series
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(BUCKETS):
+            series["buckets"][index] += 1
+        series["sum"] += seconds
+        series["count"] += 1
+        series["recent"].append(seconds)
+
+
+@contextmanager
+def span(stage, model=""):
+    """Time the enclosed block as one observation of stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, model)
+
+
+def increment(name, value=1.0, **labels):
+    """Add value to a counter"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to value"""
+    with _lock:
+        _gauges[(name, tuple(sorted(labels.items())))] = value
+
+
+def record_cost(model, num_images=1, predict_seconds=None):
+    """Add the estimated cost of a finished prediction to the model's cost counter"""
+    name = str(model).split(":")[0]
+    prices = MODEL_COSTS.get(name)
+    if not prices:
+        return 0.0
+    cost = prices.get("per_image", 0.0) * num_images
+    if predict_seconds is not None:
+        cost += prices.get("per_second", 0.0) * predict_seconds
+    increment("imagegen_cost_usd_total", cost, model=name)
+    return cost
+
+
+def percentile(stage, q, model=None):
+    """Return the q-th percentile (0-100) of recent samples for stage, across models unless one is given"""
+    with _lock:
+        samples = []
+        for (series_stage, series_model), series in _histograms.items():
+            if series_stage == stage and (model is None or series_model == str(model).split(":")[0]):
+                samples.extend(series["recent"])
+    if not samples:
+        return None
+    samples.sort()
+    index = min(len(samples) - 1, max(0, int(round(q / 100 * (len(samples) - 1)))))
+    return samples[index]
+
+
+def counter_total(name):
+    """Return the sum of a counter across all its label sets"""
+    with _lock:
+        return sum(value for (series_name, _), value in _counters.items() if series_name == name)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels]
+    return "{" + ",".join(escaped) + "}"
+
+
+def render():
+    """Return all metrics in Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        if _histograms:
+            lines.append("# HELP imagegen_stage_seconds Time spent in each pipeline stage")
+            lines.append("# TYPE imagegen_stage_seconds histogram")
+            for (stage, model), series in sorted(_histograms.items()):
+                labels = [("stage", stage), ("model", model)]
+                cumulative = 0
+                for bound, count in zip(BUCKETS, series["buckets"]):
+                    cumulative += count
+                    lines.append(f"imagegen_stage_seconds_bucket{_format_labels(labels + [('le', bound)])} {cumulative}")
+                lines.append(f"imagegen_stage_seconds_bucket{_format_labels(labels + [('le', '+Inf')])} {series['count']}")
+                lines.append(f"imagegen_stage_seconds_sum{_format_labels(labels)} {series['sum']:.6f}")
+                lines.append(f"imagegen_stage_seconds_count{_format_labels(labels)} {series['count']}")
+
+        for kind, values in (("counter", _counters), ("gauge", _gauges)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (series_name, labels), value in sorted(values.items()):
+                    if series_name == name:
+                        lines.append(f"{name}{_format_labels(labels)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def set_export_path(path):
+    """Change where write_metrics() writes by default"""
+    global _export_path
+    _export_path = path
+
+
+def write_metrics(path=None):
+    """Atomically write the metrics to path (default IMAGEGEN_METRICS_FILE)"""
+    path = path or _export_path
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+    return path
+
+
+def _write_at_exit():
+    if _histograms or _counters:
+        try:
+            write_metrics()
+        except OSError as e:
+            print(f"Could not write metrics: {e}")
+
+
+atexit.register(_write_at_exit)
@@ -0,0 +1,46 @@
+import uuid
+from datetime import datetime
+from log_store import append_log, read_log
+
+# Index mapping request ids to the content hashes of the images they produced.
+# Output files are named after their SHA-256, so this is the only place that
+# remembers which request (and which save_image prefix) an image came from.
+
+INDEX_LOG_NAME = "output_index.jsonl"
+
+
+def new_request_id():
+    """Return a new unique id for a generation request"""
+    return uuid.uuid4().hex
+
+
+def record_output(request_id, digest, filepath, url=None, label=None, logs_folder="logs"):
+    """Append one request id -> output hash entry to the index"""
+    append_log({
+        "timestamp": datetime.now().isoformat(),
+        "request_id": request_id,
+        "sha256": digest,
+        "path": filepath,
+        "url": url,
+        "label": label
+    }, INDEX_LOG_NAME, logs_folder, fsync=False)
+    if url:
+        # Lets a later cache hit for the same seeded request be served from this file
+        from result_cache import remember_output
+        remember_output(str(url), filepath, digest)
+
+
+def find_outputs(request_id, logs_folder="logs"):
+    """Return the index entries recorded for request_id"""
+    return [
+        entry for entry in read_log(INDEX_LOG_NAME, logs_folder)
+        if entry.get("request_id") == request_id
+    ]
+
+
+def find_requests(digest, logs_folder="logs"):
+    """Return the request ids that produced an output with the given SHA-256 (or prefix of it)"""
+    return sorted({
+        entry["request_id"] for entry in read_log(INDEX_LOG_NAME, logs_folder)
+        if entry.get("sha256", "").startswith(digest) and entry.get("request_id")
+    })
@@ -0,0 +1,195 @@
+import os
+
+# Perceptual hashes for near-duplicate detection across saved outputs.
+#
+# aHash, dHash and pHash are 64-bit fingerprints computed with NumPy from a
+# downscaled grayscale copy of an image. Visually similar images have hashes a
+# small Hamming distance apart, even when their bytes differ (re-encodes,
+# seeded reruns, sweep cells that barely changed). They are computed by the
+# thumbnail workers right after each save and stored in the thumbnail
+# manifest; find_clusters groups near-duplicates with a vectorized Hamming
+# distance search.
+#
+# Needs NumPy and Pillow.
+
+HASH_KINDS = ("ahash", "dhash", "phash")
+DEFAULT_KIND = "phash"
+DEFAULT_RADIUS = 8  # max differing bits (of 64) for two images to count as near-duplicates
+DUPLICATES_FOLDER = os.path.join("all_output", ".duplicates")
+
+_dct_matrix = None
+
+
+def numpy_available():
+    import importlib.util
+    return importlib.util.find_spec("numpy") is not None
+
+
+def _to_int(bits):
+    import numpy as np
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _grayscale(image, width, height):
+    import numpy as np
+    from PIL import Image
+    return np.asarray(image.convert("L").resize((width, height), Image.LANCZOS), dtype=np.float32)
+
+
+def _dct(size=32):
+    """Orthonormal DCT-II matrix, so the 2D transform of X is D @ X @ D.T"""
+    global _dct_matrix
+    if _dct_matrix is None or _dct_matrix.shape[0] != size:
+        import numpy as np
+        k = np.arange(size)[:, None]
+        n = np.arange(size)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+        matrix[0] /= np.sqrt(2.0)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+
+def image_hashes(image):
+    """Return {"ahash", "dhash", "phash"} of a PIL image as 16-digit hex strings"""
+    import numpy as np
+
+    small = _grayscale(image, 8, 8)
+    ahash = _to_int(small > small.mean())
+
+    wide = _grayscale(image, 9, 8)
+    dhash = _to_int(wide[:, 1:] > wide[:, :-1])
+
+    pixels = _grayscale(image, 32, 32)
+    dct = _dct()
+    low = (dct @ pixels @ dct.T)[:8, :8]
+    # The DC term only reflects overall brightness, so it's left out of the median
+    phash = _to_int(low > np.median(low.ravel()[1:]))
+
+    return {kind: f"{value:016x}" for kind, value in zip(HASH_KINDS, (ahash, dhash, phash))}
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes (ints or hex strings)"""
+    if isinstance(a, str):
+        a = int(a, 16)
+    if isinstance(b, str):
+        b = int(b, 16)
+    return bin(a ^ b).count("1")
+
+
+def _popcount(values):
+    """Set bits of each element of a uint64 array"""
+    import numpy as np
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+        return np.bitwise_count(values)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def near_pairs(values, radius, block_elements=1 << 22):
+    """
+    Yield (i, j) with i < j for every pair of hashes within radius bits.
+    Compares a block of rows against all later hashes at a time with NumPy
+    (about block_elements XORs, 32 MB, per step). This beats a BK-tree at the
+    radii useful here: a radius of 8 out of 64 bits prunes very few branches.
+    """
+    import numpy as np
+    values = np.asarray(values, dtype=np.uint64)
+    block = max(1, block_elements // max(1, len(values)))
+    for start in range(0, len(values), block):
+        rows = values[start:start + block]
+        distances = _popcount(rows[:, None] ^ values[None, start:])
+        i, j = np.nonzero(distances <= radius)
+        keep = j > i  # the block's own diagonal and lower triangle are not pairs
+        yield from zip((i[keep] + start).tolist(), (j[keep] + start).tolist())
+
+
+def find_clusters(entries, radius=DEFAULT_RADIUS, kind=DEFAULT_KIND):
+    """
+    Group near-duplicate entries around the image each group keeps (choose_keeper):
+    every member of a cluster is within radius of its keeper, so pruning a cluster
+    never removes an image that is far from the one kept.
+    :param entries: Dicts with a "source" path and a "hashes" dict
+    Returns clusters (lists of entries) with more than one member, largest first.
+    """
+    import numpy as np
+
+    entries = [entry for entry in entries if entry.get("hashes", {}).get(kind)]
+    values = np.array([int(entry["hashes"][kind], 16) for entry in entries], dtype=np.uint64)
+
+    # Union-find narrows the search down to connected candidates first
+    parent = list(range(len(entries)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in near_pairs(values, radius):
+        a, b = root(i), root(j)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+    components = {}
+    for index in range(len(entries)):
+        components.setdefault(root(index), []).append(index)
+
+    # Near-duplicates chain (A~B~C...), so a component can span images far apart:
+    # split it into groups within radius of their keeper
+    clusters = []
+    for members in components.values():
+        remaining = members
+        while len(remaining) > 1:
+            keeper = min(remaining, key=lambda i: _keeper_order(entries[i]))
+            indices = np.array(remaining)
+            close = _popcount(values[indices] ^ values[keeper]) <= radius
+            group = indices[close].tolist()
+            if len(group) > 1:
+                clusters.append([entries[keeper]] + [entries[i] for i in group if i != keeper])
+            remaining = indices[~close].tolist()
+    clusters.sort(key=len, reverse=True)
+    return clusters
+
+
+def _keeper_order(entry):
+    return entry.get("mtime_ns", 0), len(entry["source"]), entry["source"]
+
+
+def choose_keeper(cluster):
+    """The member to keep: the oldest file, then the shortest path"""
+    return min(cluster, key=_keeper_order)
+
+
+def load_hash_index(folders=None):
+    """Manifest entries of outputs (under folders, if given) that still exist and have hashes"""
+    from thumbnails import load_manifest
+    prefixes = tuple(os.path.join(os.path.normpath(folder), "") for folder in folders or [])
+    return [
+        entry for entry in load_manifest().values()
+        if entry.get("hashes") and (not prefixes or entry["source"].startswith(prefixes))
+        and os.path.exists(entry["source"])
+    ]
+
+
+def prune_duplicates(clusters, folder=DUPLICATES_FOLDER):
+    """
+    Move every member of each cluster except its keeper into folder, keeping
+    their paths relative to all_output so they can be moved back.
+    Returns [(old path, new path)].
+    """
+    moved = []
+    for cluster in clusters:
+        keeper = choose_keeper(cluster)
+        for entry in cluster:
+            if entry is keeper:
+                continue
+            source = entry["source"]
+            relative = os.path.relpath(source, "all_output")
+            if relative.startswith(".."):
+                relative = os.path.join("_external", os.path.basename(source))
+            target = os.path.join(folder, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(source, target)
+            moved.append((source, target))
+    return moved
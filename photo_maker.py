@@ -1,14 +1,30 @@
-import replicate
 import os
-from dotenv import load_dotenv
 from datetime import datetime
-import requests
-import json
-from glob import glob
-import base64
+from env import load_env
+from downloader import download_content_addressed, save_all
+from output_index import new_request_id, record_output
+from thumbnails import schedule_thumbnails
+from log_store import append_log
+from result_cache import cached_run
+from predictions import run_prediction
+from uploads import image_reference
+from preprocess import prepare_input_image
 
-# Load environment variables from .env file
-load_dotenv()
+STYLES = [
+    "Photographic (Default)",
+    "(No style)",
+    "Cinematic",
+    "Disney Charactor",
+    "Digital Art",
+    "Fantasy art",
+    "Neonpunk",
+    "Enhance",
+    "Comic book",
+    "Lowpoly",
+    "Line art"
+]
+
+DEFAULT_NEGATIVE_PROMPT = "nsfw, lowres, bad anatomy, bad hands, bad eyes, text, error, missing fingers, extra digit, fewer digits, cropped, worst quality, low quality, normal quality, jpeg artifacts, signature, watermark, username, blurry"
 
 def get_subfolders(base_folder):
     """Get list of subfolders from the base folder"""
@@ -41,17 +57,17 @@ def select_folder(subfolders):
 
 def get_images_from_folder(folder_path):
     """Get all images from the specified folder"""
-    image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.webp']
-    images = []
-    for ext in image_extensions:
-        images.extend(glob(os.path.join(folder_path, ext)))
+    image_extensions = ('.jpg', '.jpeg', '.png', '.webp')
+    if not os.path.isdir(folder_path):
+        return []
+    # One directory listing instead of a glob per extension
+    with os.scandir(folder_path) as entries:
+        images = [
+            entry.path for entry in entries
+            if entry.is_file() and not entry.name.startswith('.') and entry.name.lower().endswith(image_extensions)
+        ]
     return sorted(images)
 
-def encode_image_to_base64(image_path):
-    """Convert image to base64 string"""
-    with open(image_path, "rb") as image_file:
-        return f"data:image/jpeg;base64,{base64.b64encode(image_file.read()).decode('utf-8')}"
-
 def generate_photo(
     input_images,
     prompt="A photo of a person img",
@@ -62,13 +78,19 @@ def generate_photo(
     negative_prompt=None,
     style_strength_ratio=20,
     seed=None,
-    disable_safety_checker=False
+    disable_safety_checker=False,
+    use_cache=True,
+    preprocess=True
 ):
     """Generate photos using Replicate's PhotoMaker API"""
+    model = "tencentarc/photomaker:ddfc2b08d209f9fa8c1eca692712918bd449f695dabb4a958da31802a9570fe4"
     try:
         # Take up to first 4 images from the folder
         input_images = input_images[:4]
         print(f"Using {len(input_images)} images from the folder")
+        if preprocess:
+            # Downscale to the model's working resolution before uploading
+            input_images = [prepare_input_image(path, model) for path in input_images]
 
         # Prepare input parameters
         input_params = {
@@ -81,12 +103,12 @@ def generate_photo(
             "disable_safety_checker": disable_safety_checker
         }
 
-        # Add main input image
-        input_params["input_image"] = encode_image_to_base64(input_images[0])
+        # Add main input image (uploaded once and passed by URL when possible)
+        input_params["input_image"] = image_reference(input_images[0])
         
         # Add additional images if available
         for i, img_path in enumerate(input_images[1:], 2):
-            input_params[f"input_image{i}"] = encode_image_to_base64(img_path)
+            input_params[f"input_image{i}"] = image_reference(img_path)
 
         # Add optional parameters
         if seed is not None:
@@ -94,27 +116,21 @@ def generate_photo(
         if negative_prompt:
             input_params["negative_prompt"] = negative_prompt
         
-        output = replicate.run(
-            "tencentarc/photomaker:ddfc2b08d209f9fa8c1eca692712918bd449f695dabb4a958da31802a9570fe4",
-            input=input_params
-        )
+        output = cached_run(model, input_params, lambda: run_prediction(model, input_params), use_cache)
         
         return output
     except Exception as e:
         print(f"Error generating photo: {e}")
         return None
 
-def save_image(url, folder, prefix="photomaker"):
-    """Save an image from URL to the specified folder"""
+def save_image(url, folder, prefix="photomaker", request_id=None):
+    """Save an image from URL to the specified folder, named after its content hash"""
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{prefix}_{timestamp}.png"
-            filepath = os.path.join(folder, filename)
-            
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
+        saved = download_content_addressed(url, folder, ".png")
+        if saved is not None:
+            filepath, digest, _ = saved
+            record_output(request_id, digest, filepath, url, prefix)
+            schedule_thumbnails(filepath)
             print(f"Image saved: {filepath}")
             return filepath
         else:
@@ -124,57 +140,17 @@ def save_image(url, folder, prefix="photomaker"):
         print(f"Error saving image: {e}")
         return None
 
-def save_request_log(log_data, logs_folder="logs", log_file_name="photomaker_log.json"):
-    """Save the request log to a JSON file"""
-    os.makedirs(logs_folder, exist_ok=True)
-    log_file_path = os.path.join(logs_folder, log_file_name)
-
-    if isinstance(log_data.get('timestamp'), datetime):
-        log_data['timestamp'] = log_data['timestamp'].isoformat()
-    
-    def sanitize_for_json(obj):
-        if isinstance(obj, (datetime, bytes)):
-            return str(obj)
-        elif isinstance(obj, dict):
-            return {k: sanitize_for_json(v) for k, v in obj.items()}
-        elif isinstance(obj, (list, tuple)):
-            return [sanitize_for_json(item) for item in obj]
-        else:
-            return str(obj) if hasattr(obj, '__dict__') else obj
-
-    log_data = sanitize_for_json(log_data)
-
+def save_request_log(log_data, logs_folder="logs", log_file_name="photomaker_log.jsonl"):
+    """Append the request log to a JSONL file"""
     try:
-        if os.path.exists(log_file_path):
-            with open(log_file_path, 'r') as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = []
-        
-        existing_data.append(log_data)
-        
-        with open(log_file_path, 'w') as f:
-            json.dump(existing_data, f, indent=2)
-        
+        log_file_path = append_log(log_data, log_file_name, logs_folder)
         print(f"Request log saved to {log_file_path}")
     except Exception as e:
         print(f"Error saving log: {e}")
 
 def get_style_choice():
     """Present a menu for style selection"""
-    styles = [
-        "Photographic (Default)",
-        "(No style)",
-        "Cinematic",
-        "Disney Charactor",
-        "Digital Art",
-        "Fantasy art",
-        "Neonpunk",
-        "Enhance",
-        "Comic book",
-        "Lowpoly",
-        "Line art"
-    ]
+    styles = STYLES
     
     print("\nAvailable styles:")
     for i, style in enumerate(styles, 1):
@@ -190,6 +166,9 @@ def get_style_choice():
             print("Invalid input. Please enter a number.")
 
 if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_env()
+
     # Check for API key
     replicate_api_key = os.getenv("REPLICATE_API_TOKEN")
     if not replicate_api_key:
@@ -245,9 +224,8 @@ if __name__ == "__main__":
             seed = input("Seed (optional, press Enter for random): ")
             seed = int(seed) if seed else None
             
-            default_negative = "nsfw, lowres, bad anatomy, bad hands, bad eyes, text, error, missing fingers, extra digit, fewer digits, cropped, worst quality, low quality, normal quality, jpeg artifacts, signature, watermark, username, blurry"
             use_default_negative = input("Use default negative prompt? (y/n, default: y): ").lower() != 'n'
-            negative_prompt = default_negative if use_default_negative else input("Enter custom negative prompt: ")
+            negative_prompt = DEFAULT_NEGATIVE_PROMPT if use_default_negative else input("Enter custom negative prompt: ")
             
             disable_safety = input("Disable safety checker? (y/n, default: n): ").lower() == 'y'
             
@@ -258,7 +236,7 @@ if __name__ == "__main__":
             guidance_scale = 5
             style_strength_ratio = 20
             seed = None
-            negative_prompt = default_negative
+            negative_prompt = DEFAULT_NEGATIVE_PROMPT
             disable_safety = False
 
         print("\nGenerating photos...")
@@ -276,17 +254,21 @@ if __name__ == "__main__":
         )
 
         if output_urls:
-            saved_paths = []
-            for i, url in enumerate(output_urls, 1):
-                saved_path = save_image(url, output_folder, f"photomaker_{selected_folder}_{i}")
-                if saved_path:
-                    saved_paths.append(saved_path)
+            # Download all outputs in parallel
+            request_id = new_request_id()
+            numbered_urls = list(enumerate(output_urls, 1))
+            saved_paths = save_all(
+                numbered_urls,
+                lambda item: save_image(item[1], output_folder, f"photomaker_{selected_folder}_{item[0]}", request_id)
+            )
+            saved_paths = [path for path in saved_paths if path]
 
             if saved_paths:
                 print(f"\nSaved {len(saved_paths)} images successfully.")
                 
                 # Prepare and save log data
                 log_data = {
+                    "request_id": request_id,
                     "timestamp": datetime.now(),
                     "input_folder": selected_folder,
                     "input_images": images[:4],  # Log only the used images
@@ -0,0 +1,331 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from log_store import sanitize_for_json
+from result_cache import cache_key
+from providers import get_provider, QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELED, ProviderError
+from scheduler import call_with_retry, classify_error
+from progress import with_listener
+import metrics
+
+# Resumable submit-and-poll mode for provider calls.
+#
+# Instead of holding a blocking subscribe/run call open, predictions are
+# submitted, their ids persisted to a local SQLite job table, and polled with
+# backoff until they finish. If the process dies, re-running the same job
+# finds the in-flight prediction in the table and keeps polling it instead of
+# submitting (and paying for) it again. Seeded requests are matched by their
+# arguments. Unseeded calls with the same arguments are meant to give different
+# images, so they are matched by a request id instead: the stable id of the job
+# they belong to (see stable_request, used for queue jobs), or else a fresh one
+# per call that only its retries share.
+#
+# Enable with IMAGEGEN_RESUMABLE=1 (or imagegen --resumable).
+
+JOB_TABLE_PATH = os.path.join(".cache", "predictions.sqlite")
+POLL_INITIAL = 0.5
+POLL_MAX = 10.0
+POLL_FACTOR = 1.5
+SUBMIT_TIMEOUT = 120.0  # a claimed row without a job id after this long belongs to a caller that died
+
+# Prediction rows move pending -> succeeded/failed/canceled -> collected.
+# Only rows that were not collected yet are resumed.
+PENDING = "pending"
+COLLECTED = "collected"
+
+
+def resumable_enabled():
+    """True when IMAGEGEN_RESUMABLE is set"""
+    return os.getenv("IMAGEGEN_RESUMABLE", "").lower() in ("1", "true", "yes")
+
+
+def connect(path=JOB_TABLE_PATH):
+    """Open the job table, creating it on first use"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_key TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            model TEXT NOT NULL,
+            job_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            output TEXT,
+            error TEXT,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS predictions_key ON predictions (request_key, status)")
+    try:
+        _create_open_index(conn)
+    except sqlite3.IntegrityError:
+        # Tables from before the index can hold duplicate open rows: keep the oldest of each
+        with conn:
+            conn.execute(
+                "UPDATE predictions SET status = ? WHERE status != ? AND id NOT IN "
+                "(SELECT MIN(id) FROM predictions WHERE status != ? GROUP BY request_key, provider)",
+                (COLLECTED, COLLECTED, COLLECTED)
+            )
+        _create_open_index(conn)
+    return conn
+
+
+def _create_open_index(conn):
+    """At most one open prediction per request and provider"""
+    conn.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS predictions_open ON predictions (request_key, provider) "
+        f"WHERE status != '{COLLECTED}'"
+    )
+
+
+def request_key_for(model, arguments, request_id=None):
+    """
+    Key a prediction is resumed by. Seeded requests are keyed by their arguments
+    alone; unseeded ones also by request_id (a fresh one when not given).
+    """
+    key = cache_key(model, arguments)
+    if arguments.get("seed") is None:
+        key += ":" + (request_id or uuid.uuid4().hex)
+    return key
+
+
+_stable_scope = contextvars.ContextVar("imagegen_stable_request", default=None)
+
+
+@contextmanager
+def stable_request(request_id):
+    """
+    Key the unseeded predictions made inside the block by request_id (e.g. a queue
+    job's id) instead of a fresh id, so running the same job again after a crash
+    or an expired lease resumes them. Identical calls within the job are told
+    apart by how many came before them.
+    """
+    token = _stable_scope.set({"id": request_id, "counts": {}, "lock": threading.Lock()})
+    try:
+        yield
+    finally:
+        _stable_scope.reset(token)
+
+
+def _call_request_id(model, arguments):
+    """Request id of a new run_prediction call (see stable_request)"""
+    scope = _stable_scope.get()
+    if scope is None:
+        return uuid.uuid4().hex
+    key = cache_key(model, arguments)
+    with scope["lock"]:
+        occurrence = scope["counts"].get(key, 0)
+        scope["counts"][key] = occurrence + 1
+    return f"{scope['id']}:{occurrence}"
+
+
+def _find_open(conn, request_key, provider_name):
+    return conn.execute(
+        "SELECT id, job_id, status, output, error, updated, created FROM predictions "
+        "WHERE request_key = ? AND provider = ? AND status != ? ORDER BY id LIMIT 1",
+        (request_key, provider_name, COLLECTED)
+    ).fetchone()
+
+
+def _claim(conn, request_key, provider_name, model, retention=None):
+    """
+    Find the open prediction for a request, or insert a row claiming it, in one transaction.
+    Pending predictions older than retention seconds are given up on first.
+    Returns (row, claimed): claimed rows have no job id yet and are ours to submit.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = _find_open(conn, request_key, provider_name)
+        now = time.time()
+        if row is not None and row[1] and row[2] == PENDING and retention and now - row[6] > retention:
+            # The provider has dropped it by now; polling would only fail
+            conn.execute("UPDATE predictions SET status = ?, error = ?, updated = ? WHERE id = ?",
+                         (COLLECTED, "expired before it was collected", now, row[0]))
+            row = None
+        if row is None:
+            cursor = conn.execute(
+                "INSERT INTO predictions (request_key, provider, model, job_id, status, created, updated) "
+                "VALUES (?, ?, ?, '', ?, ?, ?)",
+                (request_key, provider_name, model, PENDING, now, now)
+            )
+            row = (cursor.lastrowid, "", PENDING, None, None, now, now)
+            claimed = True
+        elif row[1] == "" and time.time() - row[5] > SUBMIT_TIMEOUT:
+            # Whoever claimed it died before submitting: take it over
+            conn.execute("UPDATE predictions SET updated = ? WHERE id = ?", (time.time(), row[0]))
+            claimed = True
+        else:
+            claimed = False
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row, claimed
+
+
+def _open_row(conn, request_key, provider_name, model, retention=None):
+    """
+    The open prediction for a request, with its job id: submitted by another
+    caller, or claimed here (job id "") for the caller to submit.
+    """
+    while True:
+        row, claimed = _claim(conn, request_key, provider_name, model, retention)
+        if claimed or row[1]:
+            return row, claimed
+        # Another caller is submitting this request right now
+        time.sleep(POLL_INITIAL)
+
+
+def _update(conn, row_id, status, output=None, error=None):
+    with conn:
+        conn.execute(
+            "UPDATE predictions SET status = ?, output = ?, error = ?, updated = ? WHERE id = ?",
+            (status, json.dumps(output) if output is not None else None, error, time.time(), row_id)
+        )
+
+
+def wait_for(provider, model, job_id, on_update=None, row_id=None, conn=None):
+    """Poll a prediction with exponential backoff until it finishes and return its final state"""
+    delay = POLL_INITIAL
+    while True:
+        state = provider.poll(model, job_id)
+        if on_update:
+            on_update(state)
+        if state["status"] in (SUCCEEDED, FAILED, CANCELED):
+            if conn is not None and row_id is not None:
+                output = sanitize_for_json(state.get("output"))
+                _update(conn, row_id, state["status"], output, state.get("error"))
+            return state
+        time.sleep(delay)
+        delay = min(delay * POLL_FACTOR, POLL_MAX)
+
+
+def run_resumable(model, arguments, on_update=None, path=JOB_TABLE_PATH, request_id=None):
+    """
+    Submit a prediction (or pick up an earlier in-flight one for the same request),
+    persist its id, and poll until it finishes. Returns the prediction output.
+    :param request_id: Identifies an unseeded call across retries (see request_key_for)
+    """
+    provider = get_provider(model)
+    request_key = request_key_for(model, arguments, request_id)
+    conn = connect(path)
+    conn.isolation_level = None  # transactions are explicit
+    try:
+        while True:
+            row, claimed = _open_row(conn, request_key, provider.name, model, provider.retention)
+            row_id, job_id, status, output, error = row[:5]
+            if claimed:
+                try:
+                    job_id = provider.submit(model, arguments)
+                except BaseException:
+                    conn.execute("DELETE FROM predictions WHERE id = ?", (row_id,))
+                    raise
+                conn.execute("UPDATE predictions SET job_id = ?, updated = ? WHERE id = ?",
+                             (job_id, time.time(), row_id))
+            else:
+                print(f"Resuming prediction {job_id} for {model.split(':')[0]}")
+
+            status_code = None
+            if status == PENDING:
+                try:
+                    state = wait_for(provider, model, job_id, on_update, row_id, conn)
+                except Exception as e:
+                    if claimed or classify_error(e)[0]:
+                        raise
+                    # The provider doesn't know the prediction anymore (expired, or from an
+                    # earlier process of an in-memory provider): close it and submit anew
+                    print(f"Prediction {job_id} can't be resumed ({e}), submitting it again")
+                    _update(conn, row_id, COLLECTED, None, str(e))
+                    continue
+                status, output, error = state["status"], sanitize_for_json(state.get("output")), state.get("error")
+                status_code = state.get("status_code")
+            elif output is not None:
+                output = json.loads(output)
+            break
+
+        _update(conn, row_id, COLLECTED, output, error)
+        if status != SUCCEEDED:
+            raise ProviderError(f"{model} prediction {job_id} {status}: {error}", status_code)
+        return output
+    finally:
+        conn.close()
+
+
+class _StageTimer:
+    """Splits a provider call into queue_wait and inference from its progress updates"""
+
+    def __init__(self, model, on_update=None):
+        self.model = model
+        self.on_update = on_update
+        self.start = time.perf_counter()
+        self.running_since = None
+        self.predict_time = None
+
+    def update(self, state):
+        status = state.get("status")
+        if status == QUEUED and state.get("position") is not None:
+            metrics.set_gauge("imagegen_queue_position", state["position"], model=self.model.split(":")[0])
+        elif status in (RUNNING, SUCCEEDED) and self.running_since is None:
+            self.running_since = time.perf_counter()
+            metrics.observe("queue_wait", self.running_since - self.start, self.model)
+        if (state.get("metrics") or {}).get("predict_time") is not None:
+            self.predict_time = state["metrics"]["predict_time"]
+        if self.on_update:
+            self.on_update(state)
+
+    def finish(self, output, provider):
+        now = time.perf_counter()
+        # Without updates (blocking Replicate runs) queueing can't be separated from inference
+        inference = now - (self.running_since if self.running_since is not None else self.start)
+        metrics.observe("inference", inference, self.model)
+        predict_seconds = self.predict_time if self.predict_time is not None else inference
+        metrics.record_cost(self.model, len(provider.fetch_outputs(output)), predict_seconds)
+
+
+def run_prediction(model, arguments, on_update=None):
+    """
+    Run a provider call, in resumable submit-and-poll mode when enabled, otherwise blocking.
+    Calls go through the shared scheduler, which limits how many are in flight per
+    provider/model and retries rate limits and transient errors with backoff.
+    In resumable mode a retry resumes the already submitted prediction.
+    """
+    provider = get_provider(model)
+    key = f"{provider.name}:{model.split(':')[0]}"
+    timer = _StageTimer(model, with_listener(on_update))
+    name = model.split(":")[0]
+    request_id = _call_request_id(model, arguments)  # retries of this call resume its prediction
+    try:
+        if resumable_enabled():
+            output = call_with_retry(key, lambda: run_resumable(model, arguments, timer.update, request_id=request_id))
+        else:
+            output = call_with_retry(key, lambda: provider.run(model, arguments, on_update=timer.update))
+    except Exception:
+        metrics.increment("imagegen_requests_total", model=name, status="failed")
+        raise
+    timer.finish(output, provider)
+    metrics.increment("imagegen_requests_total", model=name, status="succeeded")
+    return output
+
+
+def list_open_predictions(path=JOB_TABLE_PATH):
+    """Return (model, provider, job_id, status, age seconds) for predictions not collected yet"""
+    if not os.path.exists(path):
+        return []
+    conn = connect(path)
+    try:
+        rows = conn.execute(
+            "SELECT model, provider, job_id, status, created FROM predictions WHERE status != ? ORDER BY id",
+            (COLLECTED,)
+        ).fetchall()
+    finally:
+        conn.close()
+    now = time.time()
+    return [(model, provider, job_id, status, now - created) for model, provider, job_id, status, created in rows]
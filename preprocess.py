@@ -0,0 +1,107 @@
+import os
+import tempfile
+from image_encoding import file_digest
+from metrics import span
+
+# Optional input preprocessing before upload.
+# Phone photos are often 8-12 MB while the models work at about 1024px, so
+# inputs are downscaled and re-encoded once per source file and the result is
+# kept in a derived-image cache. Without Pillow installed, inputs are sent as is.
+#
+# Set IMAGEGEN_PREPROCESS=0 to always send the original files.
+
+_pillow = None
+
+
+def _load_pillow():
+    """Import Pillow on first use; returns (Image, ImageOps) or None when it isn't installed"""
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            _pillow = (Image, ImageOps)
+        except ImportError:  # Pillow is optional
+            _pillow = ()
+    return _pillow or None
+
+DERIVED_FOLDER = os.path.join(".cache", "derived")
+JPEG_QUALITY = 90
+MAX_ASPECT = 1.5  # crop anything more elongated than 3:2 (or 2:3)
+
+# Resolution each model works at; inputs are scaled so their longest side fits
+MODEL_TARGET_SIZES = {
+    "tencentarc/photomaker": 1024,
+    "fofr/face-to-many": 1024,
+    "fofr/face-to-sticker": 1024,
+}
+
+
+def preprocessing_enabled():
+    """False when Pillow is missing or IMAGEGEN_PREPROCESS=0"""
+    if os.getenv("IMAGEGEN_PREPROCESS", "1").lower() in ("0", "false", "no"):
+        return False
+    return _load_pillow() is not None
+
+
+def face_safe_crop(image, max_aspect=MAX_ASPECT):
+    """
+    Crop very wide or very tall images to max_aspect.
+    Horizontal crops stay centered; vertical crops keep more of the top of the
+    frame, where faces usually are in portrait photos.
+    """
+    width, height = image.size
+    if width > height * max_aspect:
+        new_width = int(height * max_aspect)
+        left = (width - new_width) // 2
+        return image.crop((left, 0, left + new_width, height))
+    if height > width * max_aspect:
+        new_height = int(width * max_aspect)
+        top = int((height - new_height) * 0.25)
+        return image.crop((0, top, width, top + new_height))
+    return image
+
+
+def prepare_input_image(image_path, model=None, target_size=None):
+    """
+    Return the path of an input image ready to upload for model.
+    The derived image is resized so its longest side is at most target_size,
+    cropped with face_safe_crop and re-encoded as JPEG. It is cached under the
+    source's content hash, so each source file is only processed once.
+    Returns image_path unchanged when preprocessing is disabled or not needed.
+    :param model: Model id (with or without version) used to look up the target size
+    :param target_size: Explicit longest side in pixels, overrides the model lookup
+    """
+    if not preprocessing_enabled():
+        return image_path
+    if target_size is None:
+        target_size = MODEL_TARGET_SIZES.get(str(model).split(":")[0]) if model else None
+    if not target_size:
+        return image_path
+
+    digest = file_digest(image_path)
+    derived_path = os.path.join(DERIVED_FOLDER, f"{digest}_{target_size}.jpg")
+    if os.path.exists(derived_path):
+        return derived_path
+
+    Image, ImageOps = _load_pillow()
+    try:
+        with span("preprocess", model or ""), Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image)
+            image = face_safe_crop(image)
+            if max(image.size) <= target_size and os.path.getsize(image_path) < 1024 * 1024:
+                # Already small enough; re-encoding would only lose quality
+                return image_path
+            image.thumbnail((target_size, target_size), Image.LANCZOS)
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+
+            os.makedirs(DERIVED_FOLDER, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=DERIVED_FOLDER, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, "JPEG", quality=JPEG_QUALITY, optimize=True)
+            os.replace(tmp_path, derived_path)
+    except Exception as e:
+        print(f"Could not preprocess {os.path.basename(image_path)}, using the original: {e}")
+        return image_path
+
+    return derived_path
@@ -0,0 +1,43 @@
+import contextvars
+from contextlib import contextmanager
+
+# Context-local progress listeners.
+# Provider updates (queue position, logs) are reported through report(); code
+# that wants them, like the HTTP service, installs a listener around a job
+# without every generator function having to pass callbacks along.
+# concurrency.run_bounded copies the context into its worker threads.
+
+_listener = contextvars.ContextVar("imagegen_progress_listener", default=None)
+
+
+@contextmanager
+def listening(listener):
+    """Send every progress update reported inside the block to listener(update)"""
+    token = _listener.set(listener)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def report(update):
+    """Forward a progress update to the current listener, if any"""
+    listener = _listener.get()
+    if listener is not None:
+        try:
+            listener(update)
+        except Exception as e:
+            print(f"Progress listener failed: {e}")
+
+
+def with_listener(on_update=None):
+    """Return an update callback that calls on_update and the current listener"""
+    listener = _listener.get()
+    if listener is None:
+        return on_update
+
+    def combined(update):
+        if on_update is not None:
+            on_update(update)
+        report(update)
+    return combined
@@ -0,0 +1,378 @@
+import os
+import time
+import zlib
+import struct
+import random
+import hashlib
+import threading
+import uuid
+from env import load_env
+
+# Provider abstraction over fal.ai, Replicate and an in-process fake backend.
+#
+# Every provider supports submit / poll / cancel / fetch_outputs, plus a
+# blocking run() used by the generator scripts. Updates passed to on_update
+# callbacks are plain dicts: {"status", "position", "logs"}.
+#
+# Provider selection, per model:
+#   IMAGEGEN_PROVIDER=fake                       route every model to the fake backend
+#   IMAGEGEN_PROVIDERS="fal-ai/flux-pro/v1.1=fake,fofr/face-to-many=replicate"
+# Otherwise models starting with "fal-ai/" go to fal and everything else to Replicate.
+
+# Normalized job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELED = "canceled"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELED)
+
+
+class ProviderError(Exception):
+    """A provider call failed or a prediction finished unsuccessfully"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status  # HTTP-like status when the failure is transient
+
+
+class Provider:
+    """Base class for image generation backends"""
+
+    name = None
+    retention = 24 * 3600  # seconds a submitted job can still be polled for its result
+
+    def submit(self, model, arguments):
+        """Start a prediction and return its job id without waiting for it"""
+        raise NotImplementedError
+
+    def poll(self, model, job_id):
+        """
+        Return the current state of a job as a dict with keys
+        status, position, logs, output and error.
+        """
+        raise NotImplementedError
+
+    def cancel(self, model, job_id):
+        """Ask the provider to stop a queued or running job"""
+        raise NotImplementedError
+
+    def fetch_outputs(self, output):
+        """Return the list of output URLs contained in a finished job's output"""
+        if isinstance(output, dict) and "images" in output:
+            return [str(image["url"]) for image in output["images"]]
+        if isinstance(output, (list, tuple)):
+            return [str(getattr(item, "url", item)) for item in output]
+        if output:
+            return [str(getattr(output, "url", output))]
+        return []
+
+    def run(self, model, arguments, on_update=None, poll_interval=1.0):
+        """Submit a job and poll until it finishes, returning its output"""
+        job_id = self.submit(model, arguments)
+        while True:
+            state = self.poll(model, job_id)
+            if on_update:
+                on_update(state)
+            if state["status"] == SUCCEEDED:
+                return state["output"]
+            if state["status"] in (FAILED, CANCELED):
+                raise ProviderError(f"{model} job {job_id} {state['status']}: {state.get('error')}")
+            time.sleep(poll_interval)
+
+
+class FalProvider(Provider):
+    """fal.ai queue API through fal_client"""
+
+    name = "fal"
+
+    def __init__(self):
+        load_env()  # FAL_KEY may come from the .env file
+
+    def submit(self, model, arguments):
+        import fal_client
+        return fal_client.submit(model, arguments=arguments).request_id
+
+    def poll(self, model, job_id):
+        import fal_client
+        status = fal_client.status(model, job_id, with_logs=True)
+        state = {"status": RUNNING, "position": None, "logs": [], "output": None, "error": None}
+        if isinstance(status, fal_client.Queued):
+            state["status"] = QUEUED
+            state["position"] = status.position
+        elif isinstance(status, fal_client.InProgress):
+            state["logs"] = [log["message"] for log in (status.logs or [])]
+        elif isinstance(status, fal_client.Completed):
+            state["logs"] = [log["message"] for log in (status.logs or [])]
+            try:
+                state["output"] = fal_client.result(model, job_id)
+                state["status"] = SUCCEEDED
+            except Exception as e:
+                state["status"] = FAILED
+                state["error"] = str(e)
+        return state
+
+    def cancel(self, model, job_id):
+        import fal_client
+        fal_client.cancel(model, job_id)
+
+    def run(self, model, arguments, on_update=None, poll_interval=1.0):
+        import fal_client
+
+        def on_queue_update(update):
+            if on_update is None:
+                return
+            if isinstance(update, fal_client.Queued):
+                on_update({"status": QUEUED, "position": update.position, "logs": []})
+            elif isinstance(update, fal_client.InProgress):
+                on_update({"status": RUNNING, "position": None, "logs": [log["message"] for log in (update.logs or [])]})
+
+        return fal_client.subscribe(
+            model,
+            arguments=arguments,
+            with_logs=True,
+            on_queue_update=on_queue_update,
+        )
+
+
+class ReplicateProvider(Provider):
+    """Replicate predictions API through the replicate client"""
+
+    name = "replicate"
+    retention = 3600  # API prediction outputs are deleted after an hour
+
+    _STATUS = {
+        "starting": QUEUED,
+        "processing": RUNNING,
+        "succeeded": SUCCEEDED,
+        "failed": FAILED,
+        "canceled": CANCELED,
+    }
+
+    def __init__(self):
+        load_env()  # REPLICATE_API_TOKEN may come from the .env file
+
+    def _create(self, model, arguments):
+        import replicate
+        name, _, version = model.partition(":")
+        if version:
+            return replicate.predictions.create(version=version, input=arguments)
+        return replicate.models.predictions.create(model=name, input=arguments)
+
+    def submit(self, model, arguments):
+        return self._create(model, arguments).id
+
+    def poll(self, model, job_id):
+        import replicate
+        return self._state(replicate.predictions.get(job_id))
+
+    def _state(self, prediction):
+        return {
+            "status": self._STATUS.get(prediction.status, RUNNING),
+            "position": None,
+            "logs": (prediction.logs or "").splitlines(),
+            "output": prediction.output,
+            "error": prediction.error,
+            "metrics": getattr(prediction, "metrics", None) or {},
+        }
+
+    def cancel(self, model, job_id):
+        import replicate
+        replicate.predictions.cancel(job_id)
+
+    def run(self, model, arguments, on_update=None, poll_interval=1.0):
+        if on_update is None:
+            import replicate
+            return replicate.run(model, input=arguments)
+        # replicate.run hides the prediction, and with it the predict_time used for cost metrics
+        prediction = self._create(model, arguments)
+        on_update(self._state(prediction))
+        prediction.wait()
+        state = self._state(prediction)
+        on_update(state)
+        if state["status"] != SUCCEEDED:
+            raise ProviderError(f"{model} prediction {prediction.id} {state['status']}: {state['error']}")
+        return state["output"]
+
+
+def _fake_png(seed_bytes, size=64):
+    """Build a small valid PNG whose colours are derived from seed_bytes"""
+    digest = hashlib.sha256(seed_bytes).digest()
+    rows = []
+    for y in range(size):
+        row = bytearray([0])  # filter type: none
+        for x in range(size):
+            row += bytes((digest[(x + y) % 32], digest[(x * 3) % 32], (x * y + digest[y % 32]) % 256))
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows))) + chunk(b"IEND", b""))
+
+
+class FakeProvider(Provider):
+    """
+    In-process stand-in for a provider, for offline tests and load tests.
+    Jobs complete after a random latency and fail with failure_rate probability.
+    Output images are small PNGs written to output_folder and returned as
+    file:// URLs; identical arguments produce identical images.
+    :param latency: Mean seconds a job takes
+    :param jitter: Latency varies uniformly by +/- this many seconds
+    :param failure_rate: Probability (0-1) that a job fails
+    :param queue_time: Seconds a job reports as queued before running
+    """
+
+    name = "fake"
+
+    def __init__(self, latency=0.5, jitter=0.2, failure_rate=0.0, queue_time=0.0,
+                 output_folder=os.path.join(".cache", "fake_outputs"), seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.queue_time = queue_time
+        self.output_folder = output_folder
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.submitted = 0
+
+    def submit(self, model, arguments):
+        with self.lock:
+            job_id = uuid.uuid4().hex
+            duration = max(0.0, self._duration())
+            will_fail = self.random.random() < self.failure_rate
+            self.submitted += 1
+        now = time.time()
+        self.jobs[job_id] = {
+            "model": model,
+            "arguments": dict(arguments),
+            "started": now + self.queue_time,
+            "finishes": now + self.queue_time + duration,
+            "will_fail": will_fail,
+            "canceled": False,
+        }
+        return job_id
+
+    def _duration(self):
+        """Seconds the next job takes to run (called with self.lock held)"""
+        return self.latency + self.random.uniform(-self.jitter, self.jitter)
+
+    def _output_url(self, key):
+        """Write the output image for key and return its URL"""
+        data = _fake_png(key)
+        os.makedirs(self.output_folder, exist_ok=True)
+        path = os.path.join(self.output_folder, hashlib.sha256(data).hexdigest()[:32] + ".png")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(data)
+        return "file://" + os.path.abspath(path)
+
+    def _outputs(self, model, arguments):
+        count = int(arguments.get("num_images") or arguments.get("num_outputs") or 1)
+        key = repr((model, sorted((k, str(v)) for k, v in arguments.items()))).encode()
+        urls = [self._output_url(key + str(i).encode()) for i in range(count)]
+        if model.startswith("fal-ai/"):
+            return {"images": [{"url": url, "content_type": "image/png"} for url in urls],
+                    "seed": arguments.get("seed")}
+        return urls
+
+    def poll(self, model, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ProviderError(f"Unknown fake job {job_id}", 404)
+        now = time.time()
+        state = {"status": RUNNING, "position": None, "logs": [], "output": None, "error": None}
+        if job["canceled"]:
+            state["status"] = CANCELED
+        elif now < job["started"]:
+            state["status"] = QUEUED
+            state["position"] = 0
+        elif now < job["finishes"]:
+            state["logs"] = [f"fake inference {int(100 * (now - job['started']) / max(job['finishes'] - job['started'], 1e-9))}%"]
+        elif job["will_fail"]:
+            state["status"] = FAILED
+            state["error"] = "simulated failure"
+            state["status_code"] = 503
+        else:
+            state["status"] = SUCCEEDED
+            state["output"] = self._outputs(job["model"], job["arguments"])
+            state["metrics"] = {"predict_time": job["finishes"] - job["started"]}
+        if state["status"] in (SUCCEEDED, FAILED, CANCELED):
+            # Collected: forget the job, so long-running services and load tests don't grow without bound
+            self.jobs.pop(job_id, None)
+        return state
+
+    def cancel(self, model, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job["canceled"] = True
+
+    def run(self, model, arguments, on_update=None, poll_interval=None):
+        job_id = self.submit(model, arguments)
+        job = self.jobs[job_id]
+        if on_update and self.queue_time:
+            on_update({"status": QUEUED, "position": 0, "logs": []})
+        time.sleep(max(0.0, job["started"] - time.time()))
+        if on_update:
+            on_update({"status": RUNNING, "position": None, "logs": ["fake inference started"]})
+        time.sleep(max(0.0, job["finishes"] - time.time()))
+        state = self.poll(model, job_id)
+        if state["status"] != SUCCEEDED:
+            raise ProviderError(f"{model} job {job_id} {state['status']}: {state.get('error')}", state.get("status_code"))
+        return state["output"]
+
+
+def _fake_provider_from_env():
+    """FakeProvider configured by IMAGEGEN_FAKE_LATENCY, _JITTER, _FAILURE_RATE and _QUEUE_TIME"""
+    return FakeProvider(
+        latency=float(os.getenv("IMAGEGEN_FAKE_LATENCY", 0.5)),
+        jitter=float(os.getenv("IMAGEGEN_FAKE_JITTER", 0.2)),
+        failure_rate=float(os.getenv("IMAGEGEN_FAKE_FAILURE_RATE", 0.0)),
+        queue_time=float(os.getenv("IMAGEGEN_FAKE_QUEUE_TIME", 0.0)),
+    )
+
+
+_PROVIDER_FACTORIES = {
+    "fal": FalProvider,
+    "replicate": ReplicateProvider,
+    "fake": _fake_provider_from_env,
+}
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def register_provider(name, provider):
+    """Make a provider instance available under name (replaces any existing one)"""
+    with _providers_lock:
+        _providers[name] = provider
+
+
+def _provider_name(model):
+    if os.getenv("IMAGEGEN_PROVIDER"):
+        return os.getenv("IMAGEGEN_PROVIDER")
+
+    overrides = {}
+    for item in os.getenv("IMAGEGEN_PROVIDERS", "").split(","):
+        if "=" in item:
+            prefix, name = item.split("=", 1)
+            overrides[prefix.strip()] = name.strip()
+    # The longest matching prefix wins
+    for prefix in sorted(overrides, key=len, reverse=True):
+        if model.startswith(prefix):
+            return overrides[prefix]
+
+    return "fal" if model.startswith("fal-ai/") else "replicate"
+
+
+def get_provider(model):
+    """Return the provider instance that should serve model"""
+    name = _provider_name(model)
+    with _providers_lock:
+        if name not in _providers:
+            if name not in _PROVIDER_FACTORIES:
+                raise ValueError(f"Unknown provider '{name}'. Choose from: {', '.join(_PROVIDER_FACTORIES)}")
+            _providers[name] = _PROVIDER_FACTORIES[name]()
+        return _providers[name]
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from log_store import sanitize_for_json
+from singleflight import SingleFlight
+
+# On-disk cache of provider results for seeded (deterministic) requests.
+# Entries are keyed on model + version + the full argument set, with inline
+# images replaced by the hash of their content, and evicted least recently used
+# first once the cache grows past its entry or size limit.
+#
+# Once the outputs of a cached result are saved, the entry also records their
+# local paths (see remember_output). A hit whose files are all still on disk is
+# served from them, as file:// URLs, however old it is; entries without local
+# copies are only reused while the provider URLs are still valid.
+#
+# Set IMAGEGEN_NO_CACHE=1 to bypass the cache for a whole run.
+
+CACHE_FOLDER = os.path.join(".cache", "results")
+MAX_ENTRIES = 5000
+MAX_BYTES = 200 * 1024 * 1024
+EVICT_EVERY = 50  # puts between two eviction passes over the cache folder
+# Provider output URLs expire (Replicate delivery URLs after about an hour),
+# so results without local copies are only reused for a limited time by default.
+DEFAULT_MAX_AGE = int(os.getenv("IMAGEGEN_CACHE_MAX_AGE", 3600))
+
+# Uploaded input URLs -> content hash, so re-uploads of the same file keep the same key
+_input_url_digests = {}
+
+# Identical seeded calls in flight at the same time share one provider call
+_flights = SingleFlight()
+
+# Output URL -> cache key of the result it came from, until its download is recorded
+_url_keys = {}
+_entry_lock = threading.Lock()
+_puts = 0
+
+
+def cache_disabled():
+    """True when the cache is bypassed through the IMAGEGEN_NO_CACHE environment variable"""
+    return os.getenv("IMAGEGEN_NO_CACHE", "").lower() in ("1", "true", "yes")
+
+
+def register_input_url(url, digest):
+    """Tell the cache that url serves an uploaded input whose content hashes to digest"""
+    _input_url_digests[url] = digest
+
+
+def _canonical_value(value):
+    """Replace input images (inline or uploaded) by the hash of their content so keys stay small and stable"""
+    if isinstance(value, str) and value.startswith("data:"):
+        return "sha256:" + hashlib.sha256(value.encode('utf-8')).hexdigest()
+    elif isinstance(value, str) and value in _input_url_digests:
+        return "sha256-file:" + _input_url_digests[value]
+    elif isinstance(value, dict):
+        return {k: _canonical_value(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_canonical_value(v) for v in value]
+    return value
+
+
+def cache_key(model, arguments):
+    """
+    Return the canonical hash of a provider call.
+    :param model: Model id, optionally with a ':version' hash (Replicate style)
+    :param arguments: Full argument dict sent to the provider
+    """
+    name, _, version = str(model).partition(":")
+    payload = {
+        "model": name,
+        "version": version,
+        "arguments": _canonical_value(arguments)
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def is_deterministic(arguments):
+    """Only requests with an explicit seed return the same images every time"""
+    return arguments.get("seed") is not None
+
+
+def _entry_path(key, cache_folder):
+    return os.path.join(cache_folder, key[:2], f"{key}.json")
+
+
+def _map_urls(value, fn):
+    """Apply fn to every http(s) URL string inside a result"""
+    if isinstance(value, str):
+        return fn(value) if value.startswith(("http://", "https://")) else value
+    elif isinstance(value, dict):
+        return {k: _map_urls(v, fn) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_map_urls(v, fn) for v in value]
+    return value
+
+
+def _read_entry(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _write_entry(path, entry):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, path)
+
+
+def _track_urls(key, result):
+    _map_urls(result, lambda url: _url_keys.__setitem__(url, key))
+
+
+def get(key, cache_folder=CACHE_FOLDER, max_age=DEFAULT_MAX_AGE):
+    """
+    Return the cached result for key, or None on a miss or expired entry.
+    URLs whose output was already saved are replaced by file:// URLs of the local copy.
+    """
+    path = _entry_path(key, cache_folder)
+    entry = _read_entry(path)
+    if entry is None:
+        return None
+
+    local = entry.get("local", {})
+    missing = []
+
+    def local_url(url):
+        copy = local.get(url)
+        if copy and os.path.exists(copy["path"]):
+            return "file://" + os.path.abspath(copy["path"])
+        missing.append(url)
+        return url
+
+    result = _map_urls(entry["result"], local_url)
+    if missing and max_age and time.time() - entry.get("created", 0) > max_age:
+        return None
+    if missing:
+        _track_urls(key, entry["result"])
+    # Bump the mtime so eviction sees this entry as recently used
+    os.utime(path)
+    return result
+
+
+def put(key, model, result, cache_folder=CACHE_FOLDER):
+    """Store a sanitized result under key, evicting old entries every EVICT_EVERY puts"""
+    global _puts
+    path = _entry_path(key, cache_folder)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {
+        "model": str(model),
+        "created": time.time(),
+        "result": result,
+        "local": {}
+    }
+    with _entry_lock:
+        _write_entry(path, entry)
+        _puts += 1
+        due = _puts % EVICT_EVERY == 1  # the first put of a process, then every EVICT_EVERY
+    _track_urls(key, result)
+    if due:
+        evict(cache_folder)
+
+
+def remember_output(url, filepath, digest, cache_folder=CACHE_FOLDER):
+    """Record where the output downloaded from a cached result's url was saved"""
+    key = _url_keys.pop(url, None)
+    if key is None:
+        return
+    path = _entry_path(key, cache_folder)
+    with _entry_lock:
+        entry = _read_entry(path)
+        if entry is None:
+            return
+        entry.setdefault("local", {})[url] = {"path": filepath, "sha256": digest}
+        _write_entry(path, entry)
+
+
+def evict(cache_folder=CACHE_FOLDER, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+    """Remove least recently used entries until the cache fits its limits"""
+    entries = []
+    total_bytes = 0
+    for root, _, files in os.walk(cache_folder):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+    if len(entries) <= max_entries and total_bytes <= max_bytes:
+        return 0
+
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if len(entries) - removed <= max_entries and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        removed += 1
+        total_bytes -= size
+    return removed
+
+
+def cached_run(model, arguments, run_fn, use_cache=True, max_age=DEFAULT_MAX_AGE):
+    """
+    Return run_fn() for a provider call, served from the cache when possible.
+    Only seeded calls are cached. Results are sanitized to plain JSON values
+    (replicate FileOutput objects become URL strings) whether or not they hit.
+    :param model: Model id including version, used in the cache key
+    :param arguments: Argument dict passed to the provider, used in the cache key
+    :param run_fn: Zero-argument callable performing the real provider call
+    :param use_cache: Set to False to always call the provider
+    Concurrent identical seeded calls are coalesced: one of them calls the
+    provider and the others wait for it and share its result. This also
+    applies with use_cache=False, since the outputs are the same either way.
+    """
+    if not is_deterministic(arguments):
+        return sanitize_for_json(run_fn())
+
+    key = cache_key(model, arguments)
+    caching = use_cache and not cache_disabled()
+    if caching:
+        result = get(key, max_age=max_age)
+        if result is not None:
+            print(f"Using cached result for {model.split(':')[0]} ({key[:12]})")
+            return result
+
+    def fetch():
+        result = sanitize_for_json(run_fn())
+        if result and caching:
+            put(key, model, result)
+        return result
+
+    result, shared = _flights.do(key, fetch)
+    if shared:
+        print(f"Shared the in-flight result for {model.split(':')[0]} ({key[:12]})")
+    return result
@@ -0,0 +1,153 @@
+import os
+import time
+import random
+import threading
+
+# Rate-limit-aware scheduling for provider calls.
+#
+# Every call goes through a per-provider/per-model AdaptiveLimiter that caps
+# how many calls are in flight. The cap grows additively while calls succeed
+# and is halved on HTTP 429, so batch runs settle right at the provider's
+# throughput ceiling (AIMD). Transient failures (429, 5xx, connection errors)
+# are retried with jittered exponential backoff, honoring Retry-After.
+
+MAX_ATTEMPTS = int(os.getenv("IMAGEGEN_MAX_ATTEMPTS", 5))
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+INITIAL_LIMIT = float(os.getenv("IMAGEGEN_INITIAL_IN_FLIGHT", 4))
+MIN_LIMIT = 1.0
+MAX_LIMIT = float(os.getenv("IMAGEGEN_MAX_IN_FLIGHT", 32))
+
+RETRYABLE_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def _status_and_headers(error):
+    """Extract an HTTP status code and response headers from SDK / HTTP client exceptions"""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    headers = {}
+    if response is not None:
+        status = status or getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None) or {}
+    try:
+        status = int(status) if status is not None else None
+    except (TypeError, ValueError):
+        status = None
+    return status, headers
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds of a Retry-After header (seconds or HTTP date), or None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    from email.utils import parsedate_to_datetime  # only needed for the rare HTTP-date form
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """
+    Return (retryable, rate_limited, retry_after seconds or None) for an exception.
+    Connection errors and timeouts are retryable; HTTP errors are when their
+    status is in RETRYABLE_STATUSES.
+    """
+    status, headers = _status_and_headers(error)
+    retry_after = parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+    if status is not None:
+        return status in RETRYABLE_STATUSES, status == 429, retry_after
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True, False, None
+    # requests / httpx connection errors don't inherit from the builtins
+    name = type(error).__name__
+    if name in ("ConnectTimeout", "ReadTimeout", "ConnectError", "RemoteProtocolError", "ChunkedEncodingError"):
+        return True, False, None
+    return False, False, None
+
+
+class AdaptiveLimiter:
+    """Concurrency limit for one provider/model, adjusted with AIMD"""
+
+    def __init__(self, initial=INITIAL_LIMIT, minimum=MIN_LIMIT, maximum=MAX_LIMIT):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a slot is free and the provider isn't asking us to back off"""
+        with self.condition:
+            while True:
+                wait_for = self.paused_until - time.time()
+                if wait_for <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait_for if wait_for > 0 else None)
+
+    def release(self, outcome="success", retry_after=None):
+        """
+        Free a slot and adapt the limit.
+        :param outcome: "success" (additive increase), "rate_limited" (halve the limit) or "error"
+        :param retry_after: Seconds the provider asked us to wait before the next call
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if outcome == "success":
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1.0))
+            elif outcome == "rate_limited":
+                self.limit = max(self.minimum, self.limit / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.time() + retry_after)
+            self.condition.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(key):
+    """Return the AdaptiveLimiter for a provider/model key"""
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter()
+        return _limiters[key]
+
+
+def backoff_delay(attempt, base_delay=None, max_delay=None):
+    """Full-jitter exponential backoff for the given (1-based) attempt"""
+    base_delay = BASE_DELAY if base_delay is None else base_delay
+    max_delay = MAX_DELAY if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def call_with_retry(key, fn, max_attempts=MAX_ATTEMPTS):
+    """
+    Call fn() under the limiter for key, retrying transient failures.
+    Non-retryable errors, and the last error once attempts run out, are raised.
+    """
+    limiter = get_limiter(key)
+    attempt = 1
+    while True:
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            retryable, rate_limited, retry_after = classify_error(e)
+            limiter.release("rate_limited" if rate_limited else "error", retry_after)
+            if not retryable or attempt >= max_attempts:
+                raise
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            print(f"{key}: {type(e).__name__} ({e}), retrying in {delay:.1f}s (attempt {attempt + 1}/{max_attempts})")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.release("success")
+        return result
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from jobs import GENERATORS, resolve_params, restrict_inputs, run_job
+from log_store import sanitize_for_json
+from progress import listening
+import metrics
+
+# HTTP front-end exposing the generators as an async job API.
+#
+#   POST /jobs/{generator}        JSON params -> 202 {"job_id", ...}
+#   GET  /jobs/{job_id}           status, result and recent events
+#   GET  /jobs/{job_id}/events    Server-Sent Events stream of progress updates
+#   GET  /health
+#   GET  /metrics                 Prometheus text format
+#
+# Run with:  python imagegen.py serve --port 8000   (or: uvicorn service:app)
+#
+# Everything runs in one process on one event loop: generations execute in a
+# shared thread pool and reuse the pooled download session, the upload cache
+# and the result cache across requests.
+
+try:
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+    from starlette.routing import Route
+except ImportError as e:
+    raise ImportError("The HTTP service needs starlette and uvicorn: pip install starlette uvicorn") from e
+
+MAX_CONCURRENT_JOBS = int(os.getenv("IMAGEGEN_SERVICE_WORKERS", 16))
+JOB_RETENTION = 3600  # seconds finished jobs stay queryable
+SSE_KEEPALIVE = 15.0
+
+
+class ServiceJob:
+    """State of one job submitted through the API"""
+
+    def __init__(self, generator, params):
+        self.id = uuid.uuid4().hex
+        self.generator = generator
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.events = []
+        self.created = time.time()
+        self.finished = None
+        self.changed = asyncio.Event()
+
+    def add_event(self, event):
+        """Record an event and wake up SSE listeners (must run on the event loop)"""
+        event = dict(event, time=time.time())
+        self.events.append(event)
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self, last_events=20):
+        return {
+            "job_id": self.id,
+            "generator": self.generator,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+            "events": self.events[-last_events:],
+        }
+
+
+_jobs = {}
+_tasks = set()  # the event loop only keeps weak references to tasks
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="imagegen")
+
+
+def _forget_old_jobs():
+    cutoff = time.time() - JOB_RETENTION
+    for job_id in [job_id for job_id, job in _jobs.items() if job.finished and job.finished < cutoff]:
+        del _jobs[job_id]
+
+
+async def _execute(job):
+    loop = asyncio.get_running_loop()
+
+    def on_progress(update):
+        # Called from the generation thread; hand the update to the event loop
+        loop.call_soon_threadsafe(job.add_event, {"type": "progress", **sanitize_for_json(update)})
+
+    def started():
+        job.status = "running"
+        job.add_event({"type": "status", "status": "running"})
+
+    def run():
+        # Jobs stay "queued" while they wait for a free executor thread
+        loop.call_soon_threadsafe(started)
+        with listening(on_progress):
+            return run_job(job.generator, job.params)
+
+    try:
+        record = await loop.run_in_executor(_executor, run)
+        job.result = sanitize_for_json(record)
+        job.status = "succeeded"
+    except Exception as e:
+        job.error = str(e)
+        job.status = "failed"
+    job.finished = time.time()
+    job.add_event({"type": "status", "status": job.status, "error": job.error})
+
+
+async def submit_job(request):
+    generator = request.path_params["generator"]
+    if generator not in GENERATORS:
+        return JSONResponse({"error": f"Unknown generator '{generator}'"}, status_code=404)
+    try:
+        params = await request.json() if await request.body() else {}
+        if not isinstance(params, dict):
+            raise ValueError("Request body must be a JSON object of job parameters")
+        resolve_params(generator, params)
+        # API callers only get to read what was uploaded, not arbitrary server paths
+        params = restrict_inputs(generator, params)
+    except (ValueError, json.JSONDecodeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    _forget_old_jobs()
+    job = ServiceJob(generator, params)
+    _jobs[job.id] = job
+    task = asyncio.get_running_loop().create_task(_execute(job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return JSONResponse({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }, status_code=202)
+
+
+async def get_job(request):
+    job = _jobs.get(request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def job_events(request):
+    job = _jobs.get(request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Unknown job"}, status_code=404)
+
+    async def stream():
+        sent = 0
+        while True:
+            while sent < len(job.events):
+                yield f"data: {json.dumps(job.events[sent])}\n\n"
+                sent += 1
+            if job.finished:
+                return
+            try:
+                await asyncio.wait_for(job.changed.wait(), SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def health(request):
+    running = sum(1 for job in _jobs.values() if job.status == "running")
+    return JSONResponse({"status": "ok", "jobs": len(_jobs), "running": running})
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+app = Starlette(routes=[
+    Route("/health", health),
+    Route("/metrics", metrics_endpoint),
+    Route("/jobs/{generator}", submit_job, methods=["POST"]),
+    Route("/jobs/{job_id}", get_job),
+    Route("/jobs/{job_id}/events", job_events),
+])
+
+
+def serve(host="127.0.0.1", port=8000):
+    """Run the service with uvicorn"""
+    import uvicorn
+    uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,52 @@
+import threading
+
+# Request coalescing for identical in-flight calls.
+# The first caller for a key runs the call; callers arriving with the same key
+# while it is in flight wait for it and share its result (or its exception).
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """
+        Return fn() for key, running it only once for all concurrent callers.
+        Returns (result, shared) where shared is True for callers that waited
+        on another caller's execution.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
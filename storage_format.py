@@ -0,0 +1,184 @@
+import os
+import tempfile
+import threading
+import metrics
+from concurrency import background_pool
+
+# Optional storage format for saved outputs.
+#
+# Providers mostly return PNGs of several MB. With IMAGEGEN_STORAGE_FORMAT set,
+# every downloaded output is re-encoded right after it is saved:
+#   original       keep what the server sent (default)
+#   webp           lossy WebP at IMAGEGEN_STORAGE_QUALITY (default 90)
+#   webp-lossless  lossless WebP, pixel-identical to a PNG and usually much smaller
+#   avif           lossy AVIF at IMAGEGEN_STORAGE_QUALITY (needs Pillow 11.2+ or pillow-avif-plugin)
+# Encoding runs in a process pool, so it doesn't hold the GIL of the download
+# threads. The re-encoded file keeps the content-hash name of the download with
+# the new extension, and the original is removed. When re-encoding doesn't make
+# the file smaller (e.g. lossless WebP of a JPEG), and for animations, the
+# original is kept.
+#
+# Needs Pillow.
+
+FORMATS = {
+    "webp": (".webp", "WEBP"),
+    "webp-lossless": (".webp", "WEBP"),
+    "avif": (".avif", "AVIF"),
+}
+DEFAULT_QUALITY = 90
+WORKERS = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+_unsupported_warned = set()
+_target_locks = {}
+_target_locks_lock = threading.Lock()
+
+
+def check_storage_format():
+    """
+    Return (format name, quality) from the environment, or None to keep originals.
+    Raises ValueError for unknown values; call it at startup to fail early.
+    """
+    name = os.getenv("IMAGEGEN_STORAGE_FORMAT", "original").strip().lower()
+    if name in ("", "original"):
+        return None
+    if name not in FORMATS:
+        raise ValueError(f"Unknown IMAGEGEN_STORAGE_FORMAT '{name}', use one of: original, {', '.join(FORMATS)}")
+    quality = os.getenv("IMAGEGEN_STORAGE_QUALITY", str(DEFAULT_QUALITY))
+    if not quality.strip().isdigit() or not 0 <= int(quality) <= 100:
+        raise ValueError(f"IMAGEGEN_STORAGE_QUALITY must be a number from 0 to 100, not '{quality}'")
+    return name, int(quality)
+
+
+def storage_format():
+    """check_storage_format for the save path: invalid settings keep originals (with one warning) instead of raising"""
+    try:
+        return check_storage_format()
+    except ValueError as e:
+        if "invalid" not in _unsupported_warned:
+            _unsupported_warned.add("invalid")
+            print(f"{e}; keeping original files.")
+        return None
+
+
+def _encoder_available(name):
+    from PIL import features
+    if name == "avif":
+        if features.check("avif"):
+            return True
+        try:
+            import pillow_avif  # noqa: F401  registers the AVIF plugin
+            return True
+        except ImportError:
+            return False
+    return features.check("webp")
+
+
+def reencode(source, target, name, quality=DEFAULT_QUALITY):
+    """
+    Write source to target in the given storage format, keeping its EXIF and ICC
+    profile. Runs in a worker process. Returns the size of target, or None (and
+    writes nothing) for animations and when it would not be smaller.
+    """
+    from PIL import Image
+
+    _, pil_format = FORMATS[name]
+    if name == "avif":
+        _encoder_available(name)  # the plugin has to be imported in the worker too
+    with Image.open(source) as image:
+        if getattr(image, "is_animated", False):
+            return None  # only the first frame would be written; keep the animation as it is
+        image.load()
+        metadata = {key: image.info[key] for key in ("exif", "icc_profile") if image.info.get(key)}
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        options = {"lossless": True, "quality": 100, "method": 4} if name == "webp-lossless" else {"quality": quality}
+        if name == "webp":
+            options["method"] = 4
+        options.update(metadata)
+
+        folder = os.path.dirname(target) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".encode_", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, pil_format, **options)
+            size = os.path.getsize(tmp_path)
+            if size >= os.path.getsize(source):
+                os.remove(tmp_path)
+                return None
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return size
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = background_pool(WORKERS)
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _lock_for(target):
+    """One lock per target file, so concurrent saves of the same content encode it once"""
+    with _target_locks_lock:
+        return _target_locks.setdefault(target, threading.Lock())
+
+
+def apply_storage_format(filepath):
+    """
+    Re-encode a freshly saved output to the configured storage format.
+    Returns the path to use from now on: the re-encoded file, or filepath when
+    no format is configured, the encoder is missing or re-encoding didn't help.
+    """
+    policy = storage_format()
+    if policy is None:
+        return filepath
+    name, quality = policy
+    extension, _ = FORMATS[name]
+    stem, current = os.path.splitext(filepath)
+    if current.lower() == extension:
+        return filepath  # already stored in the target format
+    target = stem + extension
+    with _lock_for(target):
+        if os.path.exists(target):
+            # The same download was re-encoded before
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return target
+        return _reencode_output(filepath, target, name, quality)
+
+
+def _reencode_output(filepath, target, name, quality):
+    try:
+        import importlib.util
+        if importlib.util.find_spec("PIL") is None or not _encoder_available(name):
+            if name not in _unsupported_warned:
+                _unsupported_warned.add(name)
+                print(f"No {name} encoder available (install Pillow with {name} support); keeping original files.")
+            return filepath
+        original_size = os.path.getsize(filepath)
+        with metrics.span("reencode"):
+            size = _get_executor().submit(reencode, filepath, target, name, quality).result()
+    except Exception as e:
+        from concurrent.futures.process import BrokenProcessPool
+        if isinstance(e, BrokenProcessPool):
+            _reset_executor()  # a worker died; start a fresh pool for the next output
+        print(f"Could not re-encode {filepath} to {name}: {e}")
+        return filepath
+    if size is None:
+        return filepath
+    os.remove(filepath)
+    metrics.increment("imagegen_storage_bytes_saved_total", original_size - size)
+    return target
@@ -0,0 +1,244 @@
+import os
+import json
+import math
+import tempfile
+import itertools
+from datetime import datetime
+from jobs import GENERATORS, JOB_DEFAULTS, load_generator, resolve_params, run_job
+from job_queue import default_idempotency_key
+from concurrency import run_bounded
+from log_store import sanitize_for_json
+
+# Parameter sweeps: expand a spec into a grid of jobs, run them concurrently
+# and write a contact sheet (one grid image) plus a manifest of every cell.
+#
+# Example spec (YAML or JSON):
+#
+#   name: clay-portraits
+#   generator: face-to-many
+#   params:
+#     image: me.jpg
+#     prompt: "a {subject}, studio lighting"
+#   matrix:
+#     style: all                # every option of the generator's style menu
+#     seed: [1, 2, 3]
+#     subject: [person, wizard] # not a job parameter: fills {subject} in string params
+#   concurrency: 4
+#
+# Combinations that resolve to the same job parameters run once. Cells that
+# already succeeded in an earlier run of the same sweep are reused as long as
+# their images still exist, and seeded jobs hit the result cache, so re-running
+# a grown sweep only pays for the new cells.
+
+SWEEP_FOLDER = "all_output/sweeps"
+THUMB_SIZE = 256
+LABEL_HEIGHT = 36
+
+# Job parameter -> script constant listing its menu options, for "all" in a matrix
+ALL_CHOICES = {
+    "flux": {"image_size": "IMAGE_SIZES"},
+    "photomaker": {"style_name": "STYLES"},
+    "face-to-many": {"style": "STYLES"},
+    "logo": {"style_suffix": "STYLE_SUFFIXES"},
+}
+
+
+class _KeepMissing(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+def load_spec(path):
+    """Read a sweep spec from a YAML or JSON file"""
+    with open(path, 'r') as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        import yaml  # PyYAML is only needed for YAML specs
+        spec = yaml.safe_load(text)
+    else:
+        spec = json.loads(text)
+    if not isinstance(spec, dict) or spec.get("generator") not in GENERATORS:
+        raise ValueError(f"Sweep spec {path} needs a 'generator' key, one of: {', '.join(GENERATORS)}")
+    spec.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    return spec
+
+
+def _axis_values(generator, name, values):
+    if values == "all":
+        constant = ALL_CHOICES.get(generator, {}).get(name)
+        if constant is None:
+            raise ValueError(f"'all' is not available for {generator} parameter '{name}'")
+        return list(getattr(load_generator(generator), constant))
+    return values if isinstance(values, list) else [values]
+
+
+def expand(spec):
+    """
+    Expand a spec into its grid of cells, in matrix order.
+    Each cell is a dict with 'axes' (the combination) and 'params' (resolved job parameters).
+    Matrix keys that are not job parameters are template variables for the string parameters.
+    """
+    generator = spec["generator"]
+    base = dict(spec.get("params") or {})
+    matrix = spec.get("matrix") or {}
+    names = list(matrix)
+    axes = [_axis_values(generator, name, matrix[name]) for name in names]
+
+    cells = []
+    for combination in itertools.product(*axes):
+        values = dict(zip(names, combination))
+        params = dict(base)
+        variables = {}
+        for name, value in values.items():
+            if name in JOB_DEFAULTS[generator]:
+                params[name] = value
+            else:
+                variables[name] = value
+        if variables:
+            params = {
+                k: v.format_map(_KeepMissing(variables)) if isinstance(v, str) else v
+                for k, v in params.items()
+            }
+        cells.append({"axes": values, "params": resolve_params(generator, params)})
+    return cells
+
+
+def _write_json(path, data):
+    folder = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(sanitize_for_json(data), f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _record_outputs(record):
+    outputs = record.get("output_images")
+    if outputs is None:
+        outputs = [record.get("output_image")]
+    return [path for path in outputs if path]
+
+
+def _previous_results(manifest_path):
+    """job_key -> cell of an earlier run whose images are all still on disk"""
+    try:
+        with open(manifest_path, 'r') as f:
+            previous = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return {
+        cell["job_key"]: cell for cell in previous.get("cells", [])
+        if cell.get("status") == "succeeded" and cell.get("outputs")
+        and all(os.path.exists(path) for path in cell["outputs"])
+    }
+
+
+def run_sweep(spec, concurrency=None, sweep_folder=None, use_cache=True, columns=None):
+    """
+    Run every cell of a sweep and return the manifest.
+    :param spec: Sweep spec dict (see load_spec)
+    :param concurrency: Jobs run at the same time (default: spec's 'concurrency' or 4)
+    :param sweep_folder: Where images, manifest.json and contact_sheet.jpg go
+    :param columns: Contact sheet columns (default: size of the last matrix axis)
+    """
+    generator = spec["generator"]
+    concurrency = concurrency or spec.get("concurrency") or 4
+    sweep_folder = sweep_folder or os.path.join(SWEEP_FOLDER, spec["name"])
+    image_folder = os.path.join(sweep_folder, "images")
+    manifest_path = os.path.join(sweep_folder, "manifest.json")
+    os.makedirs(image_folder, exist_ok=True)
+
+    cells = expand(spec)
+    previous = _previous_results(manifest_path)
+    jobs = {}  # job_key -> resolved params, one entry per distinct job
+    for index, cell in enumerate(cells):
+        key = default_idempotency_key(generator, cell["params"])
+        cell.update(index=index, job_key=key, status="pending", outputs=[], request_id=None, error=None,
+                    reused=False)
+        if key in previous:
+            cell.update(status="succeeded", outputs=previous[key]["outputs"],
+                        request_id=previous[key].get("request_id"), reused=True)
+        elif key not in jobs:
+            jobs[key] = cell["params"]
+
+    manifest = {
+        "name": spec["name"],
+        "generator": generator,
+        "spec": spec,
+        "created": datetime.now().isoformat(),
+        "cells": cells,
+        "contact_sheet": None,
+    }
+    print(f"Sweep '{spec['name']}': {len(cells)} cells, {len(jobs)} jobs to run "
+          f"({len(cells) - len(jobs)} reused or duplicate), {concurrency} at a time")
+    _write_json(manifest_path, manifest)
+
+    def run_one(key):
+        params = dict(jobs[key], use_cache=use_cache)
+        return run_job(generator, params, image_folder)
+
+    done = 0
+    for key, record, error in run_bounded(run_one, list(jobs), concurrency):
+        done += 1
+        for cell in cells:
+            if cell["job_key"] != key:
+                continue
+            if error is None:
+                cell.update(status="succeeded", outputs=_record_outputs(record), request_id=record.get("request_id"))
+            else:
+                cell.update(status="failed", error=str(error))
+        print(f"[{done}/{len(jobs)}] {'failed: ' + str(error) if error else 'done'}")
+        # Rewritten as cells finish, so an interrupted sweep resumes where it stopped
+        _write_json(manifest_path, manifest)
+
+    if columns is None and spec.get("matrix"):
+        last_axis = list(spec["matrix"])[-1]
+        columns = len({json.dumps(cell["axes"][last_axis], default=str) for cell in cells})
+    manifest["contact_sheet"] = write_contact_sheet(cells, os.path.join(sweep_folder, "contact_sheet.jpg"), columns)
+    _write_json(manifest_path, manifest)
+
+    failed = sum(1 for cell in cells if cell["status"] == "failed")
+    print(f"Sweep finished: {len(cells) - failed} cells succeeded, {failed} failed. Manifest: {manifest_path}")
+    return manifest
+
+
+def _cell_label(cell):
+    return ", ".join(f"{name}={value if value != '' else 'default'}" for name, value in cell["axes"].items())
+
+
+def write_contact_sheet(cells, path, columns=None, thumb_size=THUMB_SIZE):
+    """
+    Draw every cell's first image in a labelled grid and save it to path.
+    Returns the path, or None when Pillow is not installed.
+    """
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        print("Pillow is not installed; skipping the contact sheet (the manifest lists every image).")
+        return None
+
+    columns = max(1, columns or math.ceil(math.sqrt(len(cells))))
+    rows = max(1, math.ceil(len(cells) / columns))
+    sheet = Image.new("RGB", (columns * thumb_size, rows * (thumb_size + LABEL_HEIGHT)), "white")
+    draw = ImageDraw.Draw(sheet)
+
+    for i, cell in enumerate(cells):
+        x = (i % columns) * thumb_size
+        y = (i // columns) * (thumb_size + LABEL_HEIGHT)
+        if cell["outputs"]:
+            try:
+                with Image.open(cell["outputs"][0]) as image:
+                    image.thumbnail((thumb_size, thumb_size))
+                    sheet.paste(image.convert("RGB"), (x + (thumb_size - image.width) // 2, y + (thumb_size - image.height) // 2))
+            except Exception as e:
+                print(f"Could not add {cell['outputs'][0]} to the contact sheet: {e}")
+        else:
+            draw.rectangle([x + 4, y + 4, x + thumb_size - 4, y + thumb_size - 4], outline="red")
+            draw.text((x + 10, y + 10), cell["status"], fill="red")
+        label = _cell_label(cell)
+        chars = thumb_size // 6
+        draw.text((x + 4, y + thumb_size + 2), label[:chars], fill="black")
+        draw.text((x + 4, y + thumb_size + 18), label[chars:2 * chars], fill="black")
+
+    sheet.save(path, "JPEG", quality=85)
+    print(f"Contact sheet saved to {path}")
+    return path
@@ -0,0 +1,274 @@
+import os
+import json
+import tempfile
+import contextlib
+import threading
+from log_store import append_log, read_log, sanitize_for_json
+from concurrency import background_pool
+
+# WebP previews of every saved output, for browsing without decoding originals.
+#
+# Each save_image schedules its file here. Thumbnails are rendered in a
+# process pool (decoding and resizing is CPU bound) in several sizes, under
+#   all_output/.thumbnails/<size>/<path relative to all_output>.webp
+# and every processed output gets a line in all_output/.thumbnails/manifest.jsonl
+# with its mtime, size and perceptual hashes (see perceptual_hash.py).
+# `imagegen.py thumbnails` backfills existing folders and only decodes files
+# that are new or changed since their manifest entry.
+#
+# Needs Pillow with WebP support; set IMAGEGEN_THUMBNAILS=0 to turn it off.
+
+OUTPUT_ROOT = "all_output"
+THUMBNAIL_FOLDER = os.path.join(OUTPUT_ROOT, ".thumbnails")
+MANIFEST_NAME = "manifest.jsonl"
+SIZES = (128, 512)
+WEBP_QUALITY = 80
+WEBP_METHOD = 2  # encoder effort: about twice as fast as the default 4 for near-identical sizes
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".avif", ".gif")
+BACKGROUND_WORKERS = 2  # processes used for thumbnails of freshly saved outputs
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thumbnails_enabled():
+    """False when IMAGEGEN_THUMBNAILS=0 or Pillow is not installed"""
+    if os.getenv("IMAGEGEN_THUMBNAILS", "1").lower() in ("0", "false", "no"):
+        return False
+    import importlib.util
+    return importlib.util.find_spec("PIL") is not None
+
+
+def _source_key(source):
+    """Manifest key of an output: its path relative to the working directory when possible"""
+    source = os.path.normpath(source)
+    if os.path.isabs(source):
+        relative = os.path.relpath(source)
+        if not relative.startswith(".."):
+            return relative
+    return source
+
+
+def thumbnail_paths(source, sizes=SIZES):
+    """Return [(size, thumbnail path)] for an output file"""
+    key = _source_key(source)
+    relative = os.path.relpath(key, OUTPUT_ROOT)
+    if relative.startswith(".."):
+        relative = os.path.join("_external", os.path.basename(key))
+    stem = os.path.splitext(relative)[0]
+    return [(size, os.path.join(THUMBNAIL_FOLDER, str(size), stem + ".webp")) for size in sizes]
+
+
+def render_thumbnails(source, targets, quality=WEBP_QUALITY):
+    """
+    Decode source once and write one WebP thumbnail per (size, path) in targets.
+    Runs in a worker process. Returns the original width and height, plus the
+    perceptual hashes of the largest thumbnail when NumPy is installed.
+    """
+    from PIL import Image, ImageOps
+    import perceptual_hash
+
+    info = {}
+    with Image.open(source) as image:
+        info.update(width=image.size[0], height=image.size[1])
+        largest = max(size for size, _ in targets)
+        image.draft("RGB", (largest, largest))  # JPEG: let the decoder downscale while decoding
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+        # Largest first, each smaller size is resized from the previous one
+        for size, path in sorted(targets, reverse=True):
+            image.thumbnail((size, size), Image.LANCZOS)
+            if "hashes" not in info and perceptual_hash.numpy_available():
+                # Hashing the already downscaled image costs well under a millisecond
+                info["hashes"] = perceptual_hash.image_hashes(image)
+            folder = os.path.dirname(path)
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "WEBP", quality=quality, method=WEBP_METHOD)
+            os.replace(tmp_path, path)
+    return info
+
+
+def _render_job(job):
+    """render_thumbnails for executor.map: never raises, errors are returned"""
+    source, targets = job
+    try:
+        return source, render_thumbnails(source, targets), None
+    except Exception as e:
+        return source, None, str(e)
+
+
+def _record(source, targets, info, error):
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return
+    entry = {
+        "source": _source_key(source),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "thumbnails": {str(size): path for size, path in targets} if error is None else {},
+        "error": error,
+    }
+    if info:
+        entry.update(info)
+    with _manifest_lock(shared=True):
+        append_log(entry, MANIFEST_NAME, THUMBNAIL_FOLDER, fsync=False, max_bytes=0)
+
+
+@contextlib.contextmanager
+def _manifest_lock(shared=False):
+    """
+    Lock on the manifest across processes: appends share it, compaction takes it
+    exclusively so no append lands in the file it is about to replace.
+    Without fcntl (Windows) there is no lock and compaction is best effort.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)
+    with open(os.path.join(THUMBNAIL_FOLDER, MANIFEST_NAME + ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = background_pool(BACKGROUND_WORKERS)
+    return _executor
+
+
+def _is_fresh(source, targets):
+    """True when every thumbnail exists and is newer than source"""
+    try:
+        source_mtime = os.stat(source).st_mtime_ns
+        return all(os.stat(path).st_mtime_ns >= source_mtime for _, path in targets)
+    except OSError:
+        return False
+
+
+def schedule_thumbnails(source, sizes=SIZES):
+    """
+    Queue thumbnail rendering for a newly saved output and return immediately.
+    Outputs whose thumbnails are already up to date (e.g. a re-saved identical
+    image) are skipped. Returns the Future, or None when nothing was queued.
+    """
+    if not source or not thumbnails_enabled():
+        return None
+    targets = thumbnail_paths(source, sizes)
+    if _is_fresh(source, targets):
+        return None
+
+    def done(future):
+        try:
+            _, info, error = future.result()
+        except Exception as e:  # e.g. the worker process died
+            info, error = None, str(e)
+        if error:
+            print(f"Could not create thumbnails for {source}: {error}")
+        _record(source, targets, info, error)
+
+    try:
+        future = _get_executor().submit(_render_job, (source, targets))
+    except Exception as e:
+        # A missing thumbnail must never fail the save itself
+        print(f"Could not queue thumbnails for {source}: {e}")
+        return None
+    future.add_done_callback(done)
+    return future
+
+
+def load_manifest():
+    """Return {source: latest manifest entry}"""
+    return {entry["source"]: entry for entry in read_log(MANIFEST_NAME, THUMBNAIL_FOLDER) if "source" in entry}
+
+
+def compact_manifest():
+    """Rewrite the manifest with one line per output (saves running meanwhile wait for it)"""
+    with _manifest_lock():
+        manifest = load_manifest()
+        fd, tmp_path = tempfile.mkstemp(dir=THUMBNAIL_FOLDER, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            for entry in manifest.values():
+                f.write(json.dumps(sanitize_for_json(entry)) + "\n")
+        os.replace(tmp_path, os.path.join(THUMBNAIL_FOLDER, MANIFEST_NAME))
+
+
+def find_images(folders):
+    """Yield (path, stat) for every image under folders, skipping hidden folders such as .thumbnails"""
+    stack = list(folders)
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith("."):
+                    stack.append(entry.path)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path, entry.stat()
+
+
+def _up_to_date(entry, stat, sizes, need_hashes=False):
+    return (
+        entry is not None
+        and entry.get("error") is None
+        and entry.get("mtime_ns") == stat.st_mtime_ns
+        and entry.get("size") == stat.st_size
+        and all(str(size) in entry.get("thumbnails", {}) for size in sizes)
+        and (not need_hashes or "hashes" in entry)
+    )
+
+
+def backfill(folders=None, sizes=SIZES, max_workers=None, force=False):
+    """
+    Create thumbnails for every image in folders (default: all of all_output).
+    Files whose mtime and size match their manifest entry are skipped without
+    being opened (entries from before NumPy was installed are redone to add
+    their perceptual hashes). Returns (rendered, skipped, failed).
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from perceptual_hash import numpy_available
+
+    folders = folders or [OUTPUT_ROOT]
+    manifest = load_manifest()
+    need_hashes = numpy_available()
+    jobs, skipped = [], 0
+    for path, stat in find_images(folders):
+        if not force and _up_to_date(manifest.get(_source_key(path)), stat, sizes, need_hashes):
+            skipped += 1
+            continue
+        jobs.append((path, thumbnail_paths(path, sizes)))
+
+    print(f"{len(jobs)} images need thumbnails, {skipped} already up to date")
+    rendered = failed = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            # Chunks keep the inter-process overhead small for tens of thousands of files
+            for i, (source, info, error) in enumerate(executor.map(_render_job, jobs, chunksize=16), 1):
+                targets = thumbnail_paths(source, sizes)
+                if error:
+                    failed += 1
+                    print(f"Could not create thumbnails for {source}: {error}")
+                else:
+                    rendered += 1
+                _record(source, targets, info, error)
+                if i % 500 == 0:
+                    print(f"{i}/{len(jobs)} processed")
+
+        # Re-rendered files leave stale lines behind
+        compact_manifest()
+    return rendered, skipped, failed
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import contextlib
+from env import load_env
+from image_encoding import encode_image_to_data_uri, file_digest
+from result_cache import register_input_url
+from singleflight import SingleFlight
+from metrics import span, increment
+
+# Upload-once layer for input images.
+# Each unique input file is pushed to the provider's file API once, and the
+# returned URL is remembered per content hash until it expires. Requests then
+# carry a short URL instead of a multi-megabyte base64 data URI.
+#
+# IMAGEGEN_UPLOADS=inline disables uploading (always send data URIs),
+# IMAGEGEN_UPLOADS=fake uses the local FakeUploader (for tests and offline runs).
+
+INDEX_PATH = os.path.join(".cache", "uploads.json")
+DEFAULT_EXPIRY = 23 * 3600  # Replicate keeps uploaded files for 24 hours
+EXPIRY_MARGIN = 600  # don't hand out URLs that expire within the next 10 minutes
+
+
+class ReplicateUploader:
+    """Upload files through the Replicate files API"""
+
+    def upload(self, image_path):
+        """Upload image_path and return (url, expires_at timestamp)"""
+        load_env()
+        import replicate
+
+        with open(image_path, "rb") as f:
+            uploaded = replicate.files.create(f)
+        expires_at = time.time() + DEFAULT_EXPIRY
+        return uploaded.urls["get"], expires_at
+
+
+class FakeUploader:
+    """Copy files into a local folder and return file:// URLs, standing in for a provider"""
+
+    def __init__(self, folder=os.path.join(".cache", "fake_uploads"), expiry=DEFAULT_EXPIRY):
+        self.folder = folder
+        self.expiry = expiry
+        self.uploads = 0
+
+    def upload(self, image_path):
+        """Copy image_path and return (url, expires_at timestamp)"""
+        os.makedirs(self.folder, exist_ok=True)
+        target = os.path.join(self.folder, file_digest(image_path) + os.path.splitext(image_path)[1].lower())
+        shutil.copyfile(image_path, target)
+        self.uploads += 1
+        return "file://" + os.path.abspath(target), time.time() + self.expiry
+
+
+class UploadCache:
+    """
+    Remembers the provider URL of every uploaded file, keyed on content hash.
+    Concurrent requests for the same file share one upload, and the index on
+    disk is merged (under a file lock) with what other processes added.
+    """
+
+    def __init__(self, uploader, index_path=INDEX_PATH):
+        self.uploader = uploader
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.flight = SingleFlight()
+        self.index = self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        """Exclusive lock on the index across processes (none without fcntl)"""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        with open(self.index_path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _merge(self, index, extra):
+        """Entries of both indexes that haven't expired, the later expiry winning"""
+        now = time.time()
+        merged = {d: e for d, e in index.items() if e["expires_at"] > now}
+        for digest, entry in extra.items():
+            if entry["expires_at"] > now and entry["expires_at"] > merged.get(digest, {"expires_at": 0})["expires_at"]:
+                merged[digest] = entry
+        return merged
+
+    def _save(self):
+        """Merge the in-memory index with the one on disk and write the result back"""
+        folder = os.path.dirname(self.index_path) or "."
+        os.makedirs(folder, exist_ok=True)
+        with self._file_lock():
+            with self.lock:
+                self.index = self._merge(self._load(), self.index)
+                index = dict(self.index)
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def _live_url(self, digest):
+        with self.lock:
+            entry = self.index.get(digest)
+        if entry and entry["expires_at"] - EXPIRY_MARGIN > time.time():
+            return entry["url"]
+        return None
+
+    def url_for(self, image_path):
+        """Return a live URL for image_path, uploading it only if no unexpired upload exists"""
+        digest = file_digest(image_path)
+        url = self._live_url(digest)
+        if url is None:
+            url, _ = self.flight.do(digest, lambda: self._upload(image_path, digest))
+        register_input_url(url, digest)
+        return url
+
+    def _upload(self, image_path, digest):
+        # Another worker process may have uploaded it since the index was loaded
+        disk_index = self._load()
+        with self.lock:
+            self.index = self._merge(self.index, disk_index)
+        url = self._live_url(digest)
+        if url is not None:
+            return url
+
+        with span("upload"):
+            url, expires_at = self.uploader.upload(image_path)
+        increment("imagegen_upload_bytes_total", os.path.getsize(image_path))
+        with self.lock:
+            self.index[digest] = {"url": url, "expires_at": expires_at}
+        self._save()
+        return url
+
+
+_upload_cache = None
+
+
+def get_upload_cache():
+    """Return the process-wide UploadCache for the configured uploader, or None when uploads are off"""
+    global _upload_cache
+    mode = os.getenv("IMAGEGEN_UPLOADS", "replicate").lower()
+    if mode == "inline":
+        return None
+    if _upload_cache is None:
+        uploader = FakeUploader() if mode == "fake" else ReplicateUploader()
+        _upload_cache = UploadCache(uploader)
+    return _upload_cache
+
+
+def image_reference(image_path):
+    """
+    Return what to send to the provider for an input image:
+    an uploaded file URL when possible, otherwise an inline data URI.
+    """
+    upload_cache = get_upload_cache()
+    if upload_cache is not None:
+        try:
+            return upload_cache.url_for(image_path)
+        except Exception as e:
+            print(f"Upload of {os.path.basename(image_path)} failed, sending it inline: {e}")
+    return encode_image_to_data_uri(image_path)
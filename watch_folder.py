@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from jobs import UPLOAD_FOLDER, INPUT_PARAMS, resolve_params
+import job_queue
+
+# Watch-folder mode: hands-off processing of new uploads.
+#
+# Watches images_to_upload (inotify through watchdog when it is installed,
+# otherwise polling) and enqueues a preset of jobs into the persistent queue
+# for every new input:
+#   - every image directly in the folder, for the preset's image jobs
+#     (face-to-many, sticker)
+#   - every subfolder of images, for the preset's folder jobs (photomaker)
+# Inputs are only enqueued once they have stopped changing for settle_seconds,
+# so half-copied files are never picked up. Processed inputs are kept in an
+# index (.cache/watch_index.json) with their size and mtime: a restart only
+# enqueues what is new or changed, and polling only rescans directories whose
+# mtime changed. Run `imagegen.py worker` alongside to process the queue.
+#
+# Example preset (YAML or JSON):
+#
+#   settle_seconds: 2
+#   jobs:
+#     - generator: face-to-many
+#       style: Clay
+#     - generator: sticker
+#       prompt: cartoon
+#     - generator: photomaker
+#       prompt: "A photo of a person img, as an astronaut"
+
+INDEX_PATH = os.path.join(".cache", "watch_index.json")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+PARTIAL_SUFFIXES = (".part", ".tmp", ".crdownload", ".download", "~")
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 1.0
+
+
+def load_preset(path):
+    """Read a watch preset from a YAML or JSON file and check its jobs"""
+    with open(path, 'r') as f:
+        text = f.read()
+    if path.endswith((".yaml", ".yml")):
+        import yaml  # PyYAML is only needed for YAML presets
+        preset = yaml.safe_load(text)
+    else:
+        preset = json.loads(text)
+    if isinstance(preset, list):
+        preset = {"jobs": preset}
+
+    jobs = []
+    for job in preset.get("jobs") or []:
+        job = dict(job)
+        generator = job.pop("generator", None)
+        if generator not in INPUT_PARAMS:
+            raise ValueError(f"Watch jobs need a generator that takes an uploaded input: {', '.join(INPUT_PARAMS)}")
+        params = dict(job.pop("params", job))
+        params[INPUT_PARAMS[generator]] = "placeholder"
+        resolve_params(generator, params)  # fail on unknown parameters now, not in the worker
+        del params[INPUT_PARAMS[generator]]
+        jobs.append((generator, params))
+    if not jobs:
+        raise ValueError(f"Watch preset {path} has no jobs")
+    preset["jobs"] = jobs
+    return preset
+
+
+def _is_candidate(name):
+    return not name.startswith(".") and not name.endswith(PARTIAL_SUFFIXES)
+
+
+def _is_image(name):
+    return _is_candidate(name) and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def input_signature(path):
+    """
+    (size, mtime_ns) of an image, or for a subfolder a digest of the names,
+    sizes and mtimes of its images. None when there is nothing to process.
+    """
+    try:
+        if not os.path.isdir(path):
+            stat = os.stat(path)
+            return [stat.st_size, stat.st_mtime_ns]
+        with os.scandir(path) as entries:
+            files = sorted(
+                (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                for entry in entries if entry.is_file() and _is_image(entry.name)
+            )
+    except OSError:
+        return None
+    if not files:
+        return None
+    return hashlib.sha256(json.dumps(files).encode('utf-8')).hexdigest()
+
+
+def load_index(path=INDEX_PATH):
+    """Return {input path: signature} of the inputs already enqueued"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_index(index, path=INDEX_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+class PollingWatcher:
+    """
+    Fallback watcher without inotify: lists only the directories whose mtime
+    changed since the last poll (adding, removing or renaming a file changes
+    it), and stats the files still settling.
+    """
+
+    def __init__(self, folder, notify):
+        self.folder = folder
+        self.notify = notify
+        self.dir_mtimes = {}
+        self.subfolders = []
+
+    def _changed(self, folder):
+        """Whether folder's mtime changed since the last poll (None once it is gone)"""
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            self.dir_mtimes.pop(folder, None)
+            return None
+        changed = self.dir_mtimes.get(folder) != mtime
+        self.dir_mtimes[folder] = mtime
+        return changed
+
+    def poll(self):
+        if self._changed(self.folder):
+            # The subfolder list is cached: the root is only listed again when its mtime changes
+            subfolders = []
+            try:
+                with os.scandir(self.folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and _is_candidate(entry.name):
+                            subfolders.append(entry.path)
+                        elif entry.is_file():
+                            self.notify(entry.path)
+            except OSError:
+                self.dir_mtimes.pop(self.folder, None)  # list it again next poll
+                return
+            for folder in set(self.subfolders) - set(subfolders):
+                self.dir_mtimes.pop(folder, None)
+            self.subfolders = subfolders
+        for folder in self.subfolders:
+            if self._changed(folder):
+                self.notify(folder)
+
+    def run(self, stop, interval=POLL_INTERVAL):
+        while not stop.is_set():
+            self.poll()
+            stop.wait(interval)
+
+
+def _start_inotify(folder, notify):
+    """Start a watchdog observer on folder, or return None when watchdog is not installed"""
+    try:
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+    except ImportError:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if path:
+                    notify(path)
+
+    observer = Observer()
+    observer.schedule(Handler(), folder, recursive=True)
+    observer.start()
+    return observer
+
+
+class FolderWatcher:
+    """
+    Turn change notifications under folder into queued jobs, once each input has settled.
+    :param preset: Preset dict from load_preset
+    """
+
+    def __init__(self, folder=UPLOAD_FOLDER, preset=None, queue_path=job_queue.QUEUE_PATH,
+                 index_path=INDEX_PATH, settle_seconds=None):
+        self.folder = os.path.normpath(folder)
+        self.jobs = preset["jobs"]
+        self.queue_path = queue_path
+        self.index_path = index_path
+        self.settle_seconds = settle_seconds if settle_seconds is not None else preset.get("settle_seconds", SETTLE_SECONDS)
+        self.index = load_index(index_path)
+        self.pending = {}  # input path -> (signature, time it was last seen changing)
+        self.lock = threading.Lock()
+        self.enqueued = 0
+
+    def _input_for(self, path):
+        """The watched input a changed path belongs to: an image in folder, or a subfolder"""
+        relative = os.path.relpath(os.path.normpath(path), self.folder)
+        if relative.startswith("..") or relative == ".":
+            return None
+        parts = relative.split(os.sep)
+        if not all(_is_candidate(part) for part in parts):
+            return None
+        top = os.path.join(self.folder, parts[0])
+        if len(parts) == 1 and not os.path.isdir(top):
+            return top if _is_image(parts[0]) else None
+        return top
+
+    def notify(self, path):
+        """Record that something under folder changed; safe to call from any thread"""
+        target = self._input_for(path)
+        if target is None:
+            return
+        with self.lock:
+            self.pending[target] = (None, time.monotonic())
+
+    def scan(self):
+        """Queue every input that isn't in the index yet, e.g. uploads made while not watching"""
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    self.notify(entry.path)
+        except FileNotFoundError:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def process_settled(self):
+        """Enqueue the jobs of every pending input that stopped changing; returns how many were enqueued"""
+        now = time.monotonic()
+        with self.lock:
+            pending = list(self.pending.items())
+        ready = []
+        for target, (signature, changed_at) in pending:
+            current = input_signature(target)
+            if current != signature:
+                # Still being written (or just noticed): wait for it to settle
+                with self.lock:
+                    self.pending[target] = (current, now)
+                continue
+            if now - changed_at < self.settle_seconds:
+                continue
+            with self.lock:
+                if self.pending.get(target, (None,))[0] == signature:
+                    del self.pending[target]
+            if current is not None and self.index.get(target) != current:
+                ready.append((target, current))
+
+        for target, signature in ready:
+            self._enqueue(target, signature)
+            self.index[target] = signature
+        if ready:
+            save_index(self.index, self.index_path)
+        return len(ready)
+
+    def _enqueue(self, target, signature):
+        is_folder = os.path.isdir(target)
+        for generator, params in self.jobs:
+            input_param = INPUT_PARAMS[generator]
+            if (input_param == "folder") != is_folder:
+                continue
+            params = dict(params, **{input_param: target})
+            # The input's signature is part of the key: a replaced image or a grown folder runs again
+            key = job_queue.default_idempotency_key(generator, dict(params, input_signature=signature))
+            job_id, created = job_queue.try_enqueue(generator, params, key, path=self.queue_path)
+            if not created:
+                continue  # queued before, e.g. by a watcher whose index was lost
+            self.enqueued += 1
+            print(f"Queued {generator} for {target} (job {job_id})")
+
+    def run(self, stop=None, poll_interval=POLL_INTERVAL, use_inotify=True):
+        """Watch until stop is set (or Ctrl+C)"""
+        stop = stop or threading.Event()
+        self.scan()
+        observer = _start_inotify(self.folder, self.notify) if use_inotify else None
+        poller = None
+        if observer is None:
+            poller = PollingWatcher(self.folder, self.notify)
+            poller.poll()  # remember the current directory mtimes
+            threading.Thread(target=poller.run, args=(stop, poll_interval), daemon=True).start()
+        print(f"Watching {self.folder} ({'inotify' if observer else 'polling'}), "
+              f"{len(self.jobs)} jobs per new input. Press Ctrl+C to stop.")
+        try:
+            while not stop.is_set():
+                self.process_settled()
+                stop.wait(min(0.5, self.settle_seconds / 2 or 0.5))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        return self.enqueued